@@ -0,0 +1,547 @@
+#! /usr/bin/env python
+#
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""A small IRC server to benchmark the bot against.
+
+Real clients (the bot) connect over TCP. Everyone else is a virtual user
+the benchmark drives through L{Server}'s methods: they cost nothing but a
+dict entry, so thousands of them can share a channel with the bot. Lines
+real clients send to virtual users or channels are handed to
+L{Server.observer} instead of being delivered.
+
+Only what the bot uses is implemented: registration with CAP, JOIN, PART,
+QUIT, NICK, PRIVMSG, NOTICE, TOPIC, KICK, channel MODEs (bans and
+prefixes), NAMES and WHO. Bans aren't enforced."""
+
+from time import time
+
+from twisted.internet import protocol
+from twisted.protocols import basic
+from twisted.python import log
+
+SERVER_NAME = 'bench.local'
+CAPABILITIES = ('multi-prefix', 'userhost-in-names')
+PREFIXES = (('o', '@'), ('v', '+'))
+TOPICLEN = 307
+
+def fold(name):
+    return name.lower()
+
+def format_line(prefix, command, *params):
+    """Builds a line, the last parameter being the trailing one"""
+    params = list(params)
+    if params and (' ' in params[-1] or not params[-1]
+            or params[-1][0] == ':'):
+        params[-1] = ':' + params[-1]
+    if prefix:
+        return ' '.join([':' + prefix, command] + params)
+    return ' '.join([command] + params)
+
+def parse_line(line):
+    """@returns: (prefix, command, params)"""
+    prefix = None
+    if line.startswith(':'):
+        prefix, line = line[1:].split(' ', 1)
+    if ' :' in line:
+        line, trailing = line.split(' :', 1)
+        params = line.split() + [trailing]
+    else:
+        params = line.split()
+    return prefix, params[0].upper(), params[1:]
+
+class User:
+    """Someone on the server
+
+    @ivar client: the L{ClientProtocol} of a real client, None for virtual
+        users"""
+
+    def __init__(self, nick, ident, host, client=None):
+        self.nick = nick
+        self.ident = ident
+        self.host = host
+        self.client = client
+        self.channels = set()
+
+    def mask(self):
+        return '%s!%s@%s' % (self.nick, self.ident, self.host)
+
+class Channel:
+    """@ivar members: folded nick -> [L{User}, set of prefix modes]
+    @ivar real: the real clients among the members"""
+
+    def __init__(self, name):
+        self.name = name
+        self.members = {}
+        self.real = set()
+        self.bans = []
+        self.topic = None
+
+    def add(self, user, modes):
+        self.members[fold(user.nick)] = [user, modes]
+        if user.client is not None:
+            self.real.add(user)
+
+    def remove(self, user):
+        del self.members[fold(user.nick)]
+        self.real.discard(user)
+
+    def real_members(self):
+        return list(self.real)
+
+class Server:
+    """The network's state
+
+    @ivar observer: None, or called with (user, prefix, command, params)
+        for every line a real client sends to a virtual user or a channel
+    @ivar op_real_clients: give ops to real clients when they join
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.channels = {}
+        self.observer = None
+        self.op_real_clients = True
+        self.created = time()
+
+    # Virtual users
+
+    def add_user(self, nick, ident, host, client=None):
+        user = self.users[fold(nick)] = User(nick, ident, host, client)
+        return user
+
+    def user(self, nick):
+        return self.users.get(fold(nick))
+
+    def channel(self, name):
+        try:
+            return self.channels[fold(name)]
+        except KeyError:
+            channel = self.channels[fold(name)] = Channel(name)
+            return channel
+
+    def broadcast(self, channel, line, skip=None):
+        """Sends line to the channel's real members"""
+        for user in channel.real_members():
+            if user is not skip:
+                user.client.sendLine(line)
+
+    def neighbours(self, user):
+        """Real clients sharing a channel with user"""
+        seen = {}
+        for name in user.channels:
+            for other in self.channels[name].real_members():
+                if other is not user:
+                    seen[id(other)] = other
+        return seen.values()
+
+    def join(self, user, name, op=False):
+        channel = self.channel(name)
+        key = fold(user.nick)
+        if key in channel.members:
+            return channel
+        modes = set()
+        if op or (user.client is not None and self.op_real_clients):
+            modes.add('o')
+        channel.add(user, modes)
+        user.channels.add(fold(name))
+        self.broadcast(channel, format_line(user.mask(), 'JOIN', channel.name))
+        if 'o' in modes:
+            self.broadcast(channel, format_line(SERVER_NAME, 'MODE',
+                channel.name, '+o', user.nick), skip=user)
+        if user.client is not None:
+            if channel.topic:
+                user.client.numeric('332', channel.name, channel.topic)
+            user.client.names(channel)
+        return channel
+
+    def part(self, user, name, reason=''):
+        channel = self.channels.get(fold(name))
+        if channel is None or fold(user.nick) not in channel.members:
+            return
+        self.broadcast(channel, format_line(user.mask(), 'PART',
+            channel.name, reason))
+        self._leave(user, channel)
+
+    def kick(self, user, name, nick, reason=''):
+        channel = self.channels.get(fold(name))
+        if channel is None or fold(nick) not in channel.members:
+            return
+        victim = channel.members[fold(nick)][0]
+        self.broadcast(channel, format_line(user.mask(), 'KICK',
+            channel.name, victim.nick, reason or user.nick))
+        self._leave(victim, channel)
+
+    def _leave(self, user, channel):
+        channel.remove(user)
+        user.channels.discard(fold(channel.name))
+
+    def quit(self, user, reason=''):
+        line = format_line(user.mask(), 'QUIT', reason)
+        for other in self.neighbours(user):
+            other.client.sendLine(line)
+        for name in list(user.channels):
+            self._leave(user, self.channels[name])
+        self.users.pop(fold(user.nick), None)
+
+    def nick(self, user, newnick):
+        if fold(newnick) in self.users and fold(newnick) != fold(user.nick):
+            return False
+        line = format_line(user.mask(), 'NICK', newnick)
+        for other in self.neighbours(user):
+            other.client.sendLine(line)
+        del self.users[fold(user.nick)]
+        for name in user.channels:
+            members = self.channels[name].members
+            members[fold(newnick)] = members.pop(fold(user.nick))
+        user.nick = newnick
+        self.users[fold(newnick)] = user
+        return True
+
+    def message(self, user, command, target, text):
+        """PRIVMSG or NOTICE from user to a nick or channel"""
+        line = format_line(user.mask(), command, target, text)
+        if target[:1] == '#':
+            channel = self.channels.get(fold(target))
+            if channel is None:
+                return False
+            self.broadcast(channel, line, skip=user)
+            if user.client is not None and self.observer is not None:
+                self.observer(user, user.mask(), command, [target, text])
+            return True
+        other = self.user(target)
+        if other is None:
+            return False
+        if other.client is not None:
+            other.client.sendLine(line)
+        elif user.client is not None and self.observer is not None:
+            self.observer(user, user.mask(), command, [target, text])
+        return True
+
+    def mode(self, user, name, changes, args):
+        """Applies channel mode changes
+
+        @returns: the changes that were applied and their arguments"""
+        channel = self.channels.get(fold(name))
+        if channel is None:
+            return []
+        done, done_args = [], []
+        set_ = True
+        args = list(args)
+        for char in changes:
+            if char in '+-':
+                set_ = char == '+'
+                continue
+            if char == 'b':
+                if not args:
+                    continue
+                mask = arg = args.pop(0)
+                masks = [ban[0] for ban in channel.bans]
+                if set_ and mask not in masks:
+                    channel.bans.append((mask, user.nick, int(time())))
+                elif not set_ and mask in masks:
+                    del channel.bans[masks.index(mask)]
+                else:
+                    continue
+            elif char in dict(PREFIXES):
+                if not args:
+                    continue
+                nick = arg = args.pop(0)
+                member = channel.members.get(fold(nick))
+                if member is None:
+                    continue
+                if set_:
+                    member[1].add(char)
+                else:
+                    member[1].discard(char)
+            else:
+                continue
+            done.append(('+' if set_ else '-') + char)
+            done_args.append(arg)
+        if done:
+            self.broadcast(channel, format_line(user.mask(), 'MODE',
+                channel.name, ''.join(done), *done_args))
+        return zip(done, done_args)
+
+    def set_topic(self, user, name, topic):
+        channel = self.channels.get(fold(name))
+        if channel is None:
+            return
+        channel.topic = topic = topic[:TOPICLEN]
+        self.broadcast(channel, format_line(user.mask(), 'TOPIC',
+            channel.name, topic))
+
+class ClientProtocol(basic.LineOnlyReceiver):
+    """A real client's connection"""
+
+    delimiter = '\n'
+    MAX_LENGTH = 8192
+
+    def connectionMade(self):
+        self.server = self.factory.server
+        self.user = None
+        self.nick = None
+        self.ident = None
+        self.negotiating = False
+        self.caps = set()
+        peer = self.transport.getPeer()
+        self.host = getattr(peer, 'host', 'localhost')
+
+    def connectionLost(self, reason):
+        if self.user is not None:
+            self.server.quit(self.user, "Connection closed")
+            self.user = None
+
+    def sendLine(self, line):
+        basic.LineOnlyReceiver.sendLine(self, line + '\r')
+
+    def numeric(self, code, *params):
+        self.sendLine(format_line(SERVER_NAME, code,
+            self.nick or '*', *params))
+
+    def lineReceived(self, line):
+        line = line.rstrip('\r')
+        if not line:
+            return
+        prefix, command, params = parse_line(line)
+        handler = getattr(self, 'irc_' + command, None)
+        if handler is None:
+            if self.user is not None:
+                self.numeric('421', command, "Unknown command")
+            return
+        if self.user is None and command not in (
+                'CAP', 'NICK', 'USER', 'PASS', 'PING', 'QUIT'):
+            self.numeric('451', "You have not registered")
+            return
+        try:
+            handler(params)
+        except IndexError:
+            self.numeric('461', command, "Not enough parameters")
+
+    # Registration
+
+    def irc_CAP(self, params):
+        sub = params[0].upper()
+        if sub == 'LS':
+            if self.user is None:
+                self.negotiating = True
+            self.sendLine(format_line(SERVER_NAME, 'CAP', self.nick or '*',
+                'LS', ' '.join(CAPABILITIES)))
+        elif sub == 'REQ':
+            wanted = params[1].split()
+            if all(cap.lstrip('-') in CAPABILITIES for cap in wanted):
+                for cap in wanted:
+                    if cap.startswith('-'):
+                        self.caps.discard(cap[1:])
+                    else:
+                        self.caps.add(cap)
+                reply = 'ACK'
+            else:
+                reply = 'NAK'
+            self.sendLine(format_line(SERVER_NAME, 'CAP', self.nick or '*',
+                reply, params[1]))
+        elif sub == 'END':
+            self.negotiating = False
+            self._register()
+
+    def irc_PASS(self, params):
+        pass
+
+    def irc_NICK(self, params):
+        nick = params[0]
+        if self.user is None:
+            if self.server.user(nick) is not None:
+                self.numeric('433', nick, "Nickname is already in use")
+                return
+            self.nick = nick
+            self._register()
+        elif not self.server.nick(self.user, nick):
+            self.numeric('433', nick, "Nickname is already in use")
+        else:
+            self.sendLine(format_line(self.user.mask(), 'NICK', nick))
+            self.nick = nick
+
+    def irc_USER(self, params):
+        self.ident = params[0]
+        self._register()
+
+    def _register(self):
+        if self.user is not None or self.negotiating \
+                or self.nick is None or self.ident is None:
+            return
+        if self.server.user(self.nick) is not None:
+            self.numeric('433', self.nick, "Nickname is already in use")
+            self.nick = None
+            return
+        self.user = self.server.add_user(self.nick, self.ident, self.host, self)
+        self.numeric('001', "Welcome to the bench network %s"
+            % self.user.mask())
+        self.numeric('002', "Your host is %s" % SERVER_NAME)
+        self.numeric('003', "This server was created %d"
+            % self.server.created)
+        self.numeric('004', SERVER_NAME, 'benchircd', 'i', 'bklmnostv')
+        self.numeric('005', 'PREFIX=(%s)%s' % (
+                ''.join(mode for mode, prefix in PREFIXES),
+                ''.join(prefix for mode, prefix in PREFIXES)),
+            'CHANTYPES=#', 'CHANMODES=b,k,l,imnst', 'CASEMAPPING=ascii',
+            'NICKLEN=30', 'NETWORK=Bench', 'TARGMAX=PRIVMSG:4,NOTICE:4',
+            'TOPICLEN=%d' % TOPICLEN, 'USERLEN=10', 'HOSTLEN=63',
+            "are supported by this server")
+        self.numeric('422', "MOTD File is missing")
+
+    # Connection
+
+    def irc_PING(self, params):
+        self.sendLine(format_line(SERVER_NAME, 'PONG', SERVER_NAME,
+            params[0]))
+
+    def irc_PONG(self, params):
+        pass
+
+    def irc_QUIT(self, params):
+        if self.user is not None:
+            self.server.quit(self.user, params[0] if params else '')
+            self.user = None
+        self.transport.loseConnection()
+
+    # Channels
+
+    def irc_JOIN(self, params):
+        for name in params[0].split(','):
+            if name[:1] == '#':
+                self.server.join(self.user, name)
+            else:
+                self.numeric('403', name, "No such channel")
+
+    def irc_PART(self, params):
+        for name in params[0].split(','):
+            if fold(name) in self.user.channels:
+                self.sendLine(format_line(self.user.mask(), 'PART', name))
+            self.server.part(self.user, name,
+                params[1] if len(params) > 1 else '')
+
+    def irc_KICK(self, params):
+        self.server.kick(self.user, params[0], params[1],
+            params[2] if len(params) > 2 else '')
+
+    def irc_TOPIC(self, params):
+        channel = self.server.channels.get(fold(params[0]))
+        if channel is None:
+            self.numeric('403', params[0], "No such channel")
+        elif len(params) > 1:
+            self.server.set_topic(self.user, params[0], params[1])
+        elif channel.topic:
+            self.numeric('332', channel.name, channel.topic)
+        else:
+            self.numeric('331', channel.name, "No topic is set")
+
+    def irc_NAMES(self, params):
+        channel = self.server.channels.get(fold(params[0]))
+        if channel is None:
+            self.numeric('366', params[0], "End of /NAMES list.")
+        else:
+            self.names(channel)
+
+    def names(self, channel):
+        names = []
+        for user, modes in channel.members.itervalues():
+            prefix = ''.join(prefix for mode, prefix in PREFIXES
+                if mode in modes)
+            if 'multi-prefix' not in self.caps:
+                prefix = prefix[:1]
+            if 'userhost-in-names' in self.caps:
+                names.append(prefix + user.mask())
+            else:
+                names.append(prefix + user.nick)
+        line, size = [], 0
+        for name in names:
+            if size + len(name) > 400:
+                self.numeric('353', '=', channel.name, ' '.join(line))
+                line, size = [], 0
+            line.append(name)
+            size += len(name) + 1
+        if line:
+            self.numeric('353', '=', channel.name, ' '.join(line))
+        self.numeric('366', channel.name, "End of /NAMES list.")
+
+    def irc_WHO(self, params):
+        channel = self.server.channels.get(fold(params[0]))
+        if channel is not None:
+            for user, modes in channel.members.itervalues():
+                flags = 'H' + ''.join(prefix for mode, prefix in PREFIXES
+                    if mode in modes)
+                self.numeric('352', channel.name, user.ident, user.host,
+                    SERVER_NAME, user.nick, flags, "0 %s" % user.nick)
+        self.numeric('315', params[0], "End of /WHO list.")
+
+    def irc_MODE(self, params):
+        target = params[0]
+        if target[:1] != '#':
+            return
+        channel = self.server.channels.get(fold(target))
+        if channel is None:
+            self.numeric('403', target, "No such channel")
+        elif len(params) == 1:
+            self.numeric('324', channel.name, '+nt')
+        elif params[1].lstrip('+') == 'b' and len(params) == 2:
+            for mask, setter, when in channel.bans:
+                self.numeric('367', channel.name, mask, setter, str(when))
+            self.numeric('368', channel.name, "End of channel ban list")
+        else:
+            self.server.mode(self.user, target, params[1], params[2:])
+
+    # Messages
+
+    def irc_PRIVMSG(self, params):
+        for target in params[0].split(',')[:4]:
+            if not self.server.message(self.user, 'PRIVMSG', target,
+                    params[1]):
+                self.numeric('401', target, "No such nick/channel")
+
+    def irc_NOTICE(self, params):
+        for target in params[0].split(',')[:4]:
+            self.server.message(self.user, 'NOTICE', target, params[1])
+
+class ServerFactory(protocol.ServerFactory):
+    protocol = ClientProtocol
+
+    def __init__(self, server=None):
+        self.server = server or Server()
+
+def listen(reactor, port=0, interface='127.0.0.1', server=None):
+    """Starts a server
+
+    @returns: (L{Server}, listening port)"""
+    factory = ServerFactory(server)
+    return factory.server, reactor.listenTCP(port, factory,
+        interface=interface)
+
+if __name__ == '__main__':
+    import sys
+    from twisted.internet import reactor
+    log.startLogging(sys.stdout)
+    server, port = listen(reactor,
+        int(sys.argv[1]) if len(sys.argv) > 1 else 6667)
+    log.msg("Listening on port %d" % port.getHost().port)
+    reactor.run()
@@ -0,0 +1,114 @@
+#! /usr/bin/env python
+#
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Measures how many channel messages per second the bot can process.
+
+Feeds a mix of channel chatter, mentions and commands to the bot's
+privmsg handler, with no network involved. Run it from the top directory:
+
+    python bench/lineprocessor.py [seconds per case]
+
+Run it against an older checkout to compare."""
+
+import os
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pypickupbot import i18n
+from pypickupbot import config
+from pypickupbot.irc import IrcBot, COMMAND
+from twisted.words.protocols import irc
+
+class FakeFactory:
+    nickname = 'pypickupbot'
+    channels = ['#pickup']
+
+def make_bot():
+    config._parser.readfp(open(os.path.join(
+        os.path.dirname(config.__file__), 'defaults.cfg')))
+    config.set('Bot', 'allow mentions', 'yes')
+    config.set('Bot', 'warn on unknown command', 'no')
+
+    bot = IrcBot()
+    bot.factory = FakeFactory()
+    bot.supported = irc.ServerSupportedFeatures()
+    # our hostmask is unknown, pages assume the longest one allowed
+    bot.supported.parse(['USERLEN=10', 'HOSTLEN=63'])
+    bot.prompts = {'PM': {}, '#pickup': {}}
+    bot.more_buffer = {}
+    bot.sent = 0
+
+    def notice(user, message):
+        bot.sent += 1
+    bot.notice = notice
+    bot.msg = notice
+
+    def who(call, args):
+        call.reply("nobody")
+    def pull(call, args):
+        call.reply("pulled")
+
+    bot.commands = {
+        'who': (who, 0),
+        'pull': (pull, COMMAND.ADMIN | COMMAND.NOT_FROM_PM),
+    }
+    bot.eventhandlers['is_admin'] = [lambda user, nick, channel: nick == 'admin']
+    return bot
+
+cases = [
+    ('chatter', '#pickup', "anyone up for a game of ctf tonight?"),
+    ('mention', '#pickup', "pypickupbot: who"),
+    ('command', '#pickup', "!who"),
+    ('admin command', '#pickup', "!pull someone"),
+    ('unknown command', '#pickup', "!nosuchcommand"),
+]
+
+def run(bot, channel, message, duration):
+    user = 'admin!admin@example.org'
+    n = 0
+    start = time()
+    end = start + duration
+    while time() < end:
+        for i in xrange(1000):
+            bot.privmsg_(user, channel, message)
+        n += 1000
+    return n / (time() - start)
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    bot = make_bot()
+    mix = []
+    for name, channel, message in cases:
+        rate = run(bot, channel, message, duration)
+        mix.append(rate)
+        print("{0:>16}: {1:>10.0f} msgs/s".format(name, rate))
+    # A busy channel is mostly chatter
+    weights = [.9, .02, .05, .01, .02]
+    mixed = 1 / sum(w / r for w, r in zip(weights, mix))
+    print("{0:>16}: {1:>10.0f} msgs/s".format('90% chatter mix', mixed))
+
+if __name__ == '__main__':
+    main()
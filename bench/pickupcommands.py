@@ -0,0 +1,143 @@
+#! /usr/bin/env python
+#
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+
+"""Measures how fast the pickup module's commands run.
+
+Runs !who, !add and !remove, full games (two players adding up for a
+duel, which starts it) and topic rendering against the real pickup
+module, with no network or database involved. Message templates and
+other settings are read on each of these, so this is where reading the
+configuration shows. Run it from the top directory:
+
+    python bench/pickupcommands.py [seconds per case]
+
+Run it against an older checkout to compare."""
+
+import os
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.internet import defer
+from twisted.words.protocols.irc import ServerSupportedFeatures
+
+from pypickupbot import i18n
+from pypickupbot import config
+from pypickupbot import db
+from pypickupbot.irc import IrcBot
+
+class FakeFactory:
+    nickname = 'pypickupbot'
+    channels = ['#pickup']
+
+class FakeDB:
+    """Answers right away, as if every table were empty"""
+    def runOperation(self, *args, **kwargs):
+        return defer.succeed(None)
+    def runQuery(self, *args, **kwargs):
+        return defer.succeed([])
+    def runInteraction(self, *args, **kwargs):
+        return defer.succeed({})
+
+def make_bot():
+    config._parser.readfp(open(os.path.join(
+        os.path.dirname(config.__file__), 'defaults.cfg')))
+    config.set('Bot', 'user command interval', '0')
+    config.set('Bot', 'global command interval', '0')
+    config.set('Bot', 'warn on unknown command', 'no')
+    config.set('Server', 'channels', '#pickup')
+    db.DBs.db = FakeDB()
+
+    bot = IrcBot()
+    bot.factory = FakeFactory()
+    bot.supported = ServerSupportedFeatures()
+    bot.home_channels = FakeFactory.channels
+    bot.channel = '#pickup'
+    bot.prompts = {'PM': {}}
+    bot.more_buffer = {}
+    bot.startup = {'connected': time()}
+    bot.sent = 0
+    def send(*args):
+        bot.sent += 1
+    bot.notice = bot.msg = bot.setTopic = send
+    bot.sendLine = send
+
+    bot.preload_modules()
+    bot.load_module_config(['pickup'])
+    for section, option, value in [
+            ('Pickup games', 'ctf', 'Capture the flag'),
+            ('Pickup games', 'tdm', 'Team deathmatch'),
+            ('Pickup games', 'duel', 'Duel'),
+            ('Pickup: duel', 'captains', '0'),
+            ('Pickup: duel', 'players', '2'),
+            ('Pickup: duel', 'teamnames', 'Player 1, Player 2'),
+            ('Pickup', 'PM each player on start', 'yes'),
+            ]:
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, option, value)
+    pickup = bot.load('pickup').instances[0]
+    bot.notify('joined', '#pickup')
+    for i in range(6):
+        pickup.games['ctf'].players.append('player%d' % i)
+    return bot, pickup
+
+def run(func, duration):
+    n = 0
+    start = time()
+    end = start + duration
+    while time() < end:
+        for i in xrange(100):
+            func()
+        n += 100
+    return n / (time() - start)
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    bot, pickup = make_bot()
+
+    def who():
+        bot.privmsg_('alice!a@example.org', '#pickup', '!who')
+    def add_remove():
+        bot.privmsg_('alice!a@example.org', '#pickup', '!add ctf tdm')
+        bot.privmsg_('alice!a@example.org', '#pickup', '!remove')
+    def game():
+        bot.privmsg_('alice!a@example.org', '#pickup', '!add duel')
+        bot.privmsg_('bob!b@example.org', '#pickup', '!add duel')
+    def topic():
+        pickup.update_topic()
+        str(bot.topics['#pickup'])
+
+    for name, func in [
+            ('who', who),
+            ('add and remove', add_remove),
+            ('duel game', game),
+            ('topic', topic),
+            ]:
+        rate = run(func, duration)
+        print("{0:>16}: {1:>8.0f}/s {2:>8.1f}us each".format(
+            name, rate, 1e6 / rate))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,454 @@
+#! /usr/bin/env python
+#
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Measures how the bot copes with a busy channel, end to end.
+
+Starts the server from L{ircd}, fills a channel with simulated users and
+runs the bot in its own process against it, as it would run in
+production. The users then join, leave, rename, get split from the
+network, sign up and remove themselves from games and get banned, at the
+given rate. Everything runs locally; Linux is needed to read the bot's
+CPU time and memory. Run it from the top directory:
+
+    python bench/swarm.py --users 5000 --rate 50 --duration 60
+
+Each command is followed by a CTCP PING from the same user. Its latency is
+the time until the bot's first line to that user, which is either the
+command's reply or, if it had nothing to say, the PING's answer."""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+from collections import OrderedDict
+from time import time
+
+from twisted.internet import reactor, protocol, task
+from twisted.python import usage
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import ircd
+
+TOP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+INIT_CFG = """[Bot]
+nickname=%(nickname)s
+user command interval=0
+global command interval=0
+warn on unknown command=no
+
+[Server]
+host=127.0.0.1
+port=%(port)d
+channels=%(channel)s
+line interval=%(line interval)s
+
+[Modules]
+modules=ban, chanops, help, pickup, pickup_playertracking, status, topic
+"""
+
+CONFIG_CFG = """[Pickup]
+implicit all games in add=no
+topic=2
+
+[Pickup games]
+ctf=CTF
+tdm=TDM
+duel=Duel
+
+[Pickup: duel]
+captains=0
+players=2
+"""
+
+# What users do, and how often
+ACTIONS = [
+    ('add', 40),
+    ('remove', 20),
+    ('who', 8),
+    ('chatter', 12),
+    ('churn', 10),
+    ('rename', 8),
+    ('ban', 2),
+]
+
+GAMES = ['ctf', 'tdm', 'duel']
+
+class Options(usage.Options):
+    optParameters = [
+        ['users', 'u', 5000, "Users in the channel", int],
+        ['admins', 'a', 3, "Channel operators among the users", int],
+        ['rate', 'r', 50.0, "Actions per second", float],
+        ['duration', 't', 60.0, "Seconds to run for", float],
+        ['netsplit', 'n', 20.0,
+            "Seconds between netsplits, 0 for none", float],
+        ['split size', 's', 0.1,
+            "Share of the users a netsplit takes away", float],
+        ['line interval', 'l', 0.0,
+            "The bot's line interval, 0 lets it send as fast as it can",
+            float],
+        ['channel', 'c', '#pickup', "Channel to run in"],
+        ['seed', None, 0, "Random seed", int],
+        ['python', None, sys.executable, "Python to run the bot with"],
+    ]
+    optFlags = [
+        ['keep', 'k', "Keep the bot's configuration directory and log"],
+    ]
+
+def proc_usage(pid):
+    """@returns: (CPU seconds, resident memory in bytes) of a process"""
+    with open('/proc/%d/stat' % pid) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    ticks = float(os.sysconf('SC_CLK_TCK'))
+    cpu = (int(fields[11]) + int(fields[12])) / ticks
+    rss = 0
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+    return cpu, rss
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+class BotProcess(protocol.ProcessProtocol):
+    """Logs the bot's output to a file"""
+
+    def __init__(self, swarm, log):
+        self.swarm = swarm
+        self.log = log
+
+    def outReceived(self, data):
+        self.log.write(data)
+
+    errReceived = outReceived
+
+    def processEnded(self, reason):
+        self.log.close()
+        self.swarm.bot_ended(reason)
+
+class Swarm:
+    """Drives the simulated users and keeps the score
+
+    @ivar pending: folded nick -> OrderedDict of ping token -> (command,
+        time sent), for commands waiting for an answer
+    @ivar latencies: command -> list of seconds"""
+
+    def __init__(self, options):
+        self.options = options
+        self.channel = options['channel']
+        self.nickname = 'benchbot'
+        self.random = random.Random(options['seed'])
+        self.server = ircd.Server()
+        self.server.observer = self.observe
+        self.users = []
+        self.away = 0
+        self.admins = []
+        self.added = set()
+        self.serial = 0
+        self.token = 0
+        self.pending = {}
+        self.latencies = {}
+        self.sent = {}
+        self.lines = 0
+        self.ready = None
+        self.bot = None
+        self.running = False
+        self.actions = []
+        for action, weight in ACTIONS:
+            self.actions.extend([action] * weight)
+
+    # Population
+
+    def new_user(self, op=False):
+        self.serial += 1
+        user = self.server.add_user('player%d' % self.serial,
+            'p%d' % self.serial, 'h%d.users.bench' % self.serial)
+        self.server.join(user, self.channel, op)
+        (self.admins if op else self.users).append(user)
+        return user
+
+    def present(self, user):
+        return self.server.user(user.nick) is user \
+            and ircd.fold(self.channel) in user.channels
+
+    def pick(self, idle=False):
+        """A random user still in the channel, without pending commands
+        if idle"""
+        while self.users:
+            i = self.random.randrange(len(self.users))
+            user = self.users[i]
+            if not self.present(user):
+                self.users[i] = self.users[-1]
+                self.users.pop()
+                self.added.discard(user)
+                continue
+            if idle and self.pending.get(ircd.fold(user.nick)):
+                return None
+            return user
+
+    def refill(self):
+        while len(self.users) + self.away < self.options['users']:
+            self.new_user()
+
+    # Talking to the bot
+
+    def command(self, user, kind, text):
+        self.server.message(user, 'PRIVMSG', self.channel, text)
+        self.ping(user, kind)
+
+    def ping(self, user, kind):
+        self.token += 1
+        self.pending.setdefault(ircd.fold(user.nick), OrderedDict())[
+            self.token] = (kind, time())
+        self.sent[kind] = self.sent.get(kind, 0) + 1
+        self.server.message(user, 'PRIVMSG', self.nickname,
+            '\x01PING %d\x01' % self.token)
+
+    def observe(self, user, prefix, command, params):
+        """Lines from the bot to users or the channel"""
+        self.lines += 1
+        if command not in ('PRIVMSG', 'NOTICE') or params[0][:1] == '#':
+            return
+        pending = self.pending.get(ircd.fold(params[0]))
+        if not pending:
+            return
+        text = params[1]
+        if text.startswith('\x01PING '):
+            token = int(text[6:].strip('\x01'))
+            if token not in pending:
+                return
+            kind, sent = pending.pop(token)
+        else:
+            token, (kind, sent) = pending.popitem(last=False)
+        self.latencies.setdefault(kind, []).append(time() - sent)
+        if self.ready is not None and token == self.ready:
+            self.ready = None
+            self.start()
+
+    # Actions
+
+    def act_add(self):
+        user = self.pick()
+        if user is not None:
+            self.command(user, 'add', '!add %s' % self.random.choice(GAMES))
+            self.added.add(user)
+
+    def act_remove(self):
+        if not self.added:
+            return self.act_add()
+        user = self.added.pop()
+        if self.present(user):
+            self.command(user, 'remove', '!remove')
+
+    def act_who(self):
+        user = self.pick()
+        if user is not None:
+            self.command(user, 'who', '!who')
+
+    def act_chatter(self):
+        user = self.pick()
+        if user is not None:
+            self.server.message(user, 'PRIVMSG', self.channel,
+                "anyone up for a game tonight?")
+
+    def act_churn(self):
+        user = self.pick(idle=True)
+        if user is not None:
+            if self.random.random() < .5:
+                self.server.part(user, self.channel, "bye")
+            else:
+                self.server.quit(user, "Quit: bye")
+        self.refill()
+
+    def act_rename(self):
+        user = self.pick(idle=True)
+        if user is not None:
+            self.serial += 1
+            self.server.nick(user, 'player%d' % self.serial)
+
+    def act_ban(self):
+        user = self.pick()
+        if user is not None:
+            self.command(self.random.choice(self.admins), 'ban',
+                '!ban %s 1h flooding' % user.nick)
+
+    def netsplit(self):
+        split = set()
+        for i in xrange(int(len(self.users) * self.options['split size'])):
+            user = self.pick(idle=True)
+            if user is not None:
+                split.add(user)
+        for user in split:
+            self.server.quit(user, "bench.local split.bench.local")
+            self.added.discard(user)
+        self.users = [user for user in self.users if user not in split]
+        self.away += len(split)
+        reactor.callLater(5, self.rejoin, split)
+
+    def rejoin(self, split):
+        self.away -= len(split)
+        if not self.running:
+            return
+        for user in split:
+            if self.server.user(user.nick) is None:
+                self.server.users[ircd.fold(user.nick)] = user
+                self.server.join(user, self.channel)
+                self.users.append(user)
+
+    # Running
+
+    def run(self):
+        for i in xrange(self.options['admins']):
+            self.new_user(op=True)
+        self.refill()
+        self.listening = reactor.listenTCP(0, ircd.ServerFactory(self.server),
+            interface='127.0.0.1')
+        port = self.listening.getHost().port
+
+        self.dir = tempfile.mkdtemp(prefix='pypickupbot-bench-')
+        values = {'nickname': self.nickname, 'port': port,
+            'channel': self.channel,
+            'line interval': self.options['line interval']}
+        with open(os.path.join(self.dir, 'init.cfg'), 'w') as f:
+            f.write(INIT_CFG % values)
+        with open(os.path.join(self.dir, 'config.cfg'), 'w') as f:
+            f.write(CONFIG_CFG)
+        process = BotProcess(self,
+            open(os.path.join(self.dir, 'bot.log'), 'w'))
+        python = self.options['python']
+        self.bot = reactor.spawnProcess(process, python,
+            [python, os.path.join(TOP, 'pickupbot'), '-c', self.dir,
+                '-D', os.path.join(self.dir, 'db.sqlite')],
+            env=os.environ, path=TOP)
+        print("Bot started, its configuration and log are in %s" % self.dir)
+        self.waiting = task.LoopingCall(self.wait_for_bot)
+        self.waiting.start(0.1)
+
+    def wait_for_bot(self):
+        """Waits for the bot to join, then for it to answer a ping"""
+        bot = self.server.user(self.nickname)
+        if bot is None or ircd.fold(self.channel) not in bot.channels:
+            return
+        self.waiting.stop()
+        self.ping(self.admins[0], 'startup')
+        self.ready = self.token
+
+    def start(self):
+        print("Bot ready, running for %gs" % self.options['duration'])
+        self.sent = {}
+        self.latencies = {}
+        self.lines = 0
+        self.running = True
+        self.started = time()
+        self.issued = 0
+        self.usage = proc_usage(self.bot.pid)
+        self.ticker = task.LoopingCall(self.tick)
+        self.ticker.start(0.01)
+        if self.options['netsplit']:
+            self.splitter = task.LoopingCall(self.netsplit)
+            self.splitter.start(self.options['netsplit'], now=False)
+        reactor.callLater(self.options['duration'], self.drain)
+
+    def tick(self):
+        due = int((time() - self.started) * self.options['rate'])
+        while self.issued < due:
+            self.issued += 1
+            getattr(self, 'act_' + self.random.choice(self.actions))()
+
+    def drain(self):
+        """Stops acting and waits for the bot to answer"""
+        self.running = False
+        self.ticker.stop()
+        if self.options['netsplit']:
+            self.splitter.stop()
+        self.elapsed = time() - self.started
+        self.end_usage = proc_usage(self.bot.pid)
+        self.drained = time()
+        self.waiting = task.LoopingCall(self.wait_for_answers)
+        self.waiting.start(0.1)
+
+    def wait_for_answers(self):
+        if any(self.pending.itervalues()) and time() - self.drained < 10:
+            return
+        self.waiting.stop()
+        self.report()
+        self.bot.signalProcess('TERM')
+
+    def bot_ended(self, reason):
+        if self.bot is not None and self.running is not None:
+            self.running = None
+            if not self.options['keep']:
+                shutil.rmtree(self.dir, True)
+            if reactor.running:
+                reactor.stop()
+
+    def report(self):
+        sent = sum(self.sent.itervalues())
+        answered = sum(len(l) for l in self.latencies.itervalues())
+        cpu = self.end_usage[0] - self.usage[0]
+        print("")
+        print("%d users, %d commands in %.1fs (%.1f/s), %d answered, "
+            "%d lines from the bot" % (len(self.users), sent, self.elapsed,
+                sent / self.elapsed, answered, self.lines))
+        print("")
+        print("%-10s %8s %8s %8s %8s %8s" % (
+            'latency', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+        every = []
+        for kind in sorted(self.latencies):
+            values = sorted(self.latencies[kind])
+            every.extend(values)
+            self.print_latencies(kind, values)
+        self.print_latencies('all', sorted(every))
+        print("")
+        print("Bot CPU: %.2fms per command, %.0f%% of a core" % (
+            cpu * 1000 / sent if sent else 0, cpu * 100 / self.elapsed))
+        print("Bot memory: %.1fMB at start, %.1fMB at the end (%+.1fMB)" % (
+            self.usage[1] / 1e6, self.end_usage[1] / 1e6,
+            (self.end_usage[1] - self.usage[1]) / 1e6))
+
+    def print_latencies(self, kind, values):
+        print("%-10s %8d %8.1f %8.1f %8.1f %8.1f" % (kind, len(values),
+            percentile(values, .5) * 1000, percentile(values, .9) * 1000,
+            percentile(values, .99) * 1000,
+            (values[-1] if values else 0) * 1000))
+
+def main():
+    options = Options()
+    try:
+        options.parseOptions()
+    except usage.UsageError as e:
+        print("%s: %s" % (sys.argv[0], e))
+        sys.exit(1)
+    swarm = Swarm(options)
+    reactor.callWhenRunning(swarm.run)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
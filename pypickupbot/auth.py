@@ -0,0 +1,146 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""caching of admin checks and of the bot's own op status"""
+
+from twisted.internet import defer
+
+from pypickupbot import config
+from pypickupbot.roster import casefolder
+
+class AuthCache:
+    """Remembers who is an admin and where the bot is opped
+
+    Entries are dropped exactly when something that could change them
+    happens: mode changes, nick changes, account changes, and users or
+    the bot leaving a channel.
+
+    @ivar admins: (casefolded channel, casefolded nick) -> bool
+    @ivar opped: channel -> whether the bot is opped there"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.admins = {}
+        self.opped = {}
+        self.hits = 0
+        self.misses = 0
+        # bumped on every invalidation, so that answers computed
+        # meanwhile aren't stored
+        self.epoch = 0
+
+    def eventhandlers(self):
+        return {
+            'modeChanged': [self.modeChanged],
+            'userRenamed': [self.userRenamed],
+            'userQuit': [self.userGone],
+            'userLeft': [self.userGone],
+            'userKicked': [self.userGone],
+            'userAccountChanged': [self.userGone],
+            'left': [self.channelLost],
+            'kickedFrom': [self.channelLost],
+            'irc_RPL_ENDOFNAMES': [self.namesReceived],
+            }
+
+    def fold(self, nick):
+        return casefolder(self.bot.casemapping())(nick)
+
+    def enabled(self):
+        return config.getboolean('Bot', 'cache admin checks')
+
+    def key(self, nick, channel):
+        return (self.fold(channel), self.fold(nick))
+
+    def cached_admin(self, nick, channel):
+        """@returns: True or False if known, None otherwise"""
+        if not self.enabled():
+            return None
+        known = self.admins.get(self.key(nick, channel))
+        if known is not None:
+            self.hits += 1
+        return known
+
+    def is_admin(self, user, nick, channel):
+        """@param channel: home channel the command is about
+        @returns: Deferred, already fired when the answer was cached"""
+        known = self.cached_admin(nick, channel)
+        if known is not None:
+            return defer.succeed(known)
+        self.misses += 1
+        key = self.key(nick, channel)
+        epoch = self.epoch
+        def _store(is_admin):
+            if self.enabled() and epoch == self.epoch:
+                self.admins[key] = bool(is_admin)
+            return is_admin
+        return self.bot.fire('is_admin', user, nick, channel,
+                fire_event_func=any)\
+            .addCallback(_store)
+
+    def bot_has_op(self, channel, check):
+        """@param check: callable returning a Deferred for when the
+            answer isn't cached"""
+        key = self.fold(channel)
+        if key in self.opped and self.enabled():
+            self.hits += 1
+            return defer.succeed(self.opped[key])
+        self.misses += 1
+        epoch = self.epoch
+        def _store(has_op):
+            if epoch == self.epoch:
+                self.opped[key] = bool(has_op)
+            return has_op
+        return check().addCallback(_store)
+
+    def forget(self, nick):
+        self.epoch += 1
+        nick = self.fold(nick)
+        for key in [key for key in self.admins if key[1] == nick]:
+            del self.admins[key]
+
+    def modeChanged(self, user, channel, set, modes, args):
+        prefix_modes = self.bot.prefix_modes().values()
+        for mode, arg in zip(modes, args):
+            if mode not in prefix_modes or arg is None:
+                continue
+            self.forget(arg)
+            if mode == 'o' and self.fold(arg) == self.fold(self.bot.nickname):
+                self.opped[self.fold(channel)] = bool(set)
+
+    def userRenamed(self, oldnick, newnick):
+        self.forget(oldnick)
+        self.forget(newnick)
+
+    def userGone(self, user, *args):
+        self.forget(user.split('!', 1)[0])
+
+    def channelLost(self, channel, *args):
+        # admin rights can come from that channel
+        self.epoch += 1
+        self.admins.clear()
+        self.opped.pop(self.fold(channel), None)
+
+    def namesReceived(self, prefix, params):
+        # modules learn about ops from NAMES
+        self.epoch += 1
+        self.admins.clear()
+        self.opped.pop(self.fold(params[1]), None)
@@ -22,6 +22,7 @@
 
 """Command-line launcher"""
 
+import os.path
 import sys
 
 from twisted.internet import reactor
@@ -32,6 +33,8 @@ from twisted.python import usage
 from pypickupbot import config
 from pypickupbot.irc import IrcBotFactory
 from pypickupbot import db
+from pypickupbot import metrics
+from pypickupbot import logger
 
 class Options(usage.Options):
     
@@ -62,10 +65,15 @@ def from_commandline():
         print '%s: Try --help for usage details.' % (sys.argv[0])
         sys.exit(1)
     
-    log.startLogging(sys.stdout)
-
     config.parse_init_configs(options['config'])
 
+    logger.configure_from(config, options['debug'])
+    log_file = config.get('Bot', 'log file')
+    logger.start(log_file and os.path.expanduser(log_file),
+        config.getint('Bot', 'log file size'),
+        config.getint('Bot', 'log files kept'),
+        config.getint('Bot', 'log queue size'))
+
     if options['debug']:
         log.msg("Forced debugging output on")
         config.debug = True
@@ -74,6 +82,10 @@ def from_commandline():
 
     db.DBs.load_db(options['config'], options['db'])
 
+    if config.get('Bot', 'metrics port'):
+        metrics.listen(config.getint('Bot', 'metrics port'),
+            config.get('Bot', 'metrics interface'))
+
     factory = IrcBotFactory()
     host = config.get('Server', 'host')
     port = config.getint('Server', 'port')
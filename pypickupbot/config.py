@@ -26,6 +26,7 @@ import re
 from ConfigParser import SafeConfigParser as CfgParser, NoSectionError, NoOptionError
 
 from pypickupbot.misc import timediff_from_str
+from pypickupbot.template import Template
 
 defaults = {
     }
@@ -43,25 +44,169 @@ configs = [
     ]
 
 _parser = CfgParser(defaults)
+_get = _parser.get
+_getint = _parser.getint
+_getfloat = _parser.getfloat
+_getboolean = _parser.getboolean
 
 debug = False
 
+generation = 0
+"""bumped every time the configuration changes, so that users can cache
+values read from it"""
+
+def bump():
+    """marks cached configuration values as stale"""
+    global generation
+    generation += 1
+
+class Snapshot:
+    """The configuration as of one L{generation}, each value read and
+    converted only once
+
+    Values are shared by everyone reading them and must not be modified:
+    lists are tuples for that reason. Changing the configuration makes a
+    new snapshot rather than changing this one, see L{current}."""
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.values = {}
+
+    def _value(self, convert, section, option):
+        key = (convert, section, option)
+        try:
+            return self.values[key]
+        except KeyError:
+            value = self.values[key] = convert(section, option)
+            return value
+
+    def get(self, section, option):
+        return self._value(_get, section, option)
+
+    def getint(self, section, option):
+        return self._value(_getint, section, option)
+
+    def getfloat(self, section, option):
+        return self._value(_getfloat, section, option)
+
+    def getboolean(self, section, option):
+        return self._value(_getboolean, section, option)
+
+    def getescaped(self, section, option):
+        """@returns: the value with backslash escapes decoded, as used
+        for messages"""
+        return self._value(_getescaped, section, option)
+
+    def gettemplate(self, section, option):
+        """@returns: the escape-decoded value as a
+        L{pypickupbot.template.Template}"""
+        return self._value(_gettemplate, section, option)
+
+    def getlist(self, section, option):
+        """@returns: tuple"""
+        return self._value(_gettuple, section, option)
+
+    def getdict(self, section, option):
+        return self._value(_getdict, section, option)
+
+    def getduration(self, section, option):
+        return self._value(_getduration, section, option)
+
+    def section(self, channel, section, option=None):
+        """The section that applies in channel, see L{ChannelConfig}"""
+        return self._value(_channel_section, (channel, section), option)
+
+_snapshot = Snapshot(generation)
+
+def current():
+    """@returns: the L{Snapshot} of the configuration as it is now"""
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot.generation != generation:
+        # swapped in one go, readers holding the previous one keep it
+        snapshot = _snapshot = Snapshot(generation)
+    return snapshot
+
+files = []
+"""configuration files read, in order, see L{read_files}"""
+
+def read(paths):
+    """Reads the configuration files in paths that exist"""
+    files.extend(_parser.read(paths))
+    bump()
+
+def _readfile(path):
+    with open(path) as f:
+        _parser.readfp(f)
+    files.append(path)
+
 def parse_init_configs(dir_=None):
-    _parser.readfp(open(os.path.join(os.path.dirname(__file__), 'defaults.cfg')))
+    _readfile(os.path.join(os.path.dirname(__file__), 'defaults.cfg'))
     if dir_ != None:
         dir.append(dir_)
     if dir == []:
-        _parser.read(init_configs)
+        files.extend(_parser.read(init_configs))
     else:
-        _parser.readfp((open(os.path.join(dir[0], 'init.cfg'))))
+        _readfile(os.path.join(dir[0], 'init.cfg'))
+    bump()
 
     debug = getboolean('Bot', 'debug')
 
 def parse_configs():
     if dir == []:
-        _parser.read(configs)
+        files.extend(_parser.read(configs))
     else:
-        _parser.readfp((open(os.path.join(dir[0], 'config.cfg'))))
+        _readfile(os.path.join(dir[0], 'config.cfg'))
+    bump()
+
+def read_files(paths):
+    """Parses configuration files on their own, leaving the running
+    configuration alone: safe to call from another thread
+
+    @raises ConfigParser.Error: if one can't be parsed
+    @returns: {section: {option: raw value}}, DEFAULT included"""
+    parser = CfgParser()
+    for path in paths:
+        with open(path) as f:
+            parser.readfp(f)
+    values = {'DEFAULT': dict(parser.defaults())}
+    for section in parser.sections():
+        values[section] = dict((option, value) for option, value
+            in parser._sections[section].iteritems() if option != '__name__')
+    return values
+
+def diff(old, new):
+    """@returns: list of (section, option, value) changing what was read
+    as old into new, value None for options that are gone"""
+    changes = []
+    for section in frozenset(old).union(new):
+        before = old.get(section, {})
+        after = new.get(section, {})
+        for option in frozenset(before).union(after):
+            if before.get(option) != after.get(option):
+                changes.append((section, option, after.get(option)))
+    return changes
+
+def apply(changes):
+    """Applies L{diff}'s changes to the running configuration. Options
+    that were set otherwise and didn't change in the files stay as they
+    are.
+
+    @returns: frozenset of the sections that changed"""
+    for section, option, value in changes:
+        if value is None:
+            if section == 'DEFAULT':
+                _parser.defaults().pop(option, None)
+            elif _parser.has_section(section):
+                _parser.remove_option(section, option)
+                if _parser._sections[section].keys() == ['__name__']:
+                    _parser.remove_section(section)
+        else:
+            if section != 'DEFAULT' and not _parser.has_section(section):
+                _parser.add_section(section)
+            _parser.set(section, option, value)
+    bump()
+    return frozenset(section for section, option, value in changes)
 
 
 defaults = _parser.defaults
@@ -70,18 +215,48 @@ add_section = _parser.add_section
 has_section = _parser.has_section
 options = _parser.options
 has_option = _parser.has_option
-get = _parser.get
-getint = _parser.getint
-getfloat = _parser.getfloat
-getboolean = _parser.getboolean
 items = _parser.items
-set = _parser.set
-remove_option = _parser.remove_option
+
+def get(section, option):
+    return current().get(section, option)
+
+def getint(section, option):
+    return current().getint(section, option)
+
+def getfloat(section, option):
+    return current().getfloat(section, option)
+
+def getboolean(section, option):
+    return current().getboolean(section, option)
+
+def set(section, option, value=None):
+    _parser.set(section, option, value)
+    bump()
+
+def remove_option(section, option):
+    r = _parser.remove_option(section, option)
+    bump()
+    return r
 
 def getescaped(section, option):
-    return get(section, option).decode('string-escape')
+    return current().getescaped(section, option)
+
+def _getescaped(section, option):
+    return _get(section, option).decode('string-escape')
+
+def gettemplate(section, option):
+    return current().gettemplate(section, option)
+
+def _gettemplate(section, option):
+    return Template(_getescaped(section, option))
 
 def getlist(section, option):
+    return list(current().getlist(section, option))
+
+def _gettuple(section, option):
+    return tuple(_getlist(section, option))
+
+def _getlist(section, option):
     o = []
     if _parser.has_option(section, option+'[]'):
         count = _parser.getint(section, option+'[]')
@@ -89,7 +264,7 @@ def getlist(section, option):
         for i in range(count):
             o.append(_parser.get(section, option+'['+str(i)+']'))
     else:
-        s = get(section, option)
+        s = _parser.get(section, option)
         if ',' in s:
             o = re.split('(?:, *)', s)
         else:
@@ -100,7 +275,7 @@ def getlist(section, option):
             o = []
 
     try:
-        plus = getlist(section, option+'+')
+        plus = _getlist(section, option+'+')
         for item in plus:
             if item not in o:
                 o.append(item)
@@ -108,7 +283,7 @@ def getlist(section, option):
         pass
 
     try:
-        minus = getlist(section, option+'-')
+        minus = _getlist(section, option+'-')
         for item in minus:
             if item in o:
                 o.remove(item)
@@ -118,12 +293,79 @@ def getlist(section, option):
     return o
 
 def getdict(section, option):
+    return dict(current().getdict(section, option))
+
+def _getdict(section, option):
     return dict((
         i.split(':', 1)
-        for i in getlist(section,option)
+        for i in _getlist(section,option)
         ))
 
 def getduration(section, option):
+    return current().getduration(section, option)
+
+def _getduration(section, option):
     s = _parser.get(section, option)
     return timediff_from_str(s)
 
+def _channel_section(channel_section, option):
+    channel, section = channel_section
+    specific = '%s %s' % (section, channel)
+    if _parser.has_section(specific) and (option is None
+            or _parser.has_option(specific, option)
+            or _parser.has_option(specific, option + '[]')):
+        return specific
+    return section
+
+
+class ChannelConfig:
+    """Reads the configuration as seen from one channel
+
+    An option set in a "<section> <channel>" section, like
+    [Pickup #channel], overrides the one in <section>. Sections read as a
+    whole through L{items} are replaced entirely when the channel has its
+    own."""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def section(self, section, option=None):
+        """The section that applies for an option, or for a whole section
+        if option is None"""
+        return current().section(self.channel, section, option)
+
+    def has_section(self, section):
+        return has_section(self.section(section))
+
+    def has_option(self, section, option):
+        return has_option(self.section(section, option), option)
+
+    def items(self, section):
+        return items(self.section(section))
+
+    def get(self, section, option):
+        return get(self.section(section, option), option)
+
+    def getint(self, section, option):
+        return getint(self.section(section, option), option)
+
+    def getfloat(self, section, option):
+        return getfloat(self.section(section, option), option)
+
+    def getboolean(self, section, option):
+        return getboolean(self.section(section, option), option)
+
+    def getescaped(self, section, option):
+        return getescaped(self.section(section, option), option)
+
+    def gettemplate(self, section, option):
+        return gettemplate(self.section(section, option), option)
+
+    def getlist(self, section, option):
+        return getlist(self.section(section, option), option)
+
+    def getdict(self, section, option):
+        return getdict(self.section(section, option), option)
+
+    def getduration(self, section, option):
+        return getduration(self.section(section, option), option)
@@ -0,0 +1,181 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Applies changes to the configuration files while the bot runs"""
+
+import os.path
+from time import time
+
+from twisted.internet import reactor, threads
+from twisted.python import log, filepath
+try:
+    from twisted.internet import inotify
+except ImportError:
+    # only on Linux
+    inotify = None
+
+from pypickupbot import config
+from pypickupbot import template
+
+class ConfigWatcher:
+    """Watches the files the configuration was read from
+
+    When one changes, the files are parsed again in a thread. Only what
+    changed is applied to the running configuration, then the bot is told
+    which sections changed, see L{pypickupbot.irc.IrcBot.config_changed}.
+    Changes that break a message template are not applied. Templates
+    can only be checked against the bot's modules, so changes made while
+    it is away are held until it is back.
+
+    Without inotify, the files are checked every L{POLL_INTERVAL}
+    seconds.
+
+    @ivar bot: the connected bot, or None between connections
+    @ivar values: the files as last applied, see L{config.read_files}
+    @ivar pending: the files as last read while the bot was away, or
+        None"""
+
+    POLL_INTERVAL = 2
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.paths = list(config.files)
+        self.values = None
+        self.mtimes = None
+        self.pending = None
+        self.reading = False
+        self.again = False
+        self.notifier = None
+        self.poller = None
+
+    def start(self):
+        """Reads the files as they are now, then watches them"""
+        d = threads.deferToThread(config.read_files, self.paths)
+        def _read(values):
+            self.values = values
+            self.mtimes = self.stat()
+            self.watch()
+        return d.addCallback(_read).addErrback(log.err,
+            "reading the configuration to watch it")
+
+    def watch(self):
+        if inotify is not None:
+            try:
+                self.notifier = inotify.INotify()
+                self.notifier.startReading()
+                # editors often replace files rather than write to them
+                for directory in set(os.path.dirname(os.path.abspath(path))
+                        for path in self.paths):
+                    self.notifier.watch(filepath.FilePath(directory),
+                        inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO,
+                        callbacks=[self._notified])
+                return
+            except Exception:
+                log.err(None, "watching the configuration with inotify")
+                self.notifier = None
+        self.poller = reactor.callLater(self.POLL_INTERVAL, self.poll)
+
+    def stop(self):
+        if self.notifier is not None:
+            self.notifier.loseConnection()
+            self.notifier = None
+        if self.poller is not None and self.poller.active():
+            self.poller.cancel()
+        self.poller = None
+
+    def attach(self, bot):
+        """Applies, after a reconnect, changes made while the bot was
+        away"""
+        self.bot = bot
+        if bot is not None and self.pending is not None:
+            pending, self.pending = self.pending, None
+            self._read(pending, time())
+
+    def _notified(self, watch, path, mask):
+        if os.path.abspath(path.path) in map(os.path.abspath, self.paths):
+            self.reload()
+
+    def stat(self):
+        mtimes = {}
+        for path in self.paths:
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def poll(self):
+        mtimes = self.stat()
+        if mtimes != self.mtimes:
+            self.mtimes = mtimes
+            self.reload()
+        self.poller = reactor.callLater(self.POLL_INTERVAL, self.poll)
+
+    def reload(self):
+        """Reads the files again and applies what changed"""
+        if self.values is None:
+            return
+        if self.reading:
+            self.again = True
+            return
+        self.reading = True
+        start = time()
+        d = threads.deferToThread(config.read_files, self.paths)
+        d.addCallback(self._read, start)
+        d.addErrback(self._failed)
+        def _done(_):
+            self.reading = False
+            if self.again:
+                self.again = False
+                self.reload()
+        d.addBoth(_done)
+
+    def _failed(self, failure):
+        log.msg(_("Could not read the configuration, keeping the previous "
+            "one: {0}").format(failure.getErrorMessage()))
+
+    def _read(self, values, start):
+        if self.bot is None:
+            self.pending = values
+            return
+        changes = config.diff(self.values, values)
+        if not changes:
+            return
+        sections = config.apply(changes)
+        try:
+            self.bot.check_templates()
+        except template.TemplateError as e:
+            config.apply(config.diff(values, self.values))
+            for problem in str(e).splitlines():
+                log.msg(_("Bad message %s") % problem)
+            log.msg(_("Keeping the previous configuration."))
+            return
+        # applied: a module failing to take the changes must not get
+        # them applied again with every later change
+        self.values = values
+        try:
+            self.bot.config_changed(sections)
+        except Exception:
+            log.err(None, "passing on configuration changes")
+        log.msg(_("Applied configuration changes to {0} in {1:.1f}ms.").format(
+            ', '.join(sorted(sections)), (time() - start) * 1000))
@@ -23,15 +23,29 @@
 """Persistent data access."""
 
 import os.path
+from time import time
 
 from twisted.enterprise import adbapi
+from twisted.internet import defer
+from twisted.python import failure, log
+
+from pypickupbot import metrics
+
+SECONDS = metrics.histogram('pypickupbot_db_seconds',
+    'Time database calls took to complete', ('operation',))
 
 class DBs:
     db = None
+    # calls in progress
+    running = 0
 
     @classmethod
     def load_db(cls, configdir=None, dbfile=None):
-        if dbfile != None:
+        if dbfile == ':memory:':
+            # every connection would get its own empty database
+            cls.db = adbapi.ConnectionPool("sqlite3", dbfile,
+                check_same_thread=False, cp_min=1, cp_max=1)
+        elif dbfile != None:
             cls.db = adbapi.ConnectionPool("sqlite3", dbfile, check_same_thread=False)
         else:
             if configdir != None:
@@ -44,22 +58,99 @@ class DBs:
     
     @classmethod
     def _db_postload(cls):
-        cls.db.runOperation("""
-            CREATE TABLE IF NOT EXISTS
-            meta
-            (
-                key     TEXT UNIQUE,
-                val     TEXT
-            )
-            """)
-    
+        cls.db.runOperation(META_TABLE)
+
+META_TABLE = """
+    CREATE TABLE IF NOT EXISTS
+    meta
+    (
+        key     TEXT UNIQUE,
+        val     TEXT
+    )
+    """
+
+
+def _timed(operation, d):
+    start = time()
+    DBs.running += 1
+    def _observe(result):
+        DBs.running -= 1
+        SECONDS.observe(time() - start, operation=operation)
+        return result
+    return d.addBoth(_observe)
 
 def runInteraction(*args, **kwargs):
-    return DBs.db.runInteraction(*args, **kwargs)
+    return _timed('interaction', DBs.db.runInteraction(*args, **kwargs))
 
 def runQuery(*args, **kwargs):
-    return DBs.db.runQuery(*args, **kwargs)
+    return _timed('query', DBs.db.runQuery(*args, **kwargs))
 
 def runOperation(*args, **kwargs):
-    return DBs.db.runOperation(*args, **kwargs)
+    return _timed('operation', DBs.db.runOperation(*args, **kwargs))
 
+_migrations = {}
+"""component -> schema version, or Deferreds waiting for it"""
+
+def migrate(component, steps):
+    """Brings the tables of a component of the bot up to date
+
+    Each step is a statement, a list of statements or a function taking
+    the transaction. Step n brings the schema to version n, which is kept
+    in the meta table. Steps are only ever appended: those a database
+    already went through are skipped. Each runs in its own transaction
+    with the version it brings, so that an upgrade cut short resumes
+    where it stopped.
+
+    sqlite3 commits before each CREATE statement, so a step may have run
+    without its version being recorded: steps must be safe to run again,
+    hence "IF NOT EXISTS". That also covers databases from before
+    migrations, which already have the tables.
+
+    @param component: name the version is kept as
+    @returns: Deferred firing with the version once the tables are ready,
+        the same for everyone migrating component at the same time. A
+        migration that failed is tried again by the next caller."""
+    known = _migrations.get(component)
+    if known is not None and not isinstance(known, list):
+        return defer.succeed(known)
+    d = defer.Deferred()
+    if known is not None:
+        known.append(d)
+        return d
+    _migrations[component] = [d]
+    def _finished(result):
+        waiters = _migrations.pop(component)
+        if not isinstance(result, failure.Failure):
+            _migrations[component] = result
+        # a failed migration is tried again by the next caller
+        for waiter in waiters:
+            waiter.callback(result)
+    _migrate(component, steps).addBoth(_finished)
+    return d
+
+@defer.inlineCallbacks
+def _migrate(component, steps):
+    key = 'schema %s' % component
+    def _version(txn):
+        txn.execute(META_TABLE)
+        txn.execute("SELECT val FROM meta WHERE key=?", (key,))
+        row = txn.fetchone()
+        return int(row[0]) if row else 0
+    version = yield runInteraction(_version)
+    while version < len(steps):
+        step = steps[version]
+        version += 1
+        def _step(txn):
+            if callable(step):
+                step(txn)
+            else:
+                for statement in ([step] if isinstance(step, basestring)
+                        else step):
+                    txn.execute(statement)
+            txn.execute("INSERT OR REPLACE INTO meta(key, val) VALUES(?, ?)",
+                (key, str(version)))
+        start = time()
+        yield runInteraction(_step)
+        log.msg(_("Upgraded the {0} tables to version {1} in {2:.1f}s.")
+            .format(component, version, time() - start))
+    defer.returnValue(version)
@@ -0,0 +1,264 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""event dispatching"""
+
+from time import time
+
+from twisted.internet import defer
+from twisted.python import log
+from twisted.python.failure import Failure
+
+from pypickupbot import logger
+
+LOG = logger.get('events')
+
+SHORT_CIRCUIT = {
+    any: True,
+    all: False,
+}
+"""reducers that can stop calling handlers once one result decides the
+outcome, mapped to the deciding truth value"""
+
+class HandlerList(list):
+    """List of handlers for one event
+
+    Items are either callables or (callable, priority) tuples. Handlers with
+    a higher priority are called first, ties are broken by order of
+    registration."""
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self._ordered = None
+
+    def ordered(self):
+        """Handlers sorted by priority"""
+        if self._ordered is None:
+            entries = [
+                h if isinstance(h, tuple) else (h, 0)
+                for h in self
+                ]
+            self._ordered = tuple(
+                callback for callback, priority
+                in sorted(entries, key=lambda e: -e[1])
+                )
+        return self._ordered
+
+    def _changed(method):
+        def wrapper(self, *args):
+            self._ordered = None
+            return method(self, *args)
+        wrapper.__name__ = method.__name__
+        return wrapper
+
+    append = _changed(list.append)
+    extend = _changed(list.extend)
+    insert = _changed(list.insert)
+    remove = _changed(list.remove)
+    pop = _changed(list.pop)
+    __setitem__ = _changed(list.__setitem__)
+    __delitem__ = _changed(list.__delitem__)
+    __setslice__ = _changed(list.__setslice__)
+    __delslice__ = _changed(list.__delslice__)
+    __iadd__ = _changed(list.__iadd__)
+    del _changed
+
+class EventRegistry(dict):
+    """{'event': L{HandlerList}} that converts lists assigned to it"""
+
+    def __init__(self, handlers=None):
+        dict.__init__(self)
+        if handlers:
+            for event, l in handlers.iteritems():
+                self[event] = l
+
+    def __setitem__(self, event, handlers):
+        if not isinstance(handlers, HandlerList):
+            handlers = HandlerList(handlers)
+        dict.__setitem__(self, event, handlers)
+
+class EventBus:
+    """Calls event handlers
+
+    Handlers are called synchronously. A handler may return a Deferred, in
+    which case the result of L{fire} waits for it.
+
+    @ivar profile: None, or time spent in each handler if profiling
+    @type profile: {'event': {'handler': [calls, seconds, max seconds]}}
+    @ivar observer: None, or called with each event and the time its
+        handlers took to return
+    """
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.profile = None
+        self.observer = None
+
+    def enable_profile(self, enable=True):
+        if enable and self.profile is None:
+            self.profile = {}
+        elif not enable:
+            self.profile = None
+
+    def add(self, event, callback, priority=0):
+        """Registers a handler for event"""
+        if event not in self.handlers:
+            self.handlers[event] = []
+        if priority:
+            self.handlers[event].append((callback, priority))
+        else:
+            self.handlers[event].append(callback)
+
+    def _call(self, event, callback, args, kwargs):
+        if self.profile is None:
+            try:
+                return callback(*args, **kwargs)
+            except Exception:
+                log.err(None, "in handler for event %s" % event)
+                return None
+        start = time()
+        try:
+            return callback(*args, **kwargs)
+        except Exception:
+            log.err(None, "in handler for event %s" % event)
+            return None
+        finally:
+            spent = time() - start
+            name = handler_name(callback)
+            entry = self.profile.setdefault(event, {}).setdefault(
+                name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += spent
+            if spent > entry[2]:
+                entry[2] = spent
+
+    def _run(self, event, args, kwargs, stop):
+        """Calls the handlers for event until one decides the outcome
+
+        @returns: (decided, results) where decided is True if a synchronous
+            result matched stop"""
+        results = []
+        for callback in self.handlers[event].ordered():
+            result = self._call(event, callback, args, kwargs)
+            if stop is not None and not isinstance(result, defer.Deferred) \
+                    and bool(result) == stop:
+                for r in results:
+                    if isinstance(r, defer.Deferred):
+                        r.addErrback(log.err, "in handler for event %s" % event)
+                return True, results
+            results.append(result)
+        return False, results
+
+    def fire(self, event, *args, **kwargs):
+        """Calls all handlers for event
+
+        @param fire_event_func: called with the list of results to make the
+            value the returned Deferred fires with. Defaults to C{all}.
+            Passing C{any} or C{all} explicitly stops calling handlers as
+            soon as the outcome is known.
+        @returns: Deferred"""
+        func = kwargs.pop('fire_event_func', None)
+        LOG.debug("Event {0} fired with args {1}, kwargs {2}",
+            event, args, kwargs)
+
+        if event not in self.handlers:
+            return defer.succeed((func or all)([]))
+
+        stop = SHORT_CIRCUIT.get(func)
+        if self.observer is None:
+            decided, results = self._run(event, args, kwargs, stop)
+        else:
+            start = time()
+            decided, results = self._run(event, args, kwargs, stop)
+            self.observer(event, time() - start)
+
+        if decided:
+            return defer.succeed(stop)
+
+        pending = [
+            (i, r) for i, r in enumerate(results)
+            if isinstance(r, defer.Deferred)
+            ]
+        if not pending:
+            return defer.succeed((func or all)(results))
+
+        return self._gather(event, results, pending, func or all, stop)
+
+    def _gather(self, event, results, pending, func, stop):
+        d = defer.Deferred()
+        left = [len(pending)]
+
+        def _got(result, i):
+            if d.called:
+                return
+            results[i] = result
+            left[0] -= 1
+            if stop is not None and bool(result) == stop:
+                d.callback(stop)
+            elif not left[0]:
+                d.callback(func(results))
+
+        def _failed(failure, i):
+            log.err(failure, "in handler for event %s" % event)
+            _got(None, i)
+
+        for i, r in pending:
+            r.addCallbacks(_got, _failed, callbackArgs=(i,), errbackArgs=(i,))
+        return d
+
+    def notify(self, event, *args, **kwargs):
+        """Calls all handlers for event, without caring about the result"""
+        LOG.debug("Event {0} fired with args {1}, kwargs {2}",
+            event, args, kwargs)
+        if event not in self.handlers:
+            return
+        if self.observer is not None:
+            start = time()
+        for callback in self.handlers[event].ordered():
+            result = self._call(event, callback, args, kwargs)
+            if isinstance(result, defer.Deferred):
+                result.addErrback(log.err, "in handler for event %s" % event)
+        if self.observer is not None:
+            self.observer(event, time() - start)
+
+    def profile_report(self, event=None):
+        """Handlers sorted by total time spent in them
+
+        @returns: [(event, handler, calls, seconds, max seconds)]"""
+        if not self.profile:
+            return []
+        ret = []
+        for event_, handlers in self.profile.iteritems():
+            if event is not None and event_ != event:
+                continue
+            for name, (calls, spent, worst) in handlers.iteritems():
+                ret.append((event_, name, calls, spent, worst))
+        ret.sort(key=lambda x: x[3], reverse=True)
+        return ret
+
+def handler_name(callback):
+    """Readable name for an event handler"""
+    try:
+        return '%s.%s' % (callback.im_class.__name__, callback.__name__)
+    except AttributeError:
+        return getattr(callback, '__name__', repr(callback))
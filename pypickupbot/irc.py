@@ -22,20 +22,46 @@
 """the ircbot itself, with understanding of commands etc"""
 
 import re
+import random
 from time import time
 
-from twisted.internet import protocol, defer
+from twisted.internet import protocol, defer, reactor
 from twisted.words.protocols import irc
-from twisted.internet import reactor
 from twisted.python import log
 from twisted.python.failure import Failure
 import ConfigParser
 
 from pypickupbot import i18n
 from pypickupbot import config
-from pypickupbot.modable import Modable
+from pypickupbot.modable import Modable, LazyModule
 from pypickupbot.topic import Topic
 from pypickupbot.misc import itime
+from pypickupbot.outqueue import OutboundScheduler, PRIORITY, classify
+from pypickupbot import outqueue
+from pypickupbot.events import EventBus, EventRegistry
+from pypickupbot.roster import Roster, RosterEntry
+from pypickupbot.paginator import Paginator, payload_budget
+from pypickupbot.timers import TimerWheel
+from pypickupbot.ratelimit import InboundLimiter
+from pypickupbot.auth import AuthCache
+from pypickupbot import metrics
+from pypickupbot import logger
+from pypickupbot import template
+from pypickupbot.record import Recorder
+from pypickupbot.configwatch import ConfigWatcher
+
+COMMANDS_LOG = logger.get('commands')
+REPLIES_LOG = logger.get('replies')
+MODULES_LOG = logger.get('modules')
+
+COMMANDS = metrics.counter('pypickupbot_commands_total',
+    'Commands run', ('command',))
+COMMAND_SECONDS = metrics.histogram('pypickupbot_command_seconds',
+    'Time commands took to complete', ('command',))
+EVENT_SECONDS = metrics.histogram('pypickupbot_event_seconds',
+    'Time event handlers took to return', ('event',))
+ROSTER_USERS = metrics.gauge('pypickupbot_roster_users',
+    'Users in each channel the bot knows the user list of', ('channel',))
 
 class COMMAND:
     def __init__(self): raise NotImplementedError
@@ -48,6 +74,20 @@ class COMMAND:
 class InputError(Exception):
     pass
 
+def parse_tags(s):
+    """Parses IRCv3 message tags
+
+    @returns: {'tag': 'value'}"""
+    tags = {}
+    for tag in s.split(';'):
+        key, sep, value = tag.partition('=')
+        if sep:
+            value = re.sub(r'\\(.)', lambda m: tag_unescapes.get(m.group(1), m.group(1)), value)
+        tags[key] = value
+    return tags
+
+tag_unescapes = {':': ';', 's': ' ', 'r': '\r', 'n': '\n', '\\': '\\'}
+
 class IrcBot(irc.IRCClient, Modable):
     """The bot itself.
     
@@ -60,7 +100,8 @@ class IrcBot(irc.IRCClient, Modable):
         'eventhandlers': Modable.EXTEND_DICT_LIST
         }
 
-    lineRate = 1
+    lineRate = None
+    """replaced by L{outqueue}"""
 
     def _get_nickname(self):
         return self.factory.nickname
@@ -68,19 +109,40 @@ class IrcBot(irc.IRCClient, Modable):
 
     def __init__(self):
         self.modules = {}
+        self.module_seconds = {}
+        self.extended = []
         self.commands = {}
-        self.eventhandlers = {
+        self.eventhandlers = EventRegistry({
             'privmsg': [self.privmsg_],
             'joined': [self.joined_],
+            'topicUpdated': [self.topicUpdated_],
             'joinedHomeChannel':  [self.joinedHomeChannel],
             'irc_JOIN': [self.irc_JOIN_],
             'irc_PART': [self.irc_PART_],
             'irc_QUIT': [self.irc_QUIT_],
             'irc_KICK': [self.irc_KICK_],
             'irc_RPL_WELCOME': [self.welcome_],
-        }
+            'irc_CAP': [self.irc_CAP_],
+            'irc_ACCOUNT': [self.irc_ACCOUNT_],
+            'irc_AWAY': [self.irc_AWAY_],
+            'irc_CHGHOST': [self.irc_CHGHOST_],
+            'irc_BATCH': [self.irc_BATCH_],
+        })
+        self.events = EventBus(self.eventhandlers)
+        self.auth = AuthCache(self)
+        for event, handlers in self.auth.eventhandlers().iteritems():
+            for handler in handlers:
+                self.events.add(event, handler)
+        self.events.enable_profile(config.getboolean('Bot', 'profile events'))
+        self.events.observer = self._observe_event
         self.fetching_lists={}
+        self.recorder = None
+        self.timers = TimerWheel()
+        self.router = CommandRouter(self)
+        self.limiter = InboundLimiter(self)
         self.channel = None
+        self.home_channels = []
+        self.topics = {}
         self.setTopic = self.topic
         self.topic = None
         try:
@@ -98,22 +160,277 @@ class IrcBot(irc.IRCClient, Modable):
 
         self.channelpws = config.getdict('Server', 'channel passwords')
 
+        self.outqueue = OutboundScheduler(
+            self._reallySendLine,
+            config.getfloat('Server', 'line interval'),
+            config.getint('Server', 'line burst'),
+            {
+                PRIORITY.REPLY: config.getduration('Server', 'reply max age'),
+                PRIORITY.BULK: config.getduration('Server', 'bulk max age'),
+            })
+        outqueue.DEPTH.set_function(self.outqueue.depths)
+        ROSTER_USERS.set_function(self.roster_sizes)
+
+    def sendLine(self, line, priority=None, target=''):
+        """Queues a line for sending to the server
+
+        @param priority: one of L{PRIORITY}'s classes, guessed from the
+            line if not given"""
+        if priority is None:
+            priority, target = classify(line,
+                self.supported.getFeature('CHANTYPES', '#&'))
+        self.outqueue.enqueue(line, priority, target)
+
+    def max_targets(self, command):
+        """How many targets one PRIVMSG or NOTICE may have, from the
+        server's TARGMAX or MAXTARGETS
+
+        @returns: the limit TARGMAX gives command, or None when it gives
+            it an empty one, meaning no limit. Without TARGMAX, the
+            limit MAXTARGETS gives. 1 when command isn't in TARGMAX or
+            neither is advertised."""
+        targmax = self.supported.getFeature('TARGMAX')
+        if targmax:
+            if command not in targmax:
+                return 1
+            return targmax[command]
+        maxtargets = self.supported.getFeature('MAXTARGETS')
+        if maxtargets:
+            try:
+                return int(maxtargets[0])
+            except ValueError:
+                pass
+        return 1
+
+    def msg_many(self, targets, message, command='PRIVMSG'):
+        """Sends the same message to several targets, in as few lines as
+        the server allows
+
+        Targets are comma-joined up to the server's limit and as long as
+        the line stays short enough for the message. Otherwise, or if the
+        server doesn't take several targets, they get one message each.
+
+        @param command: PRIVMSG or NOTICE"""
+        send = self.notice if command == 'NOTICE' else self.msg
+        limit = self.max_targets(command)
+        if limit == 1 or len(targets) < 2 or '\n' in message:
+            for target in targets:
+                send(target, message)
+            return
+
+        chunk = []
+        for target in targets:
+            joined = ','.join(chunk + [target])
+            if chunk and (len(chunk) == limit or
+                    payload_budget(self, command, joined) < len(message)):
+                self._send_many(send, command, chunk, message)
+                chunk = []
+            chunk.append(target)
+        self._send_many(send, command, chunk, message)
+
+    def _send_many(self, send, command, targets, message):
+        joined = ','.join(targets)
+        if len(targets) == 1 \
+                or payload_budget(self, command, joined) < len(message):
+            for target in targets:
+                send(target, message)
+        else:
+            self.sendLine('%s %s :%s' % (command, joined, message))
+
+    def connectionMade(self):
+        self.startup = {'connected': time()}
+        self.hostmask = None
+        self.tags = {}
+        self.caps = set()
+        self.batches = {}
+        self.recorder = getattr(self.factory, 'recorder', None)
+        if self.recorder is not None:
+            self.recorder.session(self.nickname)
+        irc.IRCClient.connectionMade(self)
+
+    def register(self, nickname, hostname='foo', servername='bar'):
+        """Negotiates IRCv3 capabilities before registering"""
+        self._caps_offered = []
+        self.sendLine('CAP LS 302')
+        irc.IRCClient.register(self, nickname, hostname, servername)
+
+    def lineReceived(self, line):
+        if self.recorder is not None:
+            self.recorder.record(line)
+        if line[:1] == '@':
+            tags, line = line[1:].split(' ', 1)
+            self.tags = parse_tags(tags)
+        elif self.tags:
+            self.tags = {}
+        irc.IRCClient.lineReceived(self, line)
+
+    def irc_CAP_(self, prefix, params):
+        subcommand = params[1]
+        if subcommand == 'LS':
+            if len(params) > 3 and params[2] == '*':
+                # more to come
+                self._caps_offered.extend(params[3].split())
+                return
+            self._caps_offered.extend(params[-1].split())
+            offered = set(cap.split('=', 1)[0] for cap in self._caps_offered)
+            wanted = [cap for cap in config.getlist('Server', 'capabilities')
+                if cap in offered]
+            if wanted:
+                self.sendLine('CAP REQ :%s' % ' '.join(wanted))
+            else:
+                self.sendLine('CAP END')
+        elif subcommand == 'ACK':
+            for cap in params[-1].split():
+                if cap.startswith('-'):
+                    self.caps.discard(cap[1:])
+                else:
+                    self.caps.add(cap)
+            log.msg(_("Enabled capabilities: {0}").format(' '.join(sorted(self.caps))))
+            if not self._registered:
+                self.sendLine('CAP END')
+        elif subcommand == 'NAK':
+            if not self._registered:
+                self.sendLine('CAP END')
+        elif subcommand == 'DEL':
+            for cap in params[-1].split():
+                self.caps.discard(cap)
+
+    def irc_ACCOUNT_(self, prefix, params):
+        """account-notify"""
+        account = params[0]
+        if account == '*':
+            account = None
+        self.notify('userAccountChanged', prefix, account)
+
+    def irc_AWAY_(self, prefix, params):
+        """away-notify"""
+        if params and params[-1]:
+            self.notify('userAway', prefix, params[-1])
+        else:
+            self.notify('userAway', prefix, None)
+
+    def irc_CHGHOST_(self, prefix, params):
+        """chghost"""
+        ident, host = params[:2]
+        if prefix.split('!', 1)[0] == self.nickname:
+            self.hostmask = '%s!%s@%s' % (self.nickname, ident, host)
+        self.notify('userHostChanged', prefix, ident, host)
+
+    def irc_BATCH_(self, prefix, params):
+        """batch: lines tagged with an open batch's reference come in a
+        burst, handlers can wait for batchEnded before reacting"""
+        ref = params[0]
+        if ref[0] == '+':
+            self.batches[ref[1:]] = params[1:]
+            self.notify('batchStarted', ref[1:], *params[1:])
+        elif ref[0] == '-':
+            batch = self.batches.pop(ref[1:], [])
+            self.notify('batchEnded', ref[1:], *batch)
+
+    def connectionLost(self, reason):
+        self.notify('disconnected')
+        if self.factory.config_watcher is not None:
+            self.factory.config_watcher.attach(None)
+        self.outqueue.stop()
+        self.timers.stop()
+        if self.recorder is not None:
+            self.recorder.flush()
+        irc.IRCClient.connectionLost(self, reason)
+
     def signedOn(self):
         """called when the bot connects: joins channels"""
         self.prompts = {'PM':{}}
         self.more_buffer = {}
-        self.channel = self.factory.channels[0]
-
-        self.preload_modules()
-        self.load_modules_config()
-        config.parse_configs()
-        self.load_modules()
+        self.home_channels = self.factory.channels
+        self.channel = self.home_channels[0]
+
+        self.factory.attempts = 0
+        if self.factory.modules is None:
+            start = time()
+            self.preload_modules()
+            discovered = time()
+            self.load_modules_config()
+            config.parse_configs()
+            configured = time()
+            try:
+                self.load_modules()
+            except template.TemplateError as e:
+                for problem in str(e).splitlines():
+                    log.msg(_("Bad message %s") % problem)
+                log.msg(_("Fix the messages above and restart the bot."))
+                self.quit(_("Bad configuration"))
+                reactor.stop()
+                return
+            self.factory.modules = self.export_modules()
+            self.log_module_times(start, discovered, configured)
+            if config.getboolean('Bot', 'watch config'):
+                self.factory.config_watcher = ConfigWatcher(self)
+                self.factory.config_watcher.start()
+        else:
+            self.adopt_modules(self.factory.modules)
+            if self.factory.config_watcher is not None:
+                self.factory.config_watcher.attach(self)
 
         d = self.fire('signedOn')
         def _joinChannels(*args, **kwargs):
             self.joinChannels()
         d.addCallback(_joinChannels)
 
+    def _load(self, module):
+        """Loads a module, then checks the message templates it uses
+
+        @raises template.TemplateError: if one can't be used, while the
+            bot is starting. Modules loaded later on only log them."""
+        Modable._load(self, module)
+        try:
+            template.check(config, self.home_channels,
+                self.available_modules.entries[module]['module'])
+        except template.TemplateError as e:
+            if self.factory.modules is None:
+                raise
+            for problem in str(e).splitlines():
+                log.msg(_("Bad message %s") % problem)
+
+    def check_templates(self):
+        """Checks the message templates of the modules loaded so far
+
+        @raises template.TemplateError: listing the problems found"""
+        problems = []
+        for name, m in self.modules.iteritems():
+            if isinstance(m, LazyModule):
+                continue
+            try:
+                template.check(config, self.home_channels,
+                    self.available_modules.entries[name]['module'])
+            except template.TemplateError as e:
+                problems.append(str(e))
+        if problems:
+            raise template.TemplateError('\n'.join(problems))
+
+    def config_changed(self, sections):
+        """Called once changes to the configuration files are applied,
+        passes them on to modules as the configChanged event
+
+        @param sections: names of the sections that changed"""
+        if any(section.startswith('Topic') for section in sections):
+            for topic in self.topics.itervalues():
+                topic.update()
+        self.notify('configChanged', sections)
+
+    def log_module_times(self, start, discovered, configured):
+        """Logs where the time loading modules went"""
+        log.msg(_("Modules loaded in {total:.3f}s: discovery {discovery:.3f}s "
+            "({how}), configs {configs:.3f}s, modules {modules:.3f}s.").format(
+                total=time() - start,
+                discovery=discovered - start,
+                how=_("scanned") if self.available_modules.scanned
+                    else _("from manifest"),
+                configs=configured - discovered,
+                modules=time() - configured))
+        MODULES_LOG.info("Module load times: {0}", ', '.join(
+            '%s %.1fms' % (name, seconds * 1000) for name, seconds in
+            sorted(self.module_seconds.iteritems(), key=lambda i: -i[1])))
+
     def joinChannels(self):
         """called when all is good to join channels"""
         log.msg("Joining channels {0}".format(self.factory.channels))
@@ -121,40 +438,83 @@ class IrcBot(irc.IRCClient, Modable):
             key = self.channelpws.get(channel, None)
             self.join(channel, key)
 
+    def home_channel(self, channel):
+        """@returns: channel as spelt in the configuration if it is one
+        of our home channels, else None"""
+        channel = channel.lower()
+        for home in self.home_channels:
+            if home.lower() == channel:
+                return home
+
     def joinedHomeChannel(self):
-        self.topic = Topic(self)
+        self.topic = self.topics[self.channel]
 
     def joined_(self, channel):
-        FetchedList.get_users(self, channel).get()
+        # The server sends NAMES right after we join
+        users = FetchedList.get_users(self, channel)
+        users.expect()
         self.prompts[channel] = {}
+        home = self.home_channel(channel)
+        if home is not None:
+            self.topics[home] = Topic(self, home)
         if channel == self.channel:
+            self.startup['joined'] = time()
+            users.get().addCallback(self._homeRosterReady)
             self.fire('joinedHomeChannel')
 
+    def _homeRosterReady(self, roster):
+        """Logs how long it took to get ready"""
+        if 'ready' in self.startup:
+            return
+        self.startup['ready'] = time()
+        log.msg(_("Ready in {total:.3f}s: registered after {registered:.3f}s, "
+            "joined after {joined:.3f}s, {users} users.").format(
+                total=self.startup['ready'] - self.startup['connected'],
+                registered=self.startup['welcome'] - self.startup['connected'],
+                joined=self.startup['joined'] - self.startup['connected'],
+                users=len(roster)))
+        self.notify('ready')
+
+    def topicUpdated_(self, user, channel, newTopic):
+        home = self.home_channel(channel)
+        if home in self.topics:
+            self.topics[home].seen(newTopic)
+
     def privmsg_(self, user, channel, message):
         """when we receive a message"""
+        routed = self.router.route(channel, message)
+        if routed is None:
+            return
+        self.limiter.submit(user, routed[1],
+            self._dispatch, user, channel, message, routed)
+
+    def _dispatch(self, user, channel, message, routed):
         log.callWithContext(
             {'system': user},
-            LineProcessor, self, user, channel, message)
+            LineProcessor, self, user, channel, message, routed)
 
     def irc_JOIN_(self, prefix, params):
         nick = prefix.split('!')[0]
-        channel = params[-1]
+        channel = params[0]
         if nick == self.nickname:
-            self.fire('joined', channel)
+            self.hostmask = prefix
+            self.notify('joined', channel)
         else:
-            self.fire('userJoined', prefix, channel)
+            self.notify('userJoined', prefix, channel)
+            if 'extended-join' in self.caps and params[1] != '*':
+                self.notify('userAccountChanged', prefix, params[1])
 
     def irc_PART_(self, prefix, params):
         nick = prefix.split('!')[0]
         channel = params[-1]
         if nick == self.nickname:
-            self.fire('left', channel)
+            self.notify('left', channel)
         else:
-            self.fire('userLeft', prefix, channel)
+            self.notify('userLeft', prefix, channel)
 
     def irc_QUIT_(self, prefix, params):
         message = params[-1]
-        self.fire('userQuit', prefix, message)
+        self.notify('userQuit', prefix, message)
 
     def irc_KICK_(self, prefix, params):
         kicker = prefix
@@ -163,56 +523,79 @@ class IrcBot(irc.IRCClient, Modable):
         message = params[-1]
 
         if kicked == self.nickname:
-            self.fire('kickedFrom', channel, kicker, message)
+            self.notify('kickedFrom', channel, kicker, message)
         else:
             d = FetchedList.get_users(self, channel).get()
             def _fireEvent(userlist):
-                for nick, ident, host, flags in userlist:
-                    if nick == kicked:
-                        self.fire('userKicked', 
-                            '%s!%s@%s' % (nick, ident, host),
-                            channel, kicker, message)
+                user = userlist.get(kicked)
+                if user is not None:
+                    self.notify('userKicked', user.mask(),
+                        channel, kicker, message)
             d.addCallback(_fireEvent)
 
-    def fire(self, event, *args, **kwargs):
-        func = kwargs.pop('fire_event_func', all)
-        if config.debug:
-            log.msg("Event %s fired with args %s, kwargs %s" % (event, args, kwargs))
+    def _observe_event(self, event, spent):
+        EVENT_SECONDS.observe(spent, event=event)
 
-        dl = []
+    def roster_sizes(self):
+        """@returns: {(channel,): number of users}"""
+        return dict(((cmd[len('NAMES '):],), len(fetched.contents))
+            for cmd, fetched in self.fetching_lists.iteritems()
+            if cmd.startswith('NAMES ') and fetched.contents is not None)
 
-        if event in self.eventhandlers:
-            for callback in self.eventhandlers[event]:
-                dl.append(defer.maybeDeferred(callback, *args, **kwargs))
+    def fire(self, event, *args, **kwargs):
+        """Calls handlers for event, see L{EventBus.fire}
 
-        d = defer.DeferredList(dl)
+        @returns: Deferred"""
+        return self.events.fire(event, *args, **kwargs)
 
-        def _gotResults(l):
-            if l:
-                l_ = zip(*l)[1]
-            else:
-                l_ = []
-            return func(l_)
+    def notify(self, event, *args, **kwargs):
+        """Calls handlers for event when the results don't matter"""
+        self.events.notify(event, *args, **kwargs)
 
-        return d.addCallback(_gotResults)
+    def casemapping(self):
+        """the server's CASEMAPPING"""
+        return self.supported.getFeature('CASEMAPPING', ('rfc1459',))[0]
+
+    def prefix_modes(self):
+        """Maps nickname prefixes like @ to channel modes like o"""
+        return dict(
+            (prefix, mode)
+            for mode, (prefix, priority)
+            in self.supported.getFeature('PREFIX', {}).iteritems()
+            )
 
-    def is_admin(self, user, nick):
-        return self.fire('is_admin', user, nick, fire_event_func=any)
+    def is_admin(self, user, nick, channel=None):
+        """@param channel: home channel the command is about, the main
+            channel by default
+        @returns: Deferred, already fired when the answer was cached,
+        see L{AuthCache}"""
+        return self.auth.is_admin(user, nick, channel or self.channel)
 
     def welcome_(self, prefix, params):
         """As twisted's version of this is broken and completely ignores the
         CORRECT nickname given by the server, here's a proper version"""
         self._registered = True
+        self.startup['welcome'] = time()
         self.nickname = params[0]
+        # most servers end the welcome message with our hostmask
+        mask = params[-1].split()[-1] if params[-1].strip() else ''
+        if mask.startswith(self.nickname + '!') and '@' in mask:
+            self.hostmask = mask
         log.msg(_("Connected as {0}").format(self.nickname))
         self.signedOn()
 
+    def irc_354(self, prefix, params):
+        """RPL_WHOSPCRPL, replies to WHOX queries"""
+        self.notify('irc_RPL_WHOSPCRPL', prefix, params)
+
     def cmsg(self, message):
         """shorthand for sending channel messages"""
         return self.msg(self.channel, message)
 
     def fetch_list(self, cmd, *args, **kwargs):
         if cmd not in self.fetching_lists:
+            kwargs.setdefault('min_refresh',
+                config.getduration('Bot', 'list refresh interval'))
             self.fetching_lists[cmd] = \
                 FetchedList(self, cmd, *args, **kwargs)
         return self.fetching_lists[cmd]
@@ -226,43 +609,73 @@ class IrcBot(irc.IRCClient, Modable):
         'irc_RPL_WHOREPLY', 'irc_RPL_ENDOFWHO',
         'irc_unknown', 'irc_RPL_NAMREPLY', 'irc_RPL_ENDOFNAMES',
         'irc_RPL_BANLIST', 'irc_RPL_ENDOFBANLIST',
-        'irc_RPL_WELCOME']
+        'irc_RPL_WELCOME',
+        'irc_CAP', 'irc_ACCOUNT', 'irc_AWAY', 'irc_CHGHOST', 'irc_BATCH']
     @classmethod
     def do_import_events(cls):
         def make_func(eventname):
             def func(self, *args, **kwargs):
-                self.fire(eventname, *args, **kwargs)
+                self.events.notify(eventname, *args, **kwargs)
             return func
         for evt in cls.import_events:
             setattr(cls, evt, make_func(evt))
 IrcBot.do_import_events()
 
 class IrcBotFactory(protocol.ClientFactory):
+    """Makes the bot's connections
+
+    @ivar modules: the modules loaded on the first connection, which
+        later connections adopt, see L{Modable.export_modules}
+    @ivar attempts: how many times we tried to reconnect since the bot
+        last signed on
+    @ivar config_watcher: L{ConfigWatcher}, or None if watch config is
+        off"""
     protocol = IrcBot
 
     def __init__(self):
         self.channels = config.getlist('Server', 'channels')
         self.nickname = config.get('Bot', 'nickname')
+        self.timers = TimerWheel()
+        self.recorder = Recorder.from_config()
+        self.modules = None
+        self.attempts = 0
+        self.config_watcher = None
+
+    def reconnect_delay(self):
+        """@returns: how long to wait before the next attempt: doubles
+        with each attempt from reconnect delay up to connect retry delay,
+        less up to half of it at random so that bots dropped by the same
+        netsplit do not all come back at once"""
+        delay = min(
+            config.getint('Bot', 'reconnect delay') * 2 ** min(self.attempts, 16),
+            config.getint('Bot', 'connect retry delay'))
+        self.attempts += 1
+        return delay * random.uniform(.5, 1)
 
     def clientConnectionLost(self, connector, reason):
-        delay = config.getint('Bot', 'reconnect delay')
-        log.err("Connection lost (%s), reconnecting in %d seconds." %(reason, delay))
-        reactor.callLater(delay, connector.connect)
+        delay = self.reconnect_delay()
+        log.err("Connection lost (%s), reconnecting in %.1f seconds." %(reason, delay))
+        self.timers.schedule('reconnect', delay, connector.connect)
 
     def clientConnectionFailed(self, connector, reason):
-        delay = config.getint('Bot', 'connect retry delay')
-        log.err("Could not connect (%s), trying again in %d seconds." %(reason, delay))
-        reactor.callLater(delay, connector.connect)
+        delay = self.reconnect_delay()
+        log.err("Could not connect (%s), trying again in %.1f seconds." %(reason, delay))
+        self.timers.schedule('reconnect', delay, connector.connect)
 
 class FetchedList:
-    """utility class to read lists like banlists or userlist"""
+    """utility class to read lists like banlists or userlist
+
+    At most one fetch is in flight at once, and refreshes asked for less
+    than min_refresh seconds after the last fetch are served from what is
+    already known."""
 
     def __init__(
             self, bot, cmd, line, end, update=None, other=None,
             check_line=lambda prefix, x, contents: [x],
             check_end=lambda prefix, x, contents: True,
             check_update=lambda prefix, x, contents: [x],
-            check_other=lambda name, prefix, x, contents: ([x], [])
+            check_other=lambda name, prefix, x, contents: ([x], []),
+            new_contents=list, min_refresh=0
             ):
         if other == None:
             other = []
@@ -277,16 +690,21 @@ class FetchedList:
         self.check_end = check_end
         self.check_update = check_update
         self.check_other = check_other
+        self.new_contents = new_contents
+        self.min_refresh = min_refresh
+        self.fetched_at = None
 
         self.fetching = False
         self.contents = None
         self.deferred = None
+        self.update_pending = False
 
         for func, event in \
                 [
                     (self._line, line),
                     (self._end, end),
                     (self._update, update),
+                    (self._batchEnded, 'batchEnded'),
                 ] + [
                     (self._make_other_wrapper(event), event)
                     for event in other
@@ -298,6 +716,9 @@ class FetchedList:
             bot.eventhandlers[event].append(func)
 
     def get(self, refresh=False):
+        if refresh and self.fetched_at is not None \
+                and self.fetched_at + self.min_refresh > time():
+            refresh = False
         if not self.fetching and (refresh or self.contents == None):
             return self._refetch()
         elif self.fetching:
@@ -313,12 +734,19 @@ class FetchedList:
         self.deferred.addCallback(_cb)
         return d
 
-    def _refetch(self):
+    def expect(self):
+        """Starts reading the list without asking for it, for when the
+        server sends it on its own"""
+        if not self.fetching:
+            self._refetch(send=False)
+
+    def _refetch(self, send=True):
         self.fetching = True
-        self.contents = []
+        self.contents = self.new_contents()
         self.deferred = defer.Deferred()
 
-        self.bot.sendLine(self.cmd)
+        if send:
+            self.bot.sendLine(self.cmd)
 
         return self._give_current_deferred()
 
@@ -344,6 +772,7 @@ class FetchedList:
             self.contents.extend(end)
 
         self.fetching = False
+        self.fetched_at = time()
 
         self.deferred.callback(self.contents)
         
@@ -359,9 +788,9 @@ class FetchedList:
 
         add, remove = r
 
-        self.contents.extend(add)
         for to_remove in remove:
             self.contents.remove(to_remove)
+        self.contents.extend(add)
 
         if add or remove:
             self._fire_update()
@@ -379,97 +808,183 @@ class FetchedList:
             return
         add, remove = r
 
-
-        self.contents.extend(add)
         for to_remove in remove:
             self.contents.remove(to_remove)
+        self.contents.extend(add)
 
         self._fire_update()
 
     def _fire_update(self):
-        self.bot.fire('FetchedList %s updated' % self.cmd)
+        if self.bot.batches:
+            # wait for the end of the burst
+            self.update_pending = True
+            return
+        self.bot.notify('FetchedList %s updated' % self.cmd)
+
+    def _batchEnded(self, *args):
+        if self.update_pending and not self.bot.batches:
+            self.update_pending = False
+            self._fire_update()
 
     @classmethod
     def get_users(cls, bot, channel):
+        """The channel's L{Roster}, read from NAMES
 
-        def _check_line(args, contents):
-            me, channel_, ident, host, server, nick, flags_, hops = \
-                tuple(args[1])
-
-            flags = []
+        Idents and hosts may be missing, see L{get_userhosts}."""
+        prefix_modes = bot.prefix_modes()
+        modes = set(prefix_modes.values())
 
-            if '@' in flags_:
-                flags.append('o')
+        def _check_line(args, contents):
+            channel_, names = args[1][-2:]
 
-            if '+' in flags_:
-                flags.append('v')
+            if contents.fold(channel_) != contents.fold(channel):
+                return
 
-            if channel_.lower() == channel.lower():
-                return [(nick, ident, host, flags)]
+            users = []
+            for name in names.split():
+                flags = set()
+                while name and name[0] in prefix_modes:
+                    flags.add(prefix_modes[name[0]])
+                    name = name[1:]
+                if '!' in name:
+                    nick, userhost = name.split('!', 1)
+                    ident, host = userhost.split('@', 1)
+                    users.append(RosterEntry(nick, ident, host, flags))
+                else:
+                    users.append(RosterEntry(name, flags=flags))
+            return users
 
         def _check_end(args, contents):
             me, channel_, message = tuple(args[1])
-            if channel_.lower() == channel.lower():
+            if contents.fold(channel_) == contents.fold(channel):
                 return True
 
         def _check_other(event, args, contents):
+            # Changes are made in place, ([], []) only tells the list was
+            # updated.
             if event == 'modeChanged':
-                author, channel_, set, modes, args = args
+                author, channel_, set, modes_, args = args
 
                 if channel_ != channel:
                     return
 
-                for mode, arg in zip(modes, args):
-                    if mode in 'ov':
-                        for nick, ident, host, flags in contents:
-                            if nick == arg:
-                                flags_ = flags[:]
-                                if set:
-                                    flags_.append(mode)
-                                else:
-                                    if mode in flags:
-                                        flags_.remove(mode)
-                                return (
-                                        [(nick, ident, host, flags_)],
-                                        [(nick, ident, host, flags)]
-                                    )
+                changed = False
+                for mode, arg in zip(modes_, args):
+                    if mode not in modes:
+                        continue
+                    user = contents.get(arg)
+                    if user is None:
+                        continue
+                    if set:
+                        user.flags.add(mode)
+                    else:
+                        user.flags.discard(mode)
+                    changed = True
+                if changed:
+                    return ([], [])
 
             elif event == 'userRenamed':
                 oldnick, newnick = args
 
-                for nick, ident, host, flags in contents:
-                    if nick == oldnick:
-                        return (
-                                [(newnick, ident, host, flags)],
-                                [(oldnick, ident, host, flags)]
-                            )
+                if contents.rename(oldnick, newnick) is not None:
+                    return ([], [])
+
+            elif event == 'userAccountChanged':
+                user = contents.get(args[0].split('!')[0])
+                if user is not None:
+                    user.account = args[1]
+                    return ([], [])
+
+            elif event == 'userAway':
+                user = contents.get(args[0].split('!')[0])
+                if user is not None:
+                    user.away = args[1]
+
+            elif event == 'userHostChanged':
+                if contents.set_host(args[0].split('!')[0], *args[1:]):
+                    return ([], [])
 
             elif event in ('userLeft', 'userKicked', 'userQuit', 'userJoined'):
                 user = args[0]
 
                 channel_ = args[1]
 
+                if event != 'userQuit' and channel_ != channel:
+                    return
+
                 nick = user.split('!')[0]
                 ident = user.split('!')[1].split('@')[0]
                 host = user.split('@')[1]
 
-                if event != 'userQuit' and channel_ != channel:
-                    return
-
                 if event == 'userJoined':
-                    return ([(nick, ident, host, [])], [])
-                else:
-                    for nick_, ident_, host_, flags in contents:
-                        if nick_ == nick:
-                            return ([], [(nick, ident, host, flags)])
+                    return ([RosterEntry(nick, ident, host)], [])
+                elif contents.discard(nick) is not None:
+                    return ([], [])
 
         return bot.fetch_list(
-            cmd='WHO %s' % channel,
-            line='irc_RPL_WHOREPLY', check_line=_check_line,
-            end='irc_RPL_ENDOFWHO', check_end=_check_end,
+            cmd='NAMES %s' % channel,
+            line='irc_RPL_NAMREPLY', check_line=_check_line,
+            end='irc_RPL_ENDOFNAMES', check_end=_check_end,
             other=['userJoined', 'userLeft', 'userKicked',
-                'userQuit', 'userRenamed', 'modeChanged'],
-            check_other=_check_other)
+                'userQuit', 'userRenamed', 'modeChanged',
+                'userAccountChanged', 'userAway', 'userHostChanged'],
+            check_other=_check_other,
+            new_contents=lambda: Roster(bot.casemapping()))
+
+    @classmethod
+    def get_userhosts(cls, bot, channel):
+        """The channel's L{Roster}, with everyone's ident and host
+
+        Asks the server with WHO (only for the fields we use if it supports
+        WHOX) when they aren't all known yet."""
+        def _gotUsers(roster):
+            if not roster.hostless:
+                return roster
+            return cls._get_who(bot, channel, roster).get(refresh=True)
+        return cls.get_users(bot, channel).get().addCallback(_gotUsers)
+
+    WHOX_TOKEN = '152'
+
+    @classmethod
+    def _get_who(cls, bot, channel, roster):
+        """Fills in roster's idents and hosts from WHO replies"""
+        prefix_modes = bot.prefix_modes()
+
+        def _fill(channel_, ident, host, nick, flags_, contents):
+            if contents.fold(channel_) != contents.fold(channel):
+                return
+            user = contents.set_host(nick, ident, host)
+            if user is not None:
+                user.flags.update(
+                    prefix_modes[c] for c in flags_ if c in prefix_modes)
+
+        def _check_who(args, contents):
+            me, channel_, ident, host, server, nick, flags_, hops = \
+                tuple(args[1])
+            _fill(channel_, ident, host, nick, flags_, contents)
+
+        def _check_whox(args, contents):
+            me, token, channel_, ident, host, nick, flags_ = tuple(args[1])[:7]
+            if token == cls.WHOX_TOKEN:
+                _fill(channel_, ident, host, nick, flags_, contents)
+
+        def _check_end(args, contents):
+            me, channel_, message = tuple(args[1])
+            if contents.fold(channel_) == contents.fold(channel):
+                return True
+
+        if bot.supported.hasFeature('WHOX'):
+            return bot.fetch_list(
+                cmd='WHO %s %%tcuhnf,%s' % (channel, cls.WHOX_TOKEN),
+                line='irc_RPL_WHOSPCRPL', check_line=_check_whox,
+                end='irc_RPL_ENDOFWHO', check_end=_check_end,
+                new_contents=lambda: cls.get_users(bot, channel).contents)
+        else:
+            return bot.fetch_list(
+                cmd='WHO %s' % channel,
+                line='irc_RPL_WHOREPLY', check_line=_check_who,
+                end='irc_RPL_ENDOFWHO', check_end=_check_end,
+                new_contents=lambda: cls.get_users(bot, channel).contents)
 
     @classmethod
     def get_bans(cls, bot, channel):
@@ -530,119 +1045,189 @@ class FetchedList:
         nick = user.split('!')[0]
 
         def _gotList(l):
-            for nick_, ident, host, flags in l:
-                if nick_ == nick:
-                    if flag in flags:
-                        return True
-                    else:
-                        return False
+            user = l.get(nick)
+            if user is not None:
+                return flag in user.flags
 
         return cls.get_users(bot, channel).get().addCallback(_gotList)
 
     @classmethod
-    def bot_has_op(cls, bot):
-        return cls.has_flag(bot, bot.channel, bot.nickname, 'o')
+    def bot_has_op(cls, bot, channel=None):
+        if channel is None:
+            channel = bot.channel
+        return bot.auth.bot_has_op(channel,
+            lambda: cls.has_flag(bot, channel, bot.nickname, 'o'))
+
+class CommandRouter:
+    """Tells commands addressed to the bot apart from channel chatter.
+
+    The command prefix and mention matchers are cached and only rebuilt
+    when the bot's nickname or the configuration changes, so that
+    rejecting an ordinary channel line costs a couple of string
+    comparisons."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._key = None
+
+    def _rebuild(self, key):
+        self.nickname = key[1]
+        self.prefix = config.get('Bot', 'command prefix')
+        self.prefix_len = len(self.prefix)
+        if config.getboolean('Bot', 'allow mentions'):
+            self.mention = re.compile(
+                '^'+re.escape(self.nickname)+'[^A-Za-z0-9 ]\W*(.*)')
+        else:
+            self.mention = None
+        self.warn_unknown = config.getboolean('Bot', 'warn on unknown command')
+        self._key = key
+
+    def route(self, channel, message):
+        """Finds out if message is a command for the bot
+
+        @returns: (context, command, args) or None if the message isn't
+            addressed to the bot"""
+        key = (config.generation, self.bot.nickname)
+        if key != self._key:
+            self._rebuild(key)
+
+        if channel[0] == '#':
+            if message.startswith(self.prefix):
+                command = message[self.prefix_len:]
+                context = LineProcessor.CONTEXT_COMMAND
+            elif self.mention is not None \
+                    and message.startswith(self.nickname):
+                m = self.mention.match(message)
+                if not m:
+                    return
+                command = m.group(1)
+                context = LineProcessor.CONTEXT_MENTION
+            else:
+                # chanmsg
+                return
+        elif channel == self.nickname:
+            command = message
+            context = LineProcessor.CONTEXT_PRIVATE
+        else:
+            return
+
+        args = command.split()
+        if not args:
+            return
+        return context, args.pop(0).lower(), args
 
 class LineProcessor:
     CONTEXT_PRIVATE = 0
     CONTEXT_COMMAND = 1
     CONTEXT_MENTION = 2
     CONTEXT_NORMAL = 3
-    def __init__(self, bot, user, channel, message):
+    def __init__(self, bot, user, channel, message, routed=None):
+        """Handles a command
+
+        @param routed: result of L{CommandRouter.route} for this message
+            if the caller already has it"""
         self.bot = bot
         self.user = user
         self.nick = user.split('!',1)[0]
         self.channel = channel
-        command = str()
+        self.message = message
 
-        if channel[0]=='#':
-            if message.startswith(config.get('Bot', 'command prefix')):
-                command = message[len(config.get('Bot', 'command prefix')):]
-                self.context = self.CONTEXT_COMMAND
-            else:
-                m = re.match( '^'+re.escape(self.bot.nickname)+'[^A-Za-z0-9 ]\W*(.*)', message )
-                if m and config.getboolean('Bot', 'allow mentions'):
-                    command = m.group(1)
-                    self.context = self.CONTEXT_MENTION
-                else:
-                    # chanmsg
-                    return
-        elif channel == self.bot.nickname:
-            command = message
-            self.context = self.CONTEXT_PRIVATE
-            self.channel = 'PM'
-        else:
-            return
+        if routed is None:
+            routed = bot.router.route(channel, message)
+            if routed is None:
+                return
 
-        self.args = command.split()
-        self.cmd = self.args.pop(0).lower()
+        self.context, self.cmd, self.args = routed
+        if self.context == self.CONTEXT_PRIVATE:
+            self.channel = 'PM'
 
         if self.cmd in ['yes', 'no']:
             self._handle_confirm_reply()
             return
 
         if self.cmd == 'more':
-            log.msg(_("{0} asked for more"))
+            COMMANDS_LOG.info(_("{0} asked for more"), self.nick)
             self._handleMore()
             return
 
         if self.cmd not in self.bot.commands:
-            log.msg(_("{0} attempted to use unknown command {1}.").format(self.nick, self.cmd))
-            if config.getboolean('Bot', 'warn on unknown command'):
+            COMMANDS_LOG.info(_("{0} attempted to use unknown command {1}."), self.nick, self.cmd)
+            if bot.router.warn_unknown:
                 self.reply(_("Unknown command %s.") % self.cmd)
             return
 
         flags = self.bot.commands[self.cmd][1]
-        can_run = []
-        if flags & COMMAND.ADMIN:
-            def _knowIs_admin(is_admin):
-                if not is_admin:
-                    log.msg(_("{0} attempted to use admin command {1}.").format(self.nick, self.cmd))
-                    raise InputError(_("Command %s is only available to admins.") % self.cmd)
-                else:
-                    return True
-            can_run.append(
-                self.bot.is_admin(self.user, self.nick)\
-                    .addCallback(_knowIs_admin)
-                )
 
         if self.context == self.CONTEXT_PRIVATE and flags & COMMAND.NOT_FROM_PM:
-            log.msg(_("{0} attempted to use command {1} in a PM.").format(self.nick, self.cmd))
-            can_run.append(defer.fail(InputError(
-                _("Command %s cannot be used in private.") % self.cmd)))
-        else:
-            can_run.append(defer.succeed(True))
+            COMMANDS_LOG.info(_("{0} attempted to use command {1} in a PM."), self.nick, self.cmd)
+            self.reply(_("Command %s cannot be used in private.") % self.cmd)
+            return
 
         if self.context == self.CONTEXT_COMMAND and flags & COMMAND.NOT_FROM_CHANNEL:
-            log.msg(_("{0} attempted to use command {1} in a channel.").format(self.nick, self.cmd))
-            can_run.append(defer.fail(InputError(
-                _("Command {0} cannot be used in public.").format(self.cmd))))
-        else:
-            can_run.append(defer.succeed(True))
+            COMMANDS_LOG.info(_("{0} attempted to use command {1} in a channel."), self.nick, self.cmd)
+            self.reply(_("Command {0} cannot be used in public.").format(self.cmd))
+            return
 
-        def _canRun(true):
-            log.msg(message)
-            try:
-                d = log.callWithContext({'system': 'pypickupbot %s %s'%(self.channel,self.cmd)}, self.bot.commands[self.cmd][0], self, self.args)
-                if isinstance(d, defer.Deferred):
-                    d.addErrback(_catchInputError).addErrback(_catchInternalError)
-            except InputError as e:
-                self.reply(str(e))
-            except Exception as e:
-                self.reply(_("Internal error."))
-                log.err()
-
-        def _catchInputError(f):
-            t = f.trap(InputError)
-            self.reply(str(f.value))
-        
-        def _catchInternalError(f):
-            f.trap(Exception)
+        if not flags & COMMAND.ADMIN:
+            # Nothing to wait for, run the command right away
+            self._run()
+            return
+
+        def _knowIs_admin(is_admin):
+            if not is_admin:
+                COMMANDS_LOG.info(_("{0} attempted to use admin command {1}."), self.nick, self.cmd)
+                raise InputError(_("Command %s is only available to admins.") % self.cmd)
+            self._run()
+
+        channel = self.admin_channel()
+        if self.bot.auth.cached_admin(self.nick, channel):
+            self._run()
+            return
+
+        self.bot.is_admin(self.user, self.nick, channel)\
+            .addCallback(_knowIs_admin)\
+            .addErrback(self._catchInputError)\
+            .addErrback(self._catchInternalError)
+
+    def admin_channel(self):
+        """@returns: the home channel admin rights are checked in: the
+        one the command is about, like L{ChannelModules.for_call} finds"""
+        if self.channel != 'PM':
+            return self.bot.home_channel(self.channel) or self.bot.channel
+        if self.args:
+            return self.bot.home_channel(self.args[0]) or self.bot.channel
+        return self.bot.channel
+
+    def _run(self):
+        """Runs the command once all checks passed"""
+        COMMANDS_LOG.info(self.message)
+        COMMANDS.inc(command=self.cmd)
+        start = time()
+        try:
+            d = log.callWithContext({'system': 'pypickupbot %s %s'%(self.channel,self.cmd)}, self.bot.commands[self.cmd][0], self, self.args)
+            if isinstance(d, defer.Deferred):
+                d.addErrback(self._catchInputError).addErrback(self._catchInternalError)
+                d.addBoth(self._observe, start)
+                return
+        except InputError as e:
+            self.reply(str(e))
+        except Exception as e:
             self.reply(_("Internal error."))
-            f.printTraceback()
+            log.err()
+        self._observe(None, start)
 
-        defer.DeferredList(can_run, fireOnOneErrback=True, consumeErrors=True)\
-            .addCallbacks(_canRun, _catchInputError).addErrback(_catchInternalError)
+    def _observe(self, result, start):
+        COMMAND_SECONDS.observe(time() - start, command=self.cmd)
+        return result
+
+    def _catchInputError(self, f):
+        f.trap(InputError)
+        self.reply(str(f.value))
+
+    def _catchInternalError(self, f):
+        f.trap(Exception)
+        self.reply(_("Internal error."))
+        f.printTraceback()
 
     def printError(self, f):
         print('in printerror')
@@ -654,51 +1239,41 @@ class LineProcessor:
         
 
     def reply(self, msg, split=" "):
-        """Reply to whoever sent this"""
-        if len("PRIVMSG %s %s\n"%(self.nick, msg)) > 255:
-            self._split_reply(msg, split, 0)
-            return
-        log.msg('Replying to %s: %s'%(self.nick, msg))
-        # FIXME - encoding should be set somewhere - FIXME
-        if isinstance(msg, unicode):
-            msg = msg.encode("utf-8")
-        self.bot.notice(self.nick, msg)
-        
-
-    def _split_reply(self, msg, split, times):
-        """Splits a reply into multiple messages.
-        
-        @arg splitpoint: what pattern is it best to split at?"""
-        times += 1
-        added_len = len("PRIVMSG %s \n"%self.nick)
-        if len(msg) + added_len <= 255:
-            self.reply(msg)
-        else:
-            more_suffix = ""
-            if times == config.getint("Bot", "max reply splits before waiting"):
-                more_suffix = split \
-                    + _("Reply is too long, use \x02%(prefix)smore\x02 to continue reading.")\
-                    % {'prefix':config.get('Bot', 'command prefix')}
-            added_len += len(more_suffix)
-            m = re.match("^(?P<send>.{0,%d})%s(?P<rest>.*?)$"\
-                % (255-added_len, re.escape(split)), msg)
-            if not m:
-                # If we can't split conveniently, cut straight in
-                self.reply(msg[:255-added_len]+more_suffix)
-                rest = msg[255-added_len:]
-            else:
-                self.reply(m.group('send')+more_suffix)
-                rest = m.group('rest')
-            if len(more_suffix):
-                t = time()
-                self.bot.more_buffer[self.nick] = (rest, t)
-                reactor.callLater(60, self._dropMoreBuffer, t)
-            else:
-                self._split_reply(rest, split, times)
-
-    def _dropMoreBuffer(self, t):
-        if self.nick in self.bot.more_buffer and self.bot.more_buffer[self.nick][1] == t:
+        """Reply to whoever sent this
+
+        Long replies are cut into several notices, see L{Paginator}.
+        @param split: what it is best to split at"""
+        REPLIES_LOG.info("Replying to {0}: {1}", self.nick, msg)
+        self._page(Paginator(msg, split))
+
+    def _page(self, pager):
+        """Sends a page of a long reply, and stores the rest for the
+        more command"""
+        budget = payload_budget(self.bot, 'NOTICE', self.nick)
+        max_splits = config.getint("Bot", "max reply splits before waiting")
+        sent = 0
+        while pager.remaining() > budget:
+            sent += 1
+            if sent >= max_splits:
+                more_suffix = (pager.split
+                    + _("Reply is too long, use \x02%(prefix)smore\x02 to continue reading.")
+                    % {'prefix':config.get('Bot', 'command prefix')})
+                if isinstance(more_suffix, unicode):
+                    more_suffix = more_suffix.encode('utf-8')
+                self.bot.notice(self.nick,
+                    pager.take(budget - len(more_suffix)) + more_suffix)
+                self.bot.more_buffer[self.nick] = (pager, time())
+                self.bot.timers.schedule(('more', self.nick), 60,
+                    self.bot.more_buffer.pop, self.nick, None)
+                return
+            self.bot.notice(self.nick, pager.take(budget))
+        self.bot.notice(self.nick, pager.take(budget))
+        # only the reply the more command was reading is done, others
+        # leave it be
+        buffered = self.bot.more_buffer.get(self.nick)
+        if buffered is not None and buffered[0] is pager:
             del self.bot.more_buffer[self.nick]
+            self.bot.timers.cancel(('more', self.nick))
 
     def _handleMore(self):
         if self.nick in self.bot.more_buffer:
@@ -706,7 +1281,7 @@ class LineProcessor:
                 self.reply(_("Please wait between \x02%(prefix)smore\x02 calls.") \
                     % {'prefix':config.get('Bot', 'command prefix')})
             else:
-                self.reply(self.bot.more_buffer[self.nick][0])
+                self._page(self.bot.more_buffer[self.nick][0])
         else:
             self.reply(_("There's nothing more."))
 
@@ -731,19 +1306,21 @@ class LineProcessor:
         t = time()
         d = defer.Deferred()
         self.bot.prompts[self.channel][self.nick] = (d, t, assume)
-        reactor.callLater(60, self._removePrompt, t)
+        self.bot.timers.schedule(('prompt', self.channel, self.nick), wait,
+            self._removePrompt, t)
         return d
 
     def _handle_confirm_reply(self):
         if self.nick in self.bot.prompts[self.channel]:
             if self.cmd == 'yes':
                 ret = True
-                log.msg(_("Got confirmation from {0}").format(self.nick))
+                COMMANDS_LOG.info(_("Got confirmation from {0}"), self.nick)
             else:
                 ret = False
-                log.msg(_("Got deny from {0}").format(self.nick))
+                COMMANDS_LOG.info(_("Got deny from {0}"), self.nick)
             self.bot.prompts[self.channel][self.nick][0].callback(ret)
             del self.bot.prompts[self.channel][self.nick]
+            self.bot.timers.cancel(('prompt', self.channel, self.nick))
         else:
             raise InputError(_("No confirmation was expected from you."))
 
@@ -755,5 +1332,6 @@ def needOpped(f):
                 return f(self, call, args)
             else:
                 call.reply(_("I need to be opped to run this command."))
-        FetchedList.bot_has_op(self.pypickupbot).addCallback(do_call)
+        FetchedList.bot_has_op(self.pypickupbot,
+            getattr(self, 'channel', None)).addCallback(do_call)
     return wrapper
@@ -0,0 +1,254 @@
+#
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Leveled logging, written out by a background thread
+
+Loggers are cheap to call when their level is off: nothing is formatted.
+Messages that pass are queued with their arguments, and a thread formats
+and writes them. Twisted's own log messages are sent down the same queue
+once L{start} was called::
+
+    logger = get('commands')
+    logger.debug("{0} ran {1}", nick, cmd)
+
+Each logger can have its own level and keep only one message in so many,
+see L{configure}."""
+
+import sys
+import threading
+import Queue
+from datetime import datetime
+from time import time, strftime
+
+from twisted.internet import reactor
+from twisted.python import log, context
+from twisted.python.logfile import LogFile
+
+from pypickupbot import metrics
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+LEVEL_NAMES = dict((level, name.upper()) for name, level in LEVELS.iteritems())
+
+# arguments of these types can be formatted later on another thread
+IMMUTABLE = (str, unicode, int, long, float, bool, type(None))
+
+DROPPED = metrics.counter('pypickupbot_log_dropped_total',
+    'Log messages dropped because the log queue was full')
+
+class Logger:
+    """Logs messages about one part of the bot
+
+    @ivar level: messages below this level are ignored
+    @ivar every: only one message in this many is kept"""
+
+    def __init__(self, name, level=INFO, every=1):
+        self.name = name
+        self.level = level
+        self.every = every
+        self.count = 0
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, message, *args, **kwargs):
+        """Logs message, formatted with args and kwargs like C{str.format}
+        when written out"""
+        if level < self.level:
+            return
+        if self.every > 1:
+            self.count += 1
+            if self.count % self.every:
+                return
+        for arg in args:
+            if not isinstance(arg, IMMUTABLE):
+                args = tuple(arg if isinstance(arg, IMMUTABLE) else str(arg)
+                    for arg in args)
+                break
+        for key, arg in kwargs.iteritems():
+            if not isinstance(arg, IMMUTABLE):
+                kwargs[key] = str(arg)
+        system = (context.get(log.ILogContext) or {}).get('system', '-')
+        record = (time(), level, self.name, system, message, args, kwargs,
+            self.every)
+        if writer is None:
+            log.msg(render(record), system=system)
+        else:
+            writer.put(record)
+
+    def debug(self, message, *args, **kwargs):
+        self.log(DEBUG, message, *args, **kwargs)
+
+    def info(self, message, *args, **kwargs):
+        self.log(INFO, message, *args, **kwargs)
+
+    def warning(self, message, *args, **kwargs):
+        self.log(WARNING, message, *args, **kwargs)
+
+    def error(self, message, *args, **kwargs):
+        self.log(ERROR, message, *args, **kwargs)
+
+def render(record):
+    """The text of a record, without its time and system"""
+    when, level, name, system, message, args, kwargs, every = record
+    if args or kwargs:
+        try:
+            message = message.format(*args, **kwargs)
+        except Exception as e:
+            message = "%s %r %r (%s)" % (message, args, kwargs, e)
+    if level != INFO:
+        message = "%s %s" % (LEVEL_NAMES.get(level, level), message)
+    if every > 1:
+        message = "%s (1 in %d)" % (message, every)
+    return message
+
+def format_time(when):
+    return datetime.fromtimestamp(when).strftime('%Y-%m-%d %H:%M:%S') \
+        + strftime('%z')
+
+class Writer(threading.Thread):
+    """Writes records from a bounded queue to a file
+
+    When the queue is full, new records are dropped and counted."""
+
+    def __init__(self, out, size=10000):
+        threading.Thread.__init__(self, name='pypickupbot log writer')
+        self.daemon = True
+        self.out = out
+        self.queue = Queue.Queue(size)
+        self.dropped = 0
+
+    def put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+            DROPPED.inc()
+
+    def observe(self, event):
+        """Twisted log observer"""
+        self.put(event)
+
+    def line(self, record):
+        if isinstance(record, dict):
+            # from twisted
+            text = log.textFromEventDict(record)
+            if text is None:
+                return None
+            when, system = record['time'], record.get('system', '-')
+        else:
+            text = render(record)
+            when, system = record[0], record[3]
+        return "%s [%s] %s\n" % (format_time(when), system,
+            text.replace('\n', '\n\t'))
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            line = self.line(record)
+            if line is not None:
+                if isinstance(line, unicode):
+                    line = line.encode('utf-8')
+                self.out.write(line)
+            if self.queue.empty():
+                self.out.flush()
+        self.out.flush()
+
+    def stop(self):
+        """Writes what is left in the queue and stops"""
+        self.queue.put(None)
+        self.join()
+
+writer = None
+loggers = {}
+settings = {'level': INFO, 'levels': {}, 'every': {}}
+
+def get(name):
+    """@returns: the L{Logger} with that name"""
+    try:
+        return loggers[name]
+    except KeyError:
+        logger = loggers[name] = Logger(name)
+        _apply(logger)
+        return logger
+
+def _apply(logger):
+    logger.level = settings['levels'].get(logger.name, settings['level'])
+    logger.every = settings['every'].get(logger.name, 1)
+
+def configure(level=INFO, levels=None, every=None):
+    """Sets loggers' levels and sampling
+
+    @param levels: {logger name: level} for loggers that don't use level
+    @param every: {logger name: n} to keep only one message in n"""
+    settings['level'] = level
+    settings['levels'] = levels or {}
+    settings['every'] = every or {}
+    for logger in loggers.itervalues():
+        _apply(logger)
+
+def configure_from(config, debug=False):
+    """Reads levels and sampling from the [Bot] section
+
+    @param debug: log everything, whatever the configuration says"""
+    def level(name):
+        try:
+            return LEVELS[name.strip().lower()]
+        except KeyError:
+            raise ValueError("Unknown log level %s" % name)
+    default = level(config.get('Bot', 'log level'))
+    if debug or config.getboolean('Bot', 'debug'):
+        default = DEBUG
+    configure(default,
+        dict((name, level(value)) for name, value
+            in config.getdict('Bot', 'log levels').iteritems()),
+        dict((name, int(value)) for name, value
+            in config.getdict('Bot', 'log sampling').iteritems()))
+
+def start(path=None, rotate=None, keep=None, size=10000, out=None):
+    """Starts writing log messages, Twisted's included, to a file
+
+    @param path: file to write to, stdout if neither it nor out are given
+    @param rotate: size in bytes the file is rotated at
+    @param keep: how many rotated files to keep
+    @param out: file object to write to instead of path"""
+    global writer
+    if out is None and path:
+        out = LogFile.fromFullPath(path, rotateLength=rotate or None,
+            maxRotatedFiles=keep or None)
+    elif out is None:
+        out = sys.stdout
+    writer = Writer(out, size)
+    writer.start()
+    log.startLoggingWithObserver(writer.observe, setStdout=False)
+    reactor.addSystemEventTrigger('after', 'shutdown', stop)
+
+def stop():
+    global writer
+    if writer is not None:
+        log.removeObserver(writer.observe)
+        writer.stop()
+        writer = None
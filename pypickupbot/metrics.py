@@ -0,0 +1,242 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""counters, gauges and histograms about the bot's load, with a
+Prometheus exporter"""
+
+from twisted.internet import reactor
+from twisted.python import log
+from twisted.web import resource, server
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0,
+    2.5, 5.0, 10.0)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n')\
+        .replace('"', '\\"')
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(int(value))
+    return repr(value)
+
+class Metric:
+    """A named family of values, one per combination of label values
+
+    @ivar values: label values tuple -> value"""
+
+    kind = NotImplemented
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def key(self, labels):
+        try:
+            return tuple(str(labels[label]) for label in self.labels)
+        except KeyError as e:
+            raise ValueError("%s needs label %s" % (self.name, e))
+
+    def label_str(self, key, extra=()):
+        pairs = zip(self.labels, key) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join(
+            '%s="%s"' % (label, escape(value)) for label, value in pairs)
+
+    def samples(self):
+        """@returns: list of (name suffix, key, extra labels, value)"""
+        return [('', key, (), value)
+            for key, value in sorted(self.values.iteritems())]
+
+    def exposition(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+            '# TYPE %s %s' % (self.name, self.kind)]
+        for suffix, key, extra, value in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix,
+                self.label_str(key, extra), format_value(value)))
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self):
+        return sum(self.values.itervalues())
+
+class Gauge(Metric):
+    """A value that goes up and down. It can also be read from a function
+    when scraped, see L{set_function}"""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=()):
+        Metric.__init__(self, name, help, labels)
+        self.function = None
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """@param function: returns the value, or for labelled gauges a
+            dict of label values tuples to values"""
+        self.function = function
+
+    def collect(self):
+        if self.function is None:
+            return self.values
+        try:
+            value = self.function()
+        except Exception:
+            log.err(None, "Reading gauge %s" % self.name)
+            return {}
+        if self.labels:
+            return dict((tuple(str(v) for v in key), val)
+                for key, val in value.iteritems())
+        return {(): value}
+
+    def samples(self):
+        return [('', key, (), value)
+            for key, value in sorted(self.collect().iteritems())]
+
+    def total(self):
+        return sum(self.collect().itervalues())
+
+class Histogram(Metric):
+    """Counts observations in buckets, and keeps their sum
+
+    Values are [bucket counts..., sum, count]"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        try:
+            state = self.values[key]
+        except KeyError:
+            state = self.values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def samples(self):
+        samples = []
+        for key, state in sorted(self.values.iteritems()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                samples.append(('_bucket', key,
+                    (('le', format_value(float(bound))),), cumulative))
+            samples.append(('_bucket', key, (('le', '+Inf'),), state[-1]))
+            samples.append(('_sum', key, (), state[-2]))
+            samples.append(('_count', key, (), state[-1]))
+        return samples
+
+    def count(self, **labels):
+        """Number of observations, for given labels or all of them"""
+        if labels:
+            return self.values.get(self.key(labels), [0])[-1]
+        return sum(state[-1] for state in self.values.itervalues())
+
+    def sum(self, **labels):
+        """Sum of observations, for given labels or all of them"""
+        if labels:
+            state = self.values.get(self.key(labels))
+            return state[-2] if state else 0
+        return sum(state[-2] for state in self.values.itervalues())
+
+    def mean(self, **labels):
+        count = self.count(**labels)
+        return self.sum(**labels) / count if count else 0.0
+
+class Registry:
+    """Set of metrics, by name"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _get(self, cls, name, *args, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError("%s is already a %s" % (name, metric.kind))
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def exposition(self):
+        """All metrics in Prometheus text format"""
+        return '\n'.join(self.metrics[name].exposition()
+            for name in sorted(self.metrics)) + '\n'
+
+registry = Registry()
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+
+class MetricsResource(resource.Resource):
+    """Serves a registry's metrics to Prometheus"""
+    isLeaf = True
+
+    def __init__(self, registry=registry):
+        resource.Resource.__init__(self)
+        self.registry = registry
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+        return self.registry.exposition()
+
+def listen(port, interface='127.0.0.1'):
+    """Starts serving metrics over HTTP"""
+    log.msg(_("Serving metrics on http://{0}:{1}/metrics").format(
+        interface, port))
+    root = resource.Resource()
+    root.putChild('metrics', MetricsResource())
+    return reactor.listenTCP(port, server.Site(root), interface=interface)
@@ -212,6 +212,43 @@ def itime():
 def in_(a, b):
     return b in a
 
+class TokenBucket:
+    """Rate limiter holding up to burst tokens, regaining one every
+    interval seconds"""
+
+    def __init__(self, interval, burst, seconds=time):
+        self.interval = interval
+        self.burst = burst
+        self.seconds = seconds
+        self.tokens = float(burst)
+        self.stamp = seconds()
+
+    def _refill(self):
+        now = self.seconds()
+        if self.tokens < self.burst and self.interval > 0:
+            self.tokens = min(self.burst,
+                self.tokens + (now - self.stamp) / self.interval)
+        self.stamp = now
+
+    def consume(self, cost=1):
+        """Takes cost tokens from the bucket if there are enough
+
+        @returns: whether the tokens were available"""
+        if self.interval <= 0:
+            return True
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def delay(self, cost=1):
+        """Seconds to wait until cost tokens are available"""
+        if self.interval <= 0:
+            return 0
+        self._refill()
+        return max(0, (cost - self.tokens) * self.interval)
+
 
 try:
     from types import StringTypes
@@ -23,17 +23,24 @@
 
 import os.path
 import sys
+import json
+from time import time
 from types import ListType, TupleType, DictType, FunctionType
 import inspect
 
+from twisted.internet import defer
 from twisted.python import log
+from twisted.python.failure import Failure
 from twisted.plugin import getPlugins, IPlugin
 from zope.interface import Interface, implements
 
 from pypickupbot import config
+from pypickupbot import logger
 
 import pypickupbot.modules
 
+LOG = logger.get('modules')
+
 class IModuleFactory(Interface):
     """A module that extends a modable"""
 
@@ -60,6 +67,15 @@ class SimpleModuleFactory:
         pass
 
     def __call__(self, bot):
+        if getattr(self.Module, 'per_channel', False):
+            return ChannelModules(self, bot)
+        return self.instantiate(bot)
+
+    def instantiate(self, bot, channel=None):
+        """Creates an instance of the module
+
+        :param channel: the channel it is for, if the module declares
+            per_channel"""
         self.pre_inst(self.Module)
         try:
             try:
@@ -67,8 +83,13 @@ class SimpleModuleFactory:
             except AttributeError:
                 m = self.Module()
             else:
-                m = self.Module(bot)
+                if channel is None:
+                    m = self.Module(bot)
+                else:
+                    m = self.Module(bot, channel)
             m.pypickupbot = bot
+            if channel is not None:
+                m.channel = channel
             self.post_inst(m)
             return m
         except Exception as e:
@@ -105,6 +126,312 @@ class SimpleModuleFactory:
             'eventhandlers': module.eventhandlers,
         }
 
+class ModuleManifest:
+    """Knows which modules a package offers without importing them
+
+    Finding modules through twisted.plugin imports every one of them. The
+    manifest does that once and keeps what it learnt (where each module's
+    factory is, its config file, commands and events) in a file in the
+    configuration directory, trusted for as long as none of their files
+    changed. Only the modules that are used then get imported.
+
+    @ivar entries: {name: {'module', 'factory', 'config', 'commands',
+        'eventhandlers', 'per_channel', 'lazy'}}, where commands is
+        {name: [flags, docstring]}
+    @ivar scanned: whether the last L{refresh} had to import every module
+    @ivar seconds: how long the last L{refresh} took"""
+
+    VERSION = 3
+    FILENAME = 'modules.manifest'
+
+    def __init__(self, package=pypickupbot.modules, directory=None):
+        """@param directory: where to keep the manifest, the current
+            directory by default, like the database"""
+        self.package = package
+        self.path = os.path.join(directory or '', self.FILENAME)
+        self.entries = {}
+        self.mtimes = None
+        self.factories = {}
+        self.scanned = False
+        self.seconds = 0
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, name):
+        """@returns: the factory of module name, importing it if needed"""
+        if name not in self.factories:
+            entry = self.entries[name]
+            __import__(entry['module'])
+            self.factories[name] = getattr(sys.modules[entry['module']],
+                entry['factory'])
+        return self.factories[name]
+
+    def config_file(self, name):
+        return self.entries[name]['config']
+
+    def module_files(self):
+        """@returns: {path: mtime} of the package's modules, with paths
+        resolved so that they match whatever directory the bot is
+        started from"""
+        files = {}
+        for directory in self.package.__path__:
+            directory = os.path.realpath(directory)
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for filename in names:
+                if filename.endswith('.py') and filename != '__init__.py':
+                    path = os.path.join(directory, filename)
+                    files[path] = os.path.getmtime(path)
+        return files
+
+    def refresh(self):
+        """Reads the manifest, or rebuilds it if modules changed since
+
+        @returns: whether it changed"""
+        start = time()
+        mtimes = self.module_files()
+        self.scanned = False
+        if mtimes == self.mtimes:
+            changed = False
+        elif self.read(mtimes):
+            changed = True
+        else:
+            self.scan(mtimes)
+            self.write()
+            changed = True
+        self.seconds = time() - start
+        return changed
+
+    def read(self, mtimes):
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            return False
+        if manifest.get('version') != self.VERSION \
+                or manifest.get('files') != mtimes:
+            return False
+        self.entries = manifest['modules']
+        self.mtimes = mtimes
+        self.factories = {}
+        return True
+
+    def scan(self, mtimes):
+        """Imports every module to describe them"""
+        LOG.info("Scanning {0} for modules", self.package.__name__)
+        self.entries = {}
+        self.factories = {}
+        for factory in getPlugins(IModuleFactory, self.package):
+            modname = '%s.%s' % (self.package.__name__, factory.name)
+            Module = getattr(factory, 'Module', None)
+            for attr, val in vars(sys.modules[modname]).iteritems():
+                if val is factory:
+                    break
+            else:
+                continue
+            self.factories[factory.name] = factory
+            self.entries[factory.name] = {
+                'module': modname,
+                'factory': attr,
+                'config': os.path.realpath(factory.getConfigFile()),
+                'commands': dict(
+                    (name, [flags, getattr(func, '__doc__', None)])
+                    for name, (func, flags)
+                    in getattr(Module, 'commands', {}).iteritems()),
+                'eventhandlers': sorted(getattr(Module, 'eventhandlers', {})),
+                'per_channel': getattr(Module, 'per_channel', False),
+                'lazy': getattr(Module, 'lazy', False),
+                }
+        self.mtimes = mtimes
+        self.scanned = True
+
+    def write(self):
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({
+                    'version': self.VERSION,
+                    'files': self.mtimes,
+                    'modules': self.entries,
+                    }, f, indent=1, sort_keys=True)
+        except IOError as e:
+            LOG.warning("Could not write {0}: {1}", self.path, e)
+
+class LazyCall:
+    """A command or event handler of a L{LazyModule}: loads the module,
+    then passes the call on"""
+
+    def __init__(self, lazy, extendable, name, doc=None):
+        self.lazy = lazy
+        self.extendable = extendable
+        self.name = name
+        # for the help module
+        self.__name__ = name
+        self.__doc__ = doc
+
+    def __call__(self, *args, **kwargs):
+        def _forward(module):
+            if self.extendable == 'commands':
+                return self.lazy.pypickupbot.commands[self.name][0](
+                    *args, **kwargs)
+            results = [handler(*args, **kwargs)
+                for handler in self.lazy.handlers(self.name)]
+            if len(results) == 1:
+                return results[0]
+            return defer.gatherResults([defer.maybeDeferred(lambda: r)
+                for r in results]).addCallback(all)
+        return self.lazy.activate().addCallback(_forward)
+
+class LazyModule:
+    """Stands in for a module that declares itself lazy until one of
+    its commands or events comes, using what the manifest says about it
+
+    The module is then loaded, and calls made meanwhile wait for it to
+    be ready: for its instances' C{ready} Deferreds, if they have one.
+
+    @ivar module: the module once it is loaded
+    @ivar extended: what the module extended the modable with"""
+
+    def __init__(self, bot, name, entry):
+        # named like modules' own reference so that it is rebound with them
+        self.pypickupbot = bot
+        self.name = name
+        self.entry = entry
+        self.module = None
+        self.extended = []
+        self.waiting = []
+
+    def getExtensions(self):
+        commands = {}
+        for name, (flags, doc) in self.entry['commands'].iteritems():
+            commands[name] = (LazyCall(self, 'commands', name, doc), flags)
+        eventhandlers = {}
+        for event in self.entry['eventhandlers']:
+            eventhandlers[event] = LazyCall(self, 'eventhandlers', event)
+        return {'commands': commands, 'eventhandlers': eventhandlers}
+
+    def handlers(self, event):
+        """@returns: the module's handlers for event"""
+        handlers = []
+        for extendablename, key, val in self.extended:
+            if extendablename == 'eventhandlers' and key == event:
+                handlers.append(val[0] if isinstance(val, tuple) else val)
+        return handlers
+
+    def loaded(self, module, extended):
+        self.module = module
+        self.extended = extended
+
+    def activate(self):
+        """@returns: Deferred firing with the module once it is ready"""
+        d = defer.Deferred()
+        self.waiting.append(d)
+        if len(self.waiting) == 1:
+            defer.maybeDeferred(self.pypickupbot.load, self.name) \
+                .addCallback(self._ready) \
+                .addBoth(self._activated)
+        return d
+
+    def _ready(self, module):
+        if isinstance(module, ChannelModules):
+            instances = module.instances
+        else:
+            instances = [module]
+        return defer.DeferredList([m.ready for m in instances
+                if isinstance(getattr(m, 'ready', None), defer.Deferred)]) \
+            .addCallback(lambda _: module)
+
+    def _activated(self, result):
+        if isinstance(result, Failure):
+            log.err(result, "loading module %s" % self.name)
+        waiting, self.waiting = self.waiting, []
+        for d in waiting:
+            d.callback(result)
+
+class ChannelCommand:
+    """Runs a per-channel module's command on the instance for the
+    channel it was called from"""
+
+    def __init__(self, modules, name):
+        self.modules = modules
+        self.name = name
+        # for the help module
+        func = modules.commands_of(modules.home())[name][0]
+        self.im_self = modules.home()
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __call__(self, call, args):
+        instance = self.modules.for_call(call, args)
+        return self.modules.commands_of(instance)[self.name][0](call, args)
+
+class ChannelModules:
+    """The instances of a module that declares per_channel, one for each
+    of the bot's home channels
+
+    Each instance has a channel attribute, gets all events and is
+    expected to ignore those about other channels. Commands go to the
+    instance of the channel they are used in. In private, they go to the
+    instance of the channel given as first argument, or of the main
+    channel."""
+
+    def __init__(self, factory, bot):
+        self.factory = factory
+        self.bot = bot
+        self.instances = []
+        self._commands = {}
+        for channel in bot.home_channels:
+            m = factory.instantiate(bot, channel)
+            if m is not None:
+                self.instances.append(m)
+
+    def home(self):
+        return self.instances[0]
+
+    def for_channel(self, channel):
+        """@returns: the instance for channel, or None"""
+        channel = channel.lower()
+        for m in self.instances:
+            if m.channel.lower() == channel:
+                return m
+
+    def for_call(self, call, args):
+        """Finds the instance a command call is about. A channel given
+        as first argument in private is taken off args."""
+        if call.channel != 'PM':
+            m = self.for_channel(call.channel)
+            if m is not None:
+                return m
+        elif args:
+            m = self.for_channel(args[0])
+            if m is not None:
+                del args[0]
+                return m
+        return self.home()
+
+    def commands_of(self, m):
+        """Commands of an instance, bound to it"""
+        if m.channel in self._commands:
+            return self._commands[m.channel]
+        commands = self._commands[m.channel] = {}
+        for name, (func, flags) in self.factory.getExtensions(m)['commands'].iteritems():
+            if type(func) == FunctionType:
+                func = func.__get__(m, m.__class__)
+            commands[name] = (func, flags)
+        return commands
+
+    def getExtensions(self):
+        commands = {}
+        if self.instances:
+            for name, (func, flags) in self.commands_of(self.home()).iteritems():
+                commands[name] = (ChannelCommand(self, name), flags)
+        return {'commands': commands}
+
 class Modable:
     """Class that can manage modules"""
 
@@ -118,37 +445,71 @@ class Modable:
             return
 
         if module in self.available_modules:
-            if config.debug:
-                log.msg('Loading module config %s' % module)
-            config._parser.read([self.available_modules[module].getConfigFile()])
+            LOG.debug("Loading module config {0}", module)
+            config.read([self.available_modules.config_file(module)])
 
-    def load(self, module):
-        """Load a module or a list of modules"""
+    def load(self, module, lazy=False):
+        """Load a module or a list of modules
+
+        @param lazy: only stand in for modules that declare themselves
+            lazy, with a L{LazyModule}, until they are used"""
         if isinstance(module, ListType):
             success = True
             for module_ in module:
-                success = self.load(module_) and success
+                success = self.load(module_, lazy) and success
             return success
 
-        if module not in self.modules:
+        m = self.modules.get(module)
+        if m is None or (isinstance(m, LazyModule) and not lazy):
             if module in self.available_modules:
-                if config.debug:
-                    log.msg('Loading module %s' % module)
-                m = self.available_modules[module](self)
-                self.modules[module] = m
-                self.module_postload(self.available_modules[module], m)
-            else:
-                self.preload_modules()
-                if module not in self.available_modules:
-                    raise ValueError(_("No such module: %s") % module)
+                if lazy and self.available_modules.entries[module].get('lazy'):
+                    LOG.debug("Deferring module {0} until it is used", module)
+                    m = self.modules[module] = LazyModule(self, module,
+                        self.available_modules.entries[module])
+                    for extendable, extender in m.getExtensions().iteritems():
+                        self.extend(m, extendable, extender)
                 else:
-                    self.load(module)
+                    self._load(module)
+            elif self.available_modules.refresh():
+                return self.load(module, lazy)
+            else:
+                raise ValueError(_("No such module: %s") % module)
 
         return self.modules[module]
 
+    def _load(self, module):
+        LOG.debug("Loading module {0}", module)
+        start = time()
+        try:
+            factory = self.available_modules[module]
+        except Exception:
+            log.err()
+            raise ValueError(_("Could not import module: %s") % module)
+        stand_in = self.modules.get(module)
+        if stand_in is not None:
+            self.unextend(stand_in)
+        extended = len(self.extended)
+        m = factory(self)
+        self.modules[module] = m
+        self.module_postload(factory, m)
+        if stand_in is not None:
+            stand_in.loaded(m, self.extended[extended:])
+        self.module_seconds[module] = time() - start
+
     def module_postload(self, factory, module):
         """calls loading hooks, imports commands"""
 
+        if isinstance(module, ChannelModules):
+            dispatched = module.getExtensions()
+            for extendable in self.__class__._extend:
+                if extendable in dispatched:
+                    self.extend(module, extendable, dispatched[extendable])
+                else:
+                    for m in module.instances:
+                        self.extend(m, extendable,
+                            factory.getExtensions(m)[extendable])
+            return
+
         for extendable in self.__class__._extend:
             try:
                 extender = factory.getExtensions(module)[extendable]
@@ -160,10 +521,7 @@ class Modable:
     def extend(self, module, extendablename, extender):
         """Extends extendablename with extender from module"""
         if extendablename not in self._extend:
-            raise ValueError("Unknown extendable: %s" % (extendable,))
-
-        extendable = getattr(self,extendablename)
-        extendable_type = self._extend[extendablename]
+            raise ValueError("Unknown extendable: %s" % (extendablename,))
 
         for key, val in extender.iteritems():
             try:
@@ -191,20 +549,74 @@ class Modable:
                     val = val.values()
                 if is_tuple:
                     val = tuple(val)
-            if extendable_type == self.__class__.EXTEND_DICT:
-                extendable[key] = val
-            elif extendable_type == self.__class__.EXTEND_DICT_LIST:
-                if key in extendable:
-                    extendable[key].append(val)
-                else:
-                    extendable[key] = [val]
-        
+            self._add_extension(extendablename, key, val)
+            self.extended.append((extendablename, key, val))
+
+    def unextend(self, module):
+        """Takes back what a L{LazyModule} extended this instance with"""
+        def _ours(val):
+            if isinstance(val, tuple):
+                val = val[0]
+            return getattr(val, 'lazy', None) is module
+        for extendablename, key, val in self.extended:
+            if not _ours(val):
+                continue
+            extendable = getattr(self, extendablename)
+            if self._extend[extendablename] == self.__class__.EXTEND_DICT:
+                if extendable.get(key) is val:
+                    del extendable[key]
+            elif val in extendable.get(key, ()):
+                extendable[key].remove(val)
+        self.extended[:] = [entry for entry in self.extended
+            if not _ours(entry[2])]
+
+    def _add_extension(self, extendablename, key, val):
+        extendable = getattr(self, extendablename)
+        extendable_type = self._extend[extendablename]
+        if extendable_type == self.__class__.EXTEND_DICT:
+            extendable[key] = val
+        elif extendable_type == self.__class__.EXTEND_DICT_LIST:
+            if key in extendable:
+                extendable[key].append(val)
+            else:
+                extendable[key] = [val]
+
+    def export_modules(self):
+        """@returns: the loaded modules and what they extended this
+        instance with, for L{adopt_modules}"""
+        return {
+            'available_modules': self.available_modules,
+            'modules': self.modules,
+            'extended': self.extended,
+            }
+
+    def adopt_modules(self, exported):
+        """Takes over modules loaded by another instance instead of
+        loading them again: they are rebound to this one, keeping their
+        state, and extend it as they extended the other one.
+
+        @param exported: what L{export_modules} returned"""
+        self.available_modules = exported['available_modules']
+        self.modules = exported['modules']
+        for module in self.modules.itervalues():
+            if isinstance(module, ChannelModules):
+                module.bot = self
+                for m in module.instances:
+                    m.pypickupbot = self
+            else:
+                module.pypickupbot = self
+        for extendablename, key, val in exported['extended']:
+            self._add_extension(extendablename, key, val)
+        self.extended = exported['extended']
+        LOG.debug("Adopted modules {0}", ', '.join(sorted(self.modules)))
+
 
     def preload_modules(self):
-        self.available_modules = {}
+        """Finds out which modules there are, see L{ModuleManifest}"""
         log.msg("Looking for modules...")
-        for module in getPlugins(IModuleFactory, pypickupbot.modules):
-            self.available_modules[module.name] = module
+        self.available_modules = ModuleManifest(
+            directory=config.dir[0] if config.dir else None)
+        self.available_modules.refresh()
     def load_modules_config(self):
         """Load modules' defaults"""
         log.msg(_("Loading default module configs..."))
@@ -212,5 +624,5 @@ class Modable:
     def load_modules(self):
         """Loads modules set in the config"""
         log.msg(_("Loading enabled modules..."))
-        self.load(config.getlist('Modules', 'modules'))
+        self.load(config.getlist('Modules', 'modules'), lazy=True)
 
@@ -30,9 +30,7 @@ import json
 from operator import contains
 import traceback
 
-from twisted.internet import defer, reactor
-from twisted.internet.error import AlreadyCalled as AlreadyCalledError,\
-                                    AlreadyCancelled as AlreadyCancelledError
+from twisted.internet import defer
 from twisted.python import log
 from zope.interface import implements
 
@@ -167,7 +165,8 @@ class Item:
         meta_names = {
                 'edited_by': 'Edited by',
                 'deleted_by': 'Deleted by',
-                'author': 'Author'
+                'author': 'Author',
+                'channel': 'Channel'
             }
         meta_funcs = {
                 'edited_by': lambda l: ', '.join(l)
@@ -241,37 +240,42 @@ class Tracker:
     search_keys = None
     cmp_funcs = None
 
-    def __init__(self, bot):
+    per_channel = True
+
+    def __init__(self, bot, channel):
         if self.name == NotImplemented:
             raise NotImplementedError(__class__)
 
+        self.channel = channel
         self.pre_init(bot)
 
         self.last_check = 0
         self.listed = []
 
-        def _itrxn(txn):
-            txn.execute("""
-                CREATE TABLE IF NOT EXISTS
-                tracker_%ss
-                (
-                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                    meta        TEXT,
-                    start       INT,
-                    length      INT,
-                    deleted     INT
-                )            
-            """ % self.name )
-            txn.execute("""
-                SELECT
-                id, meta, start, length, deleted
-                FROM tracker_%ss
-            """% self.name)
-            return txn.fetchall()
-        d = db.runInteraction(_itrxn)
+        d = db.migrate('tracker_%ss' % self.name, [
+            """
+            CREATE TABLE IF NOT EXISTS
+            tracker_%ss
+            (
+                id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                meta        TEXT,
+                start       INT,
+                length      INT,
+                deleted     INT
+            )
+            """ % self.name,
+            ])
+        d.addCallback(lambda _: db.runQuery("""
+            SELECT
+            id, meta, start, length, deleted
+            FROM tracker_%ss
+        """% self.name))
 
         def _fillItems(items):
-            self.listed.extend(items)
+            # items from before trackers were per channel belong to the
+            # main channel
+            self.listed.extend(item for item in items
+                if item.meta.get('channel', bot.channel) == self.channel)
             return True
 
         self.dbready = d.addCallback(self.ItemClass.from_results, self).addCallback(_fillItems)
@@ -279,7 +283,9 @@ class Tracker:
     def pre_init(self, bot):
         pass
 
-    def joinedHomeChannel_(self):
+    def joined_(self, channel):
+        if self.pypickupbot.home_channel(channel) != self.channel:
+            return
         dl = [self.dbready]
 
         if callable(self.joinedHomeChannel):
@@ -317,6 +323,7 @@ class Tracker:
 
         def _doneSyncing(l):
             for item in self.ItemClass.from_real(reallist, self):
+                item.meta['channel'] = self.channel
                 item.update_db()
                 self.listed.append(item)
 
@@ -324,17 +331,21 @@ class Tracker:
 
     def periodic_check(self):
         self.retrieve_real_list().addCallback(self.sync)
-        
-        try:
-            self.next_check.cancel()
-        except (AttributeError, AlreadyCalledError, AlreadyCancelledError):
-            pass
 
-        self.next_check = reactor.callLater(
+        self.pypickupbot.timers.schedule(('tracker', self.name, self.channel),
                 config.getduration(self.name.capitalize(), 'check interval'),
                 self.periodic_check
             )
 
+    def configChanged_(self, sections):
+        """picks up a new check interval"""
+        name = ('tracker', self.name, self.channel)
+        if self.name.capitalize() in sections \
+                and self.pypickupbot.timers.get(name) is not None:
+            self.pypickupbot.timers.schedule(name,
+                config.getduration(self.name.capitalize(), 'check interval'),
+                self.periodic_check)
+
     def default_cmp(self, a, b):
         try:
             return a.lower() in b.lower()
@@ -452,6 +463,7 @@ class Tracker:
 
             def _newItem(item):
                 item.meta['author'] = call.user
+                item.meta['channel'] = self.channel
                 return item
             item = self.ItemClass.from_call(self, call, args)
             item.addCallback(_newItem)
@@ -561,7 +573,8 @@ class Tracker:
    
 
     eventhandlers = {
-        'joinedHomeChannel': joinedHomeChannel_
+        'joined': joined_,
+        'configChanged': configChanged_,
     }
 
 class TrackerModuleFactory(SimpleModuleFactory):
@@ -574,11 +587,8 @@ class TrackerModuleFactory(SimpleModuleFactory):
             if docstring:
                 setattr(m, '%sCmd_doc' % cmd, docstring % {'name': m.name})
 
-        try:
-            getattr(m, 'commands')
-        except AttributeError:
-            setattr(m, 'commands', {})
-
+        # copied so that each channel's instance binds its own methods
+        m.commands = dict(getattr(m, 'commands', {}))
         m.commands.update(
             {
                 '%s' % m.name: (m.mainCmd, COMMAND.ADMIN),
@@ -588,9 +598,11 @@ class TrackerModuleFactory(SimpleModuleFactory):
             }
         )
 
+        m.eventhandlers = dict(m.eventhandlers)
         m.eventhandlers.update(
             {
-                'joinedHomeChannel': m.joinedHomeChannel_
+                'joined': m.joined_,
+                'configChanged': m.configChanged_,
             }
         )
 
@@ -636,6 +648,22 @@ class MaskTracker(Tracker):
             return re.escape(before) + token + _recurse(after)
         return _recurse(mask)
     
+    @classmethod
+    def users_matching(cls, users, masks):
+        """Users from a L{Roster} matched by any of masks
+
+        Plain host bans are looked up by host instead of scanning
+        everyone."""
+        hosts = []
+        for mask in masks:
+            m = hostbanRe.match(mask)
+            if not m:
+                break
+            hosts.append(m.group(1))
+        else:
+            return [user for host in hosts for user in users.by_host(host)]
+        return [user for user in users if cls.cmp_masks(user.mask(), masks)]
+
     @classmethod
     def cmp_masks(cls, needle, masks):
         needle_re = cls.mask_to_regexp(needle)
@@ -662,6 +690,7 @@ banmaskRe = re.compile(r'''
     )
     $
     ''', re.VERBOSE)
+hostbanRe = re.compile(r'^\*!\*@([^*?]+)$')
 hostmaskRe = re.compile(r'''
     ^
     (?P<nick> [^*!@]+ )
@@ -729,7 +758,7 @@ class Ban(Mask):
 
             for masks in xgroup(self.meta['ban_masks'], 3): #arbitrary number
                 self.tracker.pypickupbot.sendLine("MODE %s +%s %s" % (
-                    self.tracker.pypickupbot.channel,
+                    self.tracker.channel,
                     'b' * len(masks),
                     str(' '.join(masks))
                     ))
@@ -738,25 +767,22 @@ class Ban(Mask):
             if 'reason' in self.meta:
                 kickreason += self.meta['reason']
             kickreason += '[' + self.expiry() + ']'
-            for nick, ident, host, flags in users:
-                if self.tracker.cmp_masks(
-                    '%s!%s@%s' % (nick, ident, host),
-                    self.meta['ban_masks']
-                    ):
-                    self.tracker.pypickupbot.sendLine(
-                        "KICK %s %s :%s" % 
-                        (
-                            self.tracker.pypickupbot.channel,
-                            nick,
-                            kickreason
-                        )
-                        )
+            for user in self.tracker.users_matching(
+                    users, self.meta['ban_masks']):
+                self.tracker.pypickupbot.sendLine(
+                    "KICK %s %s :%s" % 
+                    (
+                        self.tracker.channel,
+                        user.nick,
+                        kickreason
+                    )
+                    )
             return True
         return defer.DeferredList(
             [
-                FetchedList.bot_has_op(self.tracker.pypickupbot),
-                FetchedList.get_users(self.tracker.pypickupbot,
-                                      self.tracker.pypickupbot.channel).get()
+                FetchedList.bot_has_op(self.tracker.pypickupbot, self.tracker.channel),
+                FetchedList.get_userhosts(self.tracker.pypickupbot,
+                                          self.tracker.channel)
             ]
             ).addCallback(_knowOp)
 
@@ -769,12 +795,12 @@ class Ban(Mask):
             traceback.print_stack()
             for masks in xgroup(self.meta['ban_masks'], 3):
                 self.tracker.pypickupbot.sendLine("MODE %s -%s %s" % (
-                    self.tracker.pypickupbot.channel,
+                    self.tracker.channel,
                     'b' * len(masks),
                     str(' '.join(masks))
                     ))
             return False
-        return FetchedList.bot_has_op(self.tracker.pypickupbot) \
+        return FetchedList.bot_has_op(self.tracker.pypickupbot, self.tracker.channel) \
             .addCallback(_knowOp)
 
     def __contains__(self, other):
@@ -839,17 +865,16 @@ class Ban(Mask):
             user_d = defer.succeed([user])
         else:
             def _gotUserList(l):
-                for nick_, ident, host, flags in l:
-                    if nick == nick_:
-                        user = "%s!%s@%s" % (nick_, ident, host)
-                        return cls.find_banmask(user)
+                user = l.get(nick)
+                if user is not None:
+                    return cls.find_banmask(user.mask())
                 else:
                     return ['%s!*@*' % nick]
 
-            user_d = FetchedList.get_users(
+            user_d = FetchedList.get_userhosts(
                 tracker.pypickupbot,
-                tracker.pypickupbot.channel
-                ).get().addCallback(_gotUserList)
+                tracker.channel
+                ).addCallback(_gotUserList)
 
         def _gotMasks(masks):
             def _gotUserList(userlist):
@@ -865,17 +890,13 @@ class Ban(Mask):
                     meta['seen_nicks'].append(nick)
 
                 to_kick = []
-                for nick_, ident, host, flags in userlist:
-                    mask_ = '%s!%s@%s' % (nick_, ident, host)
-                    if tracker.cmp_masks(
-                        mask_,
-                        masks
-                        ):
-                        to_kick.append(nick_)
-                        if nick_ not in meta['seen_nicks']:
-                            meta['seen_nicks'].append(nick_)
-                        if mask_ not in meta['seen_masks']:
-                            meta['seen_masks'].append(mask_)
+                for user_ in tracker.users_matching(userlist, masks):
+                    mask_ = user_.mask()
+                    to_kick.append(user_.nick)
+                    if user_.nick not in meta['seen_nicks']:
+                        meta['seen_nicks'].append(user_.nick)
+                    if mask_ not in meta['seen_masks']:
+                        meta['seen_masks'].append(mask_)
 
 
                 if tracker.pypickupbot.nickname in to_kick:
@@ -893,10 +914,10 @@ class Ban(Mask):
                         meta
                         )
                 return confirm.addCallback(_confirmed)
-            return FetchedList.get_users(
+            return FetchedList.get_userhosts(
                 tracker.pypickupbot,
-                tracker.pypickupbot.channel
-                ).get(_gotUserList).addCallback(_gotUserList)
+                tracker.channel
+                ).addCallback(_gotUserList)
         return user_d.addCallback(_gotMasks)
 
 
@@ -911,13 +932,13 @@ class BanTracker(MaskTracker):
 
     def pre_init(self, bot):
         bot.extend(self, 'eventhandlers', {
-                'FetchedList MODE %s +b updated' % bot.channel:
+                'FetchedList MODE %s +b updated' % self.channel:
                     self.banListUpdated
             })
         self.lastKicked = None
 
     def joinedHomeChannel(self):
-        d = FetchedList.get_bans(self.pypickupbot, self.pypickupbot.channel).get()
+        d = FetchedList.get_bans(self.pypickupbot, self.channel).get()
         return d
 
     def banListUpdated(self):
@@ -926,7 +947,7 @@ class BanTracker(MaskTracker):
     def retrieve_real_list(self):
         return FetchedList.get_bans(
             self.pypickupbot,
-            self.pypickupbot.channel).get()
+            self.channel).get()
 
     def get_cmp_funcs(self):
         return {
@@ -20,48 +20,60 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-"""Makes main channel operators bot admins"""
+"""Makes home channel operators bot admins"""
 
 from pypickupbot.modable import SimpleModuleFactory
 
 class ChanOps:
-    def __init__(self, bot):
+    per_channel = True
+
+    def __init__(self, bot, channel):
+        self.channel = channel
         self.chanops = set()
 
-    def is_admin(self, user, nick):
-        """Checks if the user is an op in the bot's main channel"""
-        return nick in self.chanops
+    def is_admin(self, user, nick, channel):
+        """Checks if the user is an op in this home channel, when that
+        is the channel the command is about"""
+        return channel.lower() == self.channel.lower() and nick in self.chanops
 
     def modeChanged(self, user, channel, set, modes, args):
-        if channel == self.pypickupbot.channel:
+        if channel == self.channel:
             if set and 'o' in modes:
                 self.chanops.add(args[0])
             elif not set and 'o' in modes:
                 self.chanops.discard(args[0])
 
     def irc_RPL_NAMREPLY(self, prefix, params):
-        if params[2] == self.pypickupbot.channel:
+        if params[2] == self.channel:
+            prefixes = ''.join(self.pypickupbot.prefix_modes().keys())
             for user in params[3].split():
-                if user[0] == '@':
-                    self.chanops.add(user[1:])
+                name = user.lstrip(prefixes)
+                if '@' in user[:len(user) - len(name)]:
+                    self.chanops.add(name.split('!')[0])
 
-    def userLeft(self, user, channel):
-        if channel == self.pypickupbot.channel:
-            self.chanops.discard(user)
+    def userLeft(self, user, channel, *args):
+        if channel == self.channel:
+            self.chanops.discard(user.split('!')[0])
 
     def userQuit(self, user, message):
-        self.chanops.discard(user)
+        self.chanops.discard(user.split('!')[0])
 
     def userRenamed(self, oldname, newname):
         if oldname in self.chanops:
             self.chanops.remove(oldname)
             self.chanops.add(newname)
 
+    def disconnected(self):
+        """ops may change while we are away, NAMES tells us again"""
+        self.chanops.clear()
+
     eventhandlers = {
         'is_admin': is_admin,
+        'disconnected': disconnected,
         'modeChanged': modeChanged,
         'irc_RPL_NAMREPLY': irc_RPL_NAMREPLY,
         'userLeft': userLeft,
+        'userKicked': userLeft,
         'userQuit': userQuit,
         'userRenamed': userRenamed,
         }
@@ -27,6 +27,7 @@ from pypickupbot.irc import COMMAND
 from pypickupbot import config
 
 class HelpPlugin:
+    lazy = True
 
     def help(self, call, args):
         """!help <command>
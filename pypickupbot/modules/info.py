@@ -28,6 +28,7 @@ from pypickupbot.irc import COMMAND
 
 class InfoPlugin:
     """The plugin"""
+    lazy = True
 
     def source(self, call, args):
         """!source
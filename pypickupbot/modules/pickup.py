@@ -24,31 +24,198 @@
 from time import time
 import random
 
+from twisted.internet import defer, reactor
 from twisted.python import log
 
 from pypickupbot.modable import SimpleModuleFactory
-from pypickupbot.irc import COMMAND, InputError
+from pypickupbot.irc import COMMAND, InputError, FetchedList
 from pypickupbot.topic import Topic
 from pypickupbot import config
+from pypickupbot import db
+from pypickupbot import metrics
+from pypickupbot import template
+
+PLAYERS = metrics.gauge('pypickupbot_pickup_players',
+    'Players signed up for each game', ('channel', 'game'))
+ACTIVE_GAMES = metrics.gauge('pypickupbot_pickup_active_games',
+    'Games with at least one player signed up', ('channel',))
+GAMES_STARTED = metrics.counter('pypickupbot_pickup_games_started_total',
+    'Games started', ('channel', 'game'))
+GAME_READY = template.message('Pickup messages', 'game ready',
+    ('nick', 'playernum', 'playermax', 'name', 'numcaps', 'playerlist',
+     'captainlist'))
+YOURE_NEEDED = template.message('Pickup messages', 'youre needed',
+    ('channel', 'name', 'nick', 'numcaps', 'playerlist', 'captainlist'))
+GAME_READY_NOCAPTAINS = template.message(
+    'Pickup messages', 'game ready nocaptains',
+    ('nick', 'playernum', 'playermax', 'name', 'numcaps', 'playerlist'))
+YOURE_NEEDED_NOCAPTAINS = template.message(
+    'Pickup messages', 'youre needed nocaptains',
+    ('channel', 'name', 'nick', 'numcaps', 'playerlist'))
+GAME_READY_AUTOPICK = template.message(
+    'Pickup messages', 'game ready autopick',
+    ('nick', 'playernum', 'playermax', 'name', 'numcaps', 'teamslist'))
+GAME_READY_AUTOPICK_TEAM = template.message(
+    'Pickup messages', 'game ready autopick team',
+    ('name', 'players'))
+WHO_GAME = template.message('Pickup messages', 'who game',
+    ('nick', 'playernum', 'playermax', 'name', 'numcaps', 'playerlist'))
+TOPIC_GAME = template.message('Pickup messages', 'topic game',
+    ('nick', 'playernum', 'playermax', 'name', 'numcaps'))
+PROMOTE = template.message('Pickup messages', 'promote',
+    ('bold', 'prefix', 'name', 'nick', 'command', 'channel',
+     'playersneeded', 'maxplayers', 'numplayers'))
+
+QUEUE_SCHEMA = [
+    ("""
+        CREATE TABLE IF NOT EXISTS
+        pickup_queue_snapshot
+        (
+            channel     TEXT,
+            game        TEXT,
+            position    INTEGER,
+            nick        TEXT
+        )""",
+    """
+        CREATE TABLE IF NOT EXISTS
+        pickup_queue_journal
+        (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel     TEXT,
+            game        TEXT,
+            op          TEXT,
+            nick        TEXT,
+            newnick     TEXT
+        )"""),
+    ]
+
+
+class QueueJournal:
+    """Keeps a channel's queues in the database so that they survive
+    restarts
+
+    Changes are journaled in batches, journal delay seconds after they
+    happen. Once journal compaction entries piled up, the journal is
+    folded into a snapshot of the queues."""
+
+    def __init__(self, pickup):
+        self.pickup = pickup
+        self.channel = pickup.channel
+        self.pending = []
+        self.journaled = 0
+        # one transaction at a time, so that a snapshot never drops
+        # entries written after it was taken
+        self.lock = defer.DeferredLock()
+
+    def log(self, op, game, nick=None, newnick=None):
+        """Journals a change to game's queue
+
+        @param op: 'add', 'remove', 'rename' (nick to newnick) or 'clear'"""
+        self.pending.append((self.channel, game, op, nick, newnick))
+        timers = self.pickup.pypickupbot.timers
+        name = ('pickup journal', self.channel)
+        if timers.get(name) is None:
+            timers.schedule(name,
+                self.pickup.config.getfloat('Pickup', 'journal delay'),
+                self.flush)
+
+    def flush(self):
+        """Writes pending changes now
+
+        @returns: Deferred"""
+        self.pickup.pypickupbot.timers.cancel(('pickup journal', self.channel))
+        if not self.pending:
+            return defer.succeed(None)
+        pending, self.pending = self.pending, []
+        self.journaled += len(pending)
+        queues = None
+        if self.journaled >= self.pickup.config.getint('Pickup', 'journal compaction'):
+            self.journaled = 0
+            queues = self.pickup.queues()
+
+        def _write(txn):
+            if queues is None:
+                txn.executemany("""
+                    INSERT INTO pickup_queue_journal(channel, game, op, nick, newnick)
+                    VALUES(?, ?, ?, ?, ?)""", pending)
+            else:
+                self._snapshot(txn, queues)
+        return self.lock.run(db.runInteraction, _write)
+
+    def _snapshot(self, txn, queues):
+        txn.execute("""
+            DELETE FROM pickup_queue_snapshot
+            WHERE channel=?""", (self.channel,))
+        txn.executemany("""
+            INSERT INTO pickup_queue_snapshot(channel, game, position, nick)
+            VALUES(?, ?, ?, ?)""", [
+                (self.channel, game, i, nick)
+                for game, players in queues.iteritems()
+                for i, nick in enumerate(players)
+            ])
+        txn.execute("""
+            DELETE FROM pickup_queue_journal
+            WHERE channel=?""", (self.channel,))
+
+    def restore(self):
+        """Reads the queues back from the last snapshot and the journal,
+        then compacts them
+
+        @returns: Deferred firing with {gamenick: [nick, ..]}"""
+        def _read(txn):
+            queues = {}
+            txn.execute("""
+                SELECT game, nick FROM pickup_queue_snapshot
+                WHERE channel=?
+                ORDER BY position""", (self.channel,))
+            for game, nick in txn.fetchall():
+                queues.setdefault(game, []).append(nick)
+            txn.execute("""
+                SELECT game, op, nick, newnick FROM pickup_queue_journal
+                WHERE channel=?
+                ORDER BY id""", (self.channel,))
+            for game, op, nick, newnick in txn.fetchall():
+                players = queues.setdefault(game, [])
+                if op == 'add':
+                    if nick not in players:
+                        players.append(nick)
+                elif op == 'remove':
+                    if nick in players:
+                        players.remove(nick)
+                elif op == 'rename':
+                    if nick in players:
+                        players[players.index(nick)] = newnick
+                elif op == 'clear':
+                    del players[:]
+            self._snapshot(txn, queues)
+            return queues
+        def _restore():
+            d = db.migrate('pickup_queue', QUEUE_SCHEMA)
+            return d.addCallback(lambda _: db.runInteraction(_read))
+        return self.lock.run(_restore)
 
 
 class Game:
     """A game that can be played in the channel"""
 
-    def __init__(self, pickup, nick, name, captains=2, players=8, autopick=False, **kwargs):
+    def __init__(self, pickup, nick, name, **kwargs):
         self.pickup = pickup
         self.nick = nick
+        self.players = []
+        self.starting = False
+        self.abort_start = False
+        self.configure(name, **kwargs)
+
+    def configure(self, name, captains=2, players=8, autopick=False, **kwargs):
+        """Sets the game's settings, from its section of the config"""
         self.name = name
         self.caps = int(captains)
         self.maxplayers = int(players)
         self.autopick = bool(autopick)
         self.info = kwargs
-        self.players = []
-        self.starting = False
-        self.abort_start = False
 
         if 'teamnames' in kwargs:
-            self.teamnames = config.getlist('Pickup: ' + nick, 'teamnames')
+            self.teamnames = self.pickup.config.getlist('Pickup: ' + self.nick, 'teamnames')
         else:
             self.teamnames = []
 
@@ -59,7 +226,7 @@ class Game:
 
         def _knowStart(start):
             if not start:
-                self.pickup.pypickupbot.cmsg(
+                self.pickup.pypickupbot.msg(self.pickup.channel,
                     _("%s game about to start..") % self.name
                 )
             else:
@@ -79,6 +246,7 @@ class Game:
             self.abort_start = True
         if len(self.players):
             self.players = []
+            self.pickup.queue_changed('clear', self.nick)
             self.pickup.update_topic()
         self.starting = False
         return self
@@ -93,12 +261,13 @@ class Game:
         players = self.players[:self.maxplayers]
         for player in players:
             self.pickup.all_games().force_remove(player)
+        GAMES_STARTED.inc(channel=self.pickup.channel, game=self.nick)
 
         self.pickup.update_topic()
 
-        self.pickup.pypickupbot.notice(self.pickup.pypickupbot.channel,
+        self.pickup.pypickupbot.notice(self.pickup.channel,
                                        _("%(gamenick)s game ready to start in %(channel)s")
-                                       % {'gamenick': self.nick, 'channel': self.pickup.pypickupbot.channel})
+                                       % {'gamenick': self.nick, 'channel': self.pickup.channel})
 
         captains = []
 
@@ -108,8 +277,8 @@ class Game:
 
             self.pickup.pypickupbot.fire('pickup_game_starting', self, players, captains)
             if len(captains) > 0:
-                self.pickup.pypickupbot.msg(self.pickup.pypickupbot.channel,
-                                            config.get('Pickup messages', 'game ready').decode('string-escape') %
+                self.pickup.pypickupbot.msg(self.pickup.channel,
+                                            GAME_READY.get(self.pickup.config) %
                                             {
                                                 'nick': self.nick,
                                                 'playernum': len(self.players),
@@ -119,21 +288,20 @@ class Game:
                                                 'playerlist': ', '.join(players),
                                                 'captainlist': ', '.join(captains)
                                             })
-                if config.getboolean("Pickup", "PM each player on start"):
-                    for player in players:
-                        self.pickup.pypickupbot.msg(player,
-                                                    config.get("Pickup messages", "youre needed").decode('string-escape') %
-                                                    {
-                                                        'channel': self.pickup.pypickupbot.channel,
-                                                        'name': self.name,
-                                                        'nick': self.nick,
-                                                        'numcaps': self.caps,
-                                                        'playerlist': ', '.join(players),
-                                                        'captainlist': ', '.join(captains)
-                                                    })
+                if self.pickup.config.getboolean("Pickup", "PM each player on start"):
+                    self.pickup.pypickupbot.msg_many(players,
+                                                     YOURE_NEEDED.get(self.pickup.config) %
+                                                     {
+                                                         'channel': self.pickup.channel,
+                                                         'name': self.name,
+                                                         'nick': self.nick,
+                                                         'numcaps': self.caps,
+                                                         'playerlist': ', '.join(players),
+                                                         'captainlist': ', '.join(captains)
+                                                     })
             else:
-                self.pickup.pypickupbot.msg(self.pickup.pypickupbot.channel,
-                                            config.get('Pickup messages', 'game ready nocaptains').decode('string-escape') %
+                self.pickup.pypickupbot.msg(self.pickup.channel,
+                                            GAME_READY_NOCAPTAINS.get(self.pickup.config) %
                                             {
                                                 'nick': self.nick,
                                                 'playernum': len(self.players),
@@ -142,17 +310,16 @@ class Game:
                                                 'numcaps': self.caps,
                                                 'playerlist': ', '.join(players)
                                             })
-                if config.getboolean("Pickup", "PM each player on start"):
-                    for player in players:
-                        self.pickup.pypickupbot.msg(player,
-                                                    config.get("Pickup messages", "youre needed nocaptains").decode('string-escape') %
-                                                    {
-                                                        'channel': self.pickup.pypickupbot.channel,
-                                                        'name': self.name,
-                                                        'nick': self.nick,
-                                                        'numcaps': self.caps,
-                                                        'playerlist': ', '.join(players),
-                                                    })
+                if self.pickup.config.getboolean("Pickup", "PM each player on start"):
+                    self.pickup.pypickupbot.msg_many(players,
+                                                     YOURE_NEEDED_NOCAPTAINS.get(self.pickup.config) %
+                                                     {
+                                                         'channel': self.pickup.channel,
+                                                         'name': self.name,
+                                                         'nick': self.nick,
+                                                         'numcaps': self.caps,
+                                                         'playerlist': ', '.join(players),
+                                                     })
         else:
             teams = [[] for i in range(self.caps)]
             players_ = sorted(players)
@@ -162,8 +329,8 @@ class Game:
                 teams[i % self.caps].append(player)
 
             self.pickup.pypickupbot.fire('pickup_game_starting', self, teams, captains)
-            self.pickup.pypickupbot.cmsg(
-                config.get('Pickup messages', 'game ready autopick').decode('string-escape') %
+            self.pickup.pypickupbot.msg(self.pickup.channel,
+                GAME_READY_AUTOPICK.get(self.pickup.config) %
                 {
                     'nick': self.nick,
                     'playernum': len(players),
@@ -171,7 +338,7 @@ class Game:
                     'name': self.name,
                     'numcaps': self.caps,
                     'teamslist': ', '.join([
-                        config.get('Pickup messages', 'game ready autopick team').decode('string-escape') %
+                        GAME_READY_AUTOPICK_TEAM.get(self.pickup.config) %
                         {
                             'name': self.teamname(i),
                             'players': ', '.join(team)
@@ -193,6 +360,7 @@ class Game:
         """Add a player to this game"""
         if user not in self.players:
             self.players.append(user)
+            self.pickup.queue_changed('add', self.nick, user)
             self.pickup.update_topic()
 
         if len(self.players) >= self.maxplayers:
@@ -202,7 +370,7 @@ class Game:
     def who(self):
         """Who is in this game"""
         if len(self.players):
-            return config.get('Pickup messages', 'who game').decode('string-escape') % {'nick': self.nick, 'playernum': len(self.players),
+            return WHO_GAME.get(self.pickup.config) % {'nick': self.nick, 'playernum': len(self.players),
                                                                                         'playermax': self.maxplayers, 'name': self.name,
                                                                                         'numcaps': self.caps, 'playerlist': ', '.join(self.players)}
 
@@ -211,6 +379,7 @@ class Game:
         if user in self.players:
             if not self.starting or len(self.players) > self.maxplayers:
                 self.players.remove(user)
+                self.pickup.queue_changed('remove', self.nick, user)
                 self.pickup.update_topic()
             else:
                 call.reply(_('Too late to remove from %s') % self.nick)
@@ -218,17 +387,21 @@ class Game:
     def force_remove(self, user):
         try:
             self.players.remove(user)
-            self.pickup.update_topic()
         except ValueError:
             pass
+        else:
+            self.pickup.queue_changed('remove', self.nick, user)
+            self.pickup.update_topic()
 
     def rename(self, oldnick, newnick):
         """Rename a player"""
         try:
             i = self.players.index(oldnick)
-            self.players[i] = newnick
         except ValueError:
             pass
+        else:
+            self.players[i] = newnick
+            self.pickup.queue_changed('rename', self.nick, oldnick, newnick)
 
 
 class Games(Game):
@@ -271,6 +444,8 @@ class Games(Game):
 class PickupBot:
     """Allows the bot to run games with captain-picked teams"""
 
+    per_channel = True
+
     def all_games(self):
         """Gets a wrapper for all games"""
         return Games(self.games.values())
@@ -305,28 +480,72 @@ class PickupBot:
             else:
                 raise InputError(_("This command needs one game to be selected."))
 
+    def queues(self):
+        """@returns: {gamenick: [nick, ..]}"""
+        return dict((nick, list(game.players))
+            for nick, game in self.games.iteritems())
+
+    def queue_changed(self, op, game, nick=None, newnick=None):
+        """Journals a change to a game's queue, see L{QueueJournal.log}"""
+        if self.journal is not None:
+            self.journal.log(op, game, nick, newnick)
+
+    def _restored(self, queues):
+        """Puts players back in the queues they were in before a restart"""
+        restored = 0
+        for gamenick, players in queues.iteritems():
+            game = self.games.get(gamenick)
+            if game is None or not players:
+                continue
+            game.players = players + [nick for nick in game.players
+                if nick not in players]
+            restored += len(players)
+        if restored:
+            log.msg(_("Restored {0} players in {1}'s queues.").format(
+                restored, self.channel))
+        self.update_topic()
+        if self.in_channel:
+            self.check_queues()
+
+    def check_queues(self):
+        """Removes players who are no longer in the channel, as may
+        happen to queues restored after a restart or a reconnect
+
+        @returns: Deferred"""
+        def _gotUsers(roster):
+            gone = set(nick for game in self.games.itervalues()
+                for nick in game.players if nick not in roster)
+            for nick in gone:
+                self.all_games().force_remove(nick)
+        return FetchedList.get_users(self.pypickupbot, self.channel).get() \
+            .addCallback(_gotUsers)
+
+    def update_metrics(self):
+        """Updates the player gauges"""
+        for game in self.games.itervalues():
+            PLAYERS.set(len(game.players), channel=self.channel, game=game.nick)
+        ACTIVE_GAMES.set(len([game for game in self.games.itervalues()
+            if game.players]), channel=self.channel)
+
     def update_topic(self):
         """Update the pickup part of the channel topic"""
-        config_topic = config.getint('Pickup', 'topic')
+        self.update_metrics()
+        config_topic = self.config.getint('Pickup', 'topic')
 
-        if not config_topic:
+        if not config_topic or self.topic is None:
             return
 
         out = []
         for gamenick in self.order:
             game = self.games[gamenick]
             if config_topic == 1 or game.players:
-                out.append(
-                    config.get('Pickup messages', 'topic game').decode('string-escape')
-                    % {
-                        'nick': game.nick, 'playernum': len(game.players),
-                        'playermax': game.maxplayers, 'name': game.name,
-                        'numcaps': game.caps
-                    })
+                out.append(TOPIC_GAME.get(self.config).partial(
+                    nick=game.nick, playermax=game.maxplayers,
+                    name=game.name, numcaps=game.caps
+                    ).render(playernum=len(game.players)))
 
         self.topic.update(
-            config.get('Pickup messages', 'topic game separator') \
-            .decode('string-escape') \
+            self.config.getescaped('Pickup messages', 'topic game separator') \
             .join(out)
         )
 
@@ -335,7 +554,7 @@ class PickupBot:
 
         Signs you up for one or more games"""
         self.get_games(call, args,
-                       config.getboolean("Pickup", "implicit all games in add")) \
+                       self.config.getboolean("Pickup", "implicit all games in add")) \
             .add(call, call.nick)
 
     def remove(self, call, args):
@@ -354,13 +573,13 @@ class PickupBot:
             all = True
         if len(games):
             if all:
-                call.reply(_("All games:") + " " + config.get('Pickup messages', 'who game separator').decode('string-escape').join(games),
+                call.reply(_("All games:") + " " + self.config.getescaped('Pickup messages', 'who game separator').join(games),
 
 
-                           config.get('Pickup messages', 'who game separator').decode('string-escape'))
+                           self.config.getescaped('Pickup messages', 'who game separator'))
             else:
-                call.reply(config.get('Pickup messages', 'who game separator').decode('string-escape').join(games),
-                           config.get('Pickup messages', 'who game separator').decode('string-escape'))
+                call.reply(self.config.getescaped('Pickup messages', 'who game separator').join(games),
+                           self.config.getescaped('Pickup messages', 'who game separator'))
         else:
             if all:
                 call.reply(_("No game going on!"))
@@ -369,7 +588,7 @@ class PickupBot:
 
     def maps(self, call, args):
 
-        self.pypickupbot.cmsg(self.maps)
+        self.pypickupbot.msg(self.channel, self.maps)
 
     def set_maps(self, call, args):
 
@@ -382,10 +601,10 @@ class PickupBot:
         """!promote <game>
 
         Shows a notice encouraging players to sign up for the specified game"""
-        admin = self.pypickupbot.is_admin(call.user, call.nick)
+        admin = self.pypickupbot.is_admin(call.user, call.nick, self.channel)
 
         def _knowAdmin(admin):
-            if self.last_promote + config.getint('Pickup', 'promote delay') > time() \
+            if self.last_promote + self.config.getint('Pickup', 'promote delay') > time() \
                     and not admin:
                 raise InputError(_("Can't promote so often."))
 
@@ -396,12 +615,12 @@ class PickupBot:
                 raise InputError(_("Join the game yourself before promoting it."))
 
             self.last_promote = time()
-            self.pypickupbot.cmsg(
-                config.get('Pickup messages', 'promote').decode('string-escape') % {
-                    'bold': '\x02', 'prefix': config.get('Bot', 'command prefix'),
+            self.pypickupbot.msg(self.channel,
+                PROMOTE.get(self.config) % {
+                    'bold': '\x02', 'prefix': self.config.get('Bot', 'command prefix'),
                     'name': game.name, 'nick': game.nick,
-                    'command': config.get('Bot', 'command prefix') + 'add ' + game.nick,
-                    'channel': self.pypickupbot.channel,
+                    'command': self.config.get('Bot', 'command prefix') + 'add ' + game.nick,
+                    'channel': self.channel,
                     'playersneeded': game.maxplayers - len(game.players),
                     'maxplayers': game.maxplayers, 'numplayers': len(game.players),
                 })
@@ -443,42 +662,102 @@ class PickupBot:
         ), ', ')
 
 
-    def __init__(self, bot):
+    def __init__(self, bot, channel):
         """Plugin init
 
         Reads games from config"""
+        self.channel = channel
+        self.config = config.ChannelConfig(channel)
         self.games = {}
         self.order = []
         self.last_promote = 0
         self.maps = ''
-        if not config.has_section('Pickup games'):
+        self.topic = None
+        self.in_channel = False
+        self.journal = None
+        if not self.config.has_section('Pickup games'):
             log.err('Could not find section "Pickup games" of the config!')
             return
-        games = config.items('Pickup games')
-        #        log.msg(games)
-
-        for (gamenick, gamename) in games:
+        self.read_games()
+
+        if self.config.getboolean('Pickup', 'keep queues'):
+            self.journal = QueueJournal(self)
+            # queues start empty when they can't be read back
+            self.journal.restore().addCallback(self._restored).addErrback(
+                log.err, "restoring the pickup queue journal")
+            reactor.addSystemEventTrigger('before', 'shutdown',
+                self.journal.flush)
+
+    def read_games(self):
+        """Reads games from the config. Games that were already there
+        keep their players."""
+        games = {}
+        order = []
+        for (gamenick, gamename) in self.config.items('Pickup games'):
             if gamenick == 'order':
-                self.order = config.getlist('Pickup games', 'order')
+                order = self.config.getlist('Pickup games', 'order')
             else:
-                if config.has_section('Pickup: ' + gamenick):
-                    gamesettings = dict(config.items('Pickup: ' + gamenick))
+                if self.config.has_section('Pickup: ' + gamenick):
+                    gamesettings = dict(self.config.items('Pickup: ' + gamenick))
                 else:
                     gamesettings = {}
-                self.games[gamenick] = Game(
-                    self,
-                    gamenick, gamename,
-                    **gamesettings)
-                if gamenick not in self.order:
-                    self.order.append(gamenick)
-
-        self.order = filter(lambda x: x in self.games, self.order)
-
-    def joinedHomeChannel(self):
-        """when home channel joined, set topic"""
-        if config.get('Pickup', 'topic'):
-            self.topic = self.pypickupbot.topic.add('', Topic.GRAVITY_BEGINNING)
+                game = self.games.get(gamenick)
+                if game is None:
+                    game = Game(self, gamenick, gamename, **gamesettings)
+                else:
+                    game.configure(gamename, **gamesettings)
+                games[gamenick] = game
+                if gamenick not in order:
+                    order.append(gamenick)
+
+        for gamenick, game in self.games.iteritems():
+            if gamenick not in games:
+                if game.players:
+                    log.msg(_("{0} was removed from {1}'s games, dropping "
+                        "its players: {2}").format(gamenick, self.channel,
+                            ', '.join(game.players)))
+                    self.queue_changed('clear', gamenick)
+                PLAYERS.set(0, channel=self.channel, game=gamenick)
+        self.games = games
+        self.order = filter(lambda x: x in self.games, order)
+
+    def joined(self, channel):
+        """when our channel is joined, set topic"""
+        if self.pypickupbot.home_channel(channel) != self.channel:
+            return
+        self.in_channel = True
+        if self.config.get('Pickup', 'topic'):
+            self.topic = self.pypickupbot.topics[self.channel].add('', Topic.GRAVITY_BEGINNING)
             self.update_topic()
+        self.check_queues()
+
+    def disconnected(self):
+        """write the journal before the timers go"""
+        self.in_channel = False
+        self.topic = None
+        if self.journal is not None:
+            self.journal.flush()
+
+    def configChanged(self, sections):
+        """apply changes to the games and the topic"""
+        sections = set(section.split(' #', 1)[0] for section in sections)
+        if 'Pickup games' in sections or any(section.startswith('Pickup: ')
+                for section in sections):
+            if self.config.has_section('Pickup games'):
+                self.read_games()
+        if not sections.intersection(['Pickup', 'Pickup messages',
+                'Pickup games']) and not any(
+                section.startswith('Pickup: ') for section in sections):
+            return
+        if self.in_channel:
+            if self.config.get('Pickup', 'topic') and self.topic is None:
+                self.topic = self.pypickupbot.topics[self.channel].add('',
+                    Topic.GRAVITY_BEGINNING)
+            elif not self.config.get('Pickup', 'topic') \
+                    and self.topic is not None:
+                self.topic.remove()
+                self.topic = None
+        self.update_topic()
 
     def userRenamed(self, oldname, newname):
         """track user renames"""
@@ -486,7 +765,7 @@ class PickupBot:
 
     def userLeft(self, user, channel, *args):
         """track quitters"""
-        if channel == self.pypickupbot.channel:
+        if channel == self.channel:
             self.all_games().force_remove(user.split('!')[0])
 
     def userQuit(self, user, quitMessage):
@@ -513,7 +792,9 @@ class PickupBot:
     }
 
     eventhandlers = {
-        'joinedHomeChannel': joinedHomeChannel,
+        'joined': joined,
+        'disconnected': disconnected,
+        'configChanged': configChanged,
         'userRenamed': userRenamed,
         'userLeft': userLeft,
         'userKicked': userLeft,
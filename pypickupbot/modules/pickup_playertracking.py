@@ -30,33 +30,68 @@ from twisted.python import log
 from pypickupbot.modable import SimpleModuleFactory
 from pypickupbot import db
 from pypickupbot import config
+from pypickupbot import template
 from pypickupbot.irc import COMMAND, InputError
 from pypickupbot.misc import str_from_timediff, timediff_from_str,\
     InvalidTimeDiffString, StringTypes, itime
 
+TOP10_PLAYER = template.message('Pickup player tracking', 'top10 player',
+    ('player', 'count'))
+TOP10 = template.message('Pickup player tracking', 'top10',
+    ('playerlist', 'games'))
+LASTGAME = template.message('Pickup player tracking', 'lastgame',
+    ('name', 'nick', 'id', 'when', 'playerlist', 'captainlist'))
+LASTGAME_AUTOPICK = template.message(
+    'Pickup player tracking', 'lastgame autopick',
+    ('name', 'nick', 'id', 'when', 'teamslist'))
+GAME_READY_AUTOPICK_TEAM = template.message(
+    'Pickup messages', 'game ready autopick team',
+    ('name', 'players'))
+LASTGAME_NOCAPTAINS = template.message(
+    'Pickup player tracking', 'lastgame nocaptains',
+    ('name', 'nick', 'id', 'when', 'playerlist'))
+LASTGAMES_GAME = template.message('Pickup player tracking', 'lastgames game',
+    ('year', 'month', 'day', 'hour', 'minutes', 'nick', 'id'))
+LASTGAMES = template.message('Pickup player tracking', 'lastgames',
+    ('games', 'lastgames'))
+
+SCHEMA = [
+    ("""
+        CREATE TABLE IF NOT EXISTS
+        pickup_games
+        (
+            id      INTEGER PRIMARY KEY AUTOINCREMENT,
+            game    TEXT,
+            time    INTEGER,
+            players TEXT,
+            captains TEXT
+        )""",
+    """
+        CREATE TABLE IF NOT EXISTS
+        pickup_players_games
+        (
+            game_id INTEGER,
+            name    TEXT,
+            game    TEXT,
+            time    INTEGER
+        )
+        """),
+    # top10, lastgame and lastgames
+    ("""CREATE INDEX IF NOT EXISTS pickup_games_game_time
+        ON pickup_games(game, time)""",
+    """CREATE INDEX IF NOT EXISTS pickup_players_games_game_time
+        ON pickup_players_games(game, time)""",
+    """CREATE INDEX IF NOT EXISTS pickup_players_games_name_time
+        ON pickup_players_games(name, time)""",
+    """CREATE INDEX IF NOT EXISTS pickup_players_games_game_id
+        ON pickup_players_games(game_id)"""),
+    ]
+
 class PlayerTracking:
+    lazy = True
 
     def __init__(self, bot):
-        db.runOperation("""
-            CREATE TABLE IF NOT EXISTS
-            pickup_games
-            (
-                id      INTEGER PRIMARY KEY AUTOINCREMENT,
-                game    TEXT,
-                time    INTEGER,
-                players TEXT,
-                captains TEXT
-            )""")
-        db.runOperation("""
-            CREATE TABLE IF NOT EXISTS
-            pickup_players_games
-            (
-                game_id INTEGER,
-                name    TEXT,
-                game    TEXT,
-                time    INTEGER
-            )
-            """)
+        self.ready = db.migrate('pickup_playertracking', SCHEMA)
 
         self.pickup = bot.load('pickup')
 
@@ -64,7 +99,7 @@ class PlayerTracking:
         """!top10 [game [game ..]]
         
         Shows who participated most in said game(s)."""
-        games_ = self.pickup.get_games(call, args)
+        games_ = self.pickup.for_call(call, args).get_games(call, args)
         games = [game.nick for game in games_.games]
 
         def _doTransaction(txn):
@@ -94,13 +129,13 @@ class PlayerTracking:
         d = db.runInteraction(_doTransaction)
 
         def _cback(playerlist):
-            o = [config.get('Pickup player tracking', 'top10 player').decode('string-escape') % {
+            o = [TOP10_PLAYER.get(config) % {
                     'player': player,
                     'count': count,
                     }
                 for player, count in playerlist]
             call.reply(
-                config.get('Pickup player tracking', 'top10').decode('string-escape') % {
+                TOP10.get(config) % {
                     'playerlist': ', '.join(o),
                     'games': ' '.join(games)
                 }, ', ')
@@ -165,6 +200,7 @@ class PlayerTracking:
         """!lastgame [#id|game [game ..]]
         
         Shows when the last game or game given by id started and which players were in it"""
+        pickup = self.pickup.for_call(call, args)
         if len(args) == 1 and args[0].startswith('#'):
             try:
                 id = int(args[0][1:])
@@ -176,7 +212,7 @@ class PlayerTracking:
                 WHERE id=?
                 LIMIT 1""", (id,))
         else:
-            games_ = self.pickup.get_games(call, args)
+            games_ = pickup.get_games(call, args)
             games = [game.nick for game in games_.games]
             params = dict(zip([str(i) for i in range(len(games))], games)) 
             d = db.runQuery("""
@@ -200,7 +236,7 @@ class PlayerTracking:
                 players = players_.split()
                 captains = captains_.split()
             try:
-                game = self.pickup.get_game(call, [gamenick])
+                game = pickup.get_game(call, [gamenick])
                 gamename = game.name
                 teamnameFactory = game.teamname
             except InputError:
@@ -210,7 +246,7 @@ class PlayerTracking:
             timestr = str_from_timediff(itime()-gtime)
 
             if captains:
-                call.reply(config.get('Pickup player tracking', 'lastgame').decode('string-escape') % \
+                call.reply(LASTGAME.get(config) % \
                     {
                         'name': gamename,
                         'nick': gamenick,
@@ -220,14 +256,14 @@ class PlayerTracking:
                         'captainlist': ', '.join(captains)
                     })
             elif not isinstance(players[0], StringTypes):
-                call.reply(config.get('Pickup player tracking', 'lastgame autopick').decode('string-escape') % \
+                call.reply(LASTGAME_AUTOPICK.get(config) % \
                     {
                         'name': gamename,
                         'nick': gamenick,
                         'id': id_,
                         'when': timestr,
                         'teamslist': ', '.join([
-                            config.get('Pickup messages', 'game ready autopick team').decode('string-escape')%
+                            GAME_READY_AUTOPICK_TEAM.get(config)%
                             {
                                 'name': teamnameFactory(i),
                                 'players': ', '.join(team)
@@ -235,7 +271,7 @@ class PlayerTracking:
                             for i, team in enumerate(players)])
                     })
             else:
-                call.reply(config.get('Pickup player tracking', 'lastgame nocaptains').decode('string-escape') % \
+                call.reply(LASTGAME_NOCAPTAINS.get(config) % \
                     {
                         'name': gamename,
                         'nick': gamenick,
@@ -249,7 +285,7 @@ class PlayerTracking:
         """!lastgames [game [game ..]]
 
         List last games played in given modes."""
-        games_ = self.pickup.get_games(call, args)
+        games_ = self.pickup.for_call(call, args).get_games(call, args)
         games = [game.nick for game in games_.games]
         params = dict(zip([str(i) for i in range(len(games))], games)) 
 
@@ -264,7 +300,7 @@ class PlayerTracking:
             o = []
             for nick, ts, id in r:
                 date = datetime.fromtimestamp(ts)
-                o.append(config.get('Pickup player tracking', 'lastgames game').decode('string-escape') % {
+                o.append(LASTGAMES_GAME.get(config) % {
                     'year': date.year,
                     'month': date.month,
                     'day': date.day,
@@ -274,10 +310,10 @@ class PlayerTracking:
                     'id': id,
                 })
             o.reverse()
-            call.reply(config.get('Pickup player tracking', 'lastgames').decode('string-escape')%{
+            call.reply(LASTGAMES.get(config)%{
                 'games': ', '.join(games),
-                'lastgames': config.get('Pickup player tracking', 'lastgames separator').decode('string-escape').join(o)
-                }, config.get('Pickup player tracking', 'lastgames separator').decode('string-escape'))
+                'lastgames': config.getescaped('Pickup player tracking', 'lastgames separator').join(o)
+                }, config.getescaped('Pickup player tracking', 'lastgames separator'))
         d.addCallback(_printResult)
 
     def pickup_game_started(self, game, players, captains):
@@ -302,7 +338,7 @@ class PlayerTracking:
             def _insertPlayers(playerlist):
                 for player in playerlist:
                     if isinstance(player, StringTypes):
-                        db.runOperation("""INSERT INTO
+                        txn.execute("""INSERT INTO
                             pickup_players_games(game_id, name, game, time)
                             VALUES(?, ?, ?, ?)
                         """, (id_, player, game.nick, itime()))
@@ -311,7 +347,7 @@ class PlayerTracking:
             _insertPlayers(players)
             return id_
         def _gotId(id_):
-            self.pypickupbot.cmsg("Lastgame id: {0}".format(id_))
+            self.pypickupbot.msg(game.pickup.channel, "Lastgame id: {0}".format(id_))
             self.pypickupbot.fire('pickup_lastgame_id', id_, game, players, captains)
         return db.runInteraction(_insertGame).addCallback(_gotId)
 
@@ -0,0 +1,122 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""commands to look at the bot's internals"""
+
+from pypickupbot.modable import SimpleModuleFactory
+from pypickupbot.irc import COMMAND, COMMAND_SECONDS, EVENT_SECONDS,\
+    ROSTER_USERS
+from pypickupbot import outqueue
+from pypickupbot import db
+from pypickupbot import metrics
+from pypickupbot.misc import str_from_timediff
+
+def ms(seconds):
+    return "{0:.1f}ms".format(seconds * 1000)
+
+def timer_group(name):
+    if isinstance(name, tuple):
+        return name[0]
+    return name
+
+class StatusPlugin:
+    """The plugin"""
+    lazy = True
+
+    def timers(self, call, args):
+        """!timers [group]
+
+        Tells how many timers are pending in each group, or lists the
+        timers of a group."""
+        pending = self.pypickupbot.timers.pending()
+        if not pending:
+            call.reply(_("No timers pending."))
+            return
+
+        if args:
+            group = ' '.join(args)
+            listed = [
+                "{0} ({1})".format(
+                    ' '.join(str(part) for part in timer.name[1:]) or group,
+                    str_from_timediff(timer.remaining(), future=True, ignore=0))
+                for timer in pending if timer_group(timer.name) == group
+                ]
+            if not listed:
+                call.reply(_("No timers pending in {0}.").format(group))
+                return
+            call.reply(_("Timers in {0}:").format(group)
+                + ' ' + ', '.join(listed), ', ')
+            return
+
+        counts = {}
+        for timer in pending:
+            group = timer_group(timer.name)
+            counts[group] = counts.get(group, 0) + 1
+        call.reply(_n("One timer pending:", "{0} timers pending:",
+                len(pending)).format(len(pending))
+            + ' ' + ', '.join("{0}: {1}".format(group, count)
+                for group, count in sorted(counts.iteritems())), ', ')
+
+    def load(self, call, args):
+        """!load
+
+        Tells how many commands the rate limiter let through and how many
+        it shed."""
+        limiter = self.pypickupbot.limiter
+        stats = limiter.stats
+        reply = _("Commands run: {accepted}, dropped: {dropped}, "
+            "coalesced: {coalesced}, delayed: {delayed}.").format(**stats)
+        if limiter.shed:
+            shed = sorted(limiter.shed.iteritems(),
+                key=lambda item: item[1], reverse=True)
+            reply += ' ' + _("Most shed:") + ' ' + ', '.join(
+                "{0} ({1})".format(cmd, count) for cmd, count in shed[:5])
+        call.reply(reply, ', ')
+
+    def stats(self, call, args):
+        """!stats
+
+        Sums up the bot's metrics."""
+        out = [
+            _("Commands: {0} (avg {1})").format(
+                COMMAND_SECONDS.count(), ms(COMMAND_SECONDS.mean())),
+            _("Events: {0} (avg {1})").format(
+                EVENT_SECONDS.count(), ms(EVENT_SECONDS.mean())),
+            _("Out queue: {0} waiting (avg wait {1})").format(
+                outqueue.DEPTH.total(), ms(outqueue.WAIT_SECONDS.mean())),
+            _("Database: {0} calls (avg {1})").format(
+                db.SECONDS.count(), ms(db.SECONDS.mean())),
+            _("Users: {0}").format(ROSTER_USERS.total()),
+            ]
+        players = metrics.registry.metrics.get('pypickupbot_pickup_players')
+        if players is not None:
+            out.append(_("Players signed up: {0}").format(players.total()))
+        call.reply(', '.join(out), ', ')
+
+    commands = {
+        'timers': (timers, COMMAND.ADMIN),
+        'load': (load, COMMAND.ADMIN),
+        'stats': (stats, COMMAND.ADMIN),
+    }
+
+status = SimpleModuleFactory(StatusPlugin)
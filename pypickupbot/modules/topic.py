@@ -32,15 +32,28 @@ from pypickupbot import config
 from pypickupbot import db
 
 class TopicMgt:
+    per_channel = True
+
     motd = []
     motd_str = []
 
-    def joinedHomeChannel(self):
-        """when home channel joined, add motd to topic"""
+    def __init__(self, bot, channel):
+        self.channel = channel
+        self.config = config.ChannelConfig(channel)
+        # the main channel keeps the key it had when there was only one
+        if channel == bot.channel:
+            self.motd_key = "motd"
+        else:
+            self.motd_key = "motd %s" % channel
+
+    def joined(self, channel):
+        """when our channel is joined, add motd to topic"""
+        if self.pypickupbot.home_channel(channel) != self.channel:
+            return
         d = db.runQuery("""
             SELECT val
             FROM meta
-            WHERE key="motd" """)
+            WHERE key=?""", (self.motd_key,))
         self.current_topic = None
         self.motd = []
         self.motd_str = []
@@ -52,13 +65,13 @@ class TopicMgt:
                 db.runOperation("""
                     INSERT INTO
                     meta(key, val)
-                    VALUES("motd", "")
-                """)
+                    VALUES(?, "")
+                """, (self.motd_key,))
         d.addCallback(_setTopic)
 
     def setmotd(self):
         if len(self.motd) < len(self.motd_str):
-            self.motd.append(self.pypickupbot.topic.add("", topic.Topic.GRAVITY_END))
+            self.motd.append(self.pypickupbot.topics[self.channel].add("", topic.Topic.GRAVITY_END))
             self.setmotd()
         elif len(self.motd) > len(self.motd_str):
             self.motd[-1].remove()
@@ -69,7 +82,7 @@ class TopicMgt:
                 self.motd[i].update(self.motd_str[i])
 
     def motd_from_str(self, s):
-        sep = config.get('Topic', 'separator').decode('string-escape')
+        sep = self.config.getescaped('Topic', 'separator')
         self.motd_str = re.split(
             '%s|%s' % (
                 re.escape(sep),
@@ -83,7 +96,7 @@ class TopicMgt:
         !motd -- will make it empty"""
 
         if not args:
-            call.reply(config.getescaped('Topic', 'separator').join(self.motd_str))
+            call.reply(self.config.getescaped('Topic', 'separator').join(self.motd_str))
             return
 
         if len(args) == 1 and args[0] == '--':
@@ -93,8 +106,8 @@ class TopicMgt:
             db.runOperation("""
                 UPDATE meta
                 SET val=?
-                WHERE key="motd"
-            """, (' '.join(args),))
+                WHERE key=?
+            """, (' '.join(args), self.motd_key))
         self.setmotd()
 
     commands = {
@@ -102,7 +115,7 @@ class TopicMgt:
         }
 
     eventhandlers = {
-        'joinedHomeChannel': joinedHomeChannel
+        'joined': joined
         }
 
 topic_mgt = SimpleModuleFactory(TopicMgt)
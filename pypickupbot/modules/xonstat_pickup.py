@@ -35,9 +35,66 @@ from pypickupbot.irc import COMMAND, InputError, FetchedList
 from pypickupbot.topic import Topic
 from pypickupbot import db
 from pypickupbot import config
+from pypickupbot import metrics
+from pypickupbot import template
 from pypickupbot.misc import str_from_timediff, timediff_from_str,\
     InvalidTimeDiffString, StringTypes, itime
 
+XONSTAT_SECONDS = metrics.histogram('pypickupbot_xonstat_seconds',
+    'Time XonStat requests took to complete')
+GAME_READY = template.message('Pickup messages', 'game ready',
+    ('nick', 'playernum', 'playermax', 'name', 'numcaps', 'playerlist',
+     'captainlist'))
+GAME_READY_PLAYER = template.message('Pickup messages', 'game ready player',
+    ('nick', 'name', 'playerid'))
+GAME_READY_CAPTAIN = template.message('Pickup messages', 'game ready captain',
+    ('nick', 'name', 'playerid'))
+YOURE_NEEDED = template.message('Pickup messages', 'youre needed',
+    ('channel', 'name', 'nick', 'numcaps', 'playerlist', 'captainlist'))
+GAME_READY_NOCAPTAINS = template.message(
+    'Pickup messages', 'game ready nocaptains',
+    ('nick', 'playernum', 'playermax', 'name', 'numcaps', 'playerlist'))
+YOURE_NEEDED_NOCAPTAINS = template.message(
+    'Pickup messages', 'youre needed nocaptains',
+    ('channel', 'name', 'nick', 'numcaps', 'playerlist'))
+GAME_READY_AUTOPICK = template.message(
+    'Pickup messages', 'game ready autopick',
+    ('nick', 'playernum', 'playermax', 'name', 'numcaps', 'teamslist',
+     'captainlist', 'elo_diff'))
+GAME_READY_AUTOPICK_TEAM = template.message(
+    'Pickup messages', 'game ready autopick team',
+    ('name', 'players', 'mean_elo'))
+WHO_GAME = template.message('Pickup messages', 'who game',
+    ('nick', 'playernum', 'playermax', 'name', 'numcaps', 'playerlist'))
+TOPIC_GAME = template.message('Pickup messages', 'topic game',
+    ('nick', 'playernum', 'playermax', 'name', 'numcaps'))
+PROMOTE = template.message('Pickup messages', 'promote',
+    ('bold', 'prefix', 'name', 'nick', 'command', 'channel',
+     'playersneeded', 'maxplayers', 'numplayers'))
+PLAYER_WHOIS = template.message('Xonstat Interface', 'player whois',
+    ('players', 'num_players', 'gamenick'))
+PLAYER_LIST = template.message('Xonstat Interface', 'player list',
+    ('players', 'num_players'))
+PLAYER_SEARCH = template.message('Xonstat Interface', 'player search',
+    ('players', 'num_players'))
+PLAYERINFO_ELO_ENTRY = template.message(
+    'Xonstat Interface', 'playerinfo elo entry',
+    ('gametype', 'elo'))
+PLAYERINFO_RANK_ENTRY = template.message(
+    'Xonstat Interface', 'playerinfo rank entry',
+    ('gametype', 'rank', 'max_rank'))
+PLAYERINFO = template.message('Xonstat Interface', 'playerinfo',
+    ('nick', 'gamenick'))
+PLAYERINFO_ELOS = template.message('Xonstat Interface', 'playerinfo elos',
+    ('elos',))
+PLAYERINFO_RANKS = template.message('Xonstat Interface', 'playerinfo ranks',
+    ('ranks',))
+PLAYERINFO_PROFILE = template.message(
+    'Xonstat Interface', 'playerinfo profile',
+    ('profile',))
+PLAYER_REGISTERED = template.message('Xonstat Interface', 'player registered',
+    ('nick', 'playerid', 'gamenick', 'profile'))
+
 class Player:
 
     def __init__(self, nick, playerid = None, create_dt = None, index = None):
@@ -52,14 +109,15 @@ class Player:
 
     def get_xonstat_url(self):
         """return xontat url for specific player"""
-        return config.get("Xonstat Interface", "url").decode('string-escape') + "player/" + str(self.playerid)
+        return config.getescaped("Xonstat Interface", "url") + "player/" + str(self.playerid)
 
     def get_id(self):
         return self.playerid
 
     def _get_xonstat_json(self, request):
-        server = config.get("Xonstat Interface", "server").decode('string-escape')
+        server = config.getescaped("Xonstat Interface", "server")
 	data = ""
+        start = time()
         try:
             http = httplib.HTTPConnection(server)
             http.connect()
@@ -69,6 +127,8 @@ class Player:
             http.close()
         except:
             return {}
+        finally:
+            XONSTAT_SECONDS.observe(time() - start)
         json_data = json.loads(data)
         return json_data[0]  # dict embedded in a list
 
@@ -379,7 +439,7 @@ class Game:
             self.pickup.pypickupbot.fire('pickup_game_starting', self, playerlist, captainlist)
 
             if len(captains) > 0:
-                cmsg = config.get('Pickup messages', 'game ready').decode('string-escape')%\
+                cmsg = GAME_READY.get(config)%\
                     {
                         'nick': self.nick,
                         'playernum': len(self.players),
@@ -387,7 +447,7 @@ class Game:
                         'name': self.name,
                         'numcaps': self.caps,
                         'playerlist': ', '.join([
-                                config.get('Pickup messages', 'game ready player').decode('string-escape')%
+                                GAME_READY_PLAYER.get(config)%
                                 {
                                     'nick': player.get_nick(),
                                     'name': player.nick(),
@@ -395,7 +455,7 @@ class Game:
                                 }
                                 for player in players]),
                         'captainlist': ', '.join([
-                                config.get('Pickup messages', 'game ready captain').decode('string-escape')%
+                                GAME_READY_CAPTAIN.get(config)%
                                 {
                                     'nick': player.get_nick(),
                                     'name': player.nick(),
@@ -406,34 +466,34 @@ class Game:
                 self.pickup.pypickupbot.cmsg(cmsg.encode('utf-8'))
                 
                 if config.getboolean("Pickup", "PM each player on start"):
-                    for player in players:
-                        msg = config.get("Pickup messages", "youre needed").decode('string-escape')%\
-                            {
-                                'channel': self.pickup.pypickupbot.channel,
-                                'name': self.name,
-                                'nick': self.nick,
-                                'numcaps': self.caps,
-                                'playerlist': ', '.join([
-                                    config.get('Pickup messages', 'game ready player').decode('string-escape')%
-                                    {
-                                        'nick': player.get_nick(),
-                                        'name': player.nick,
-                                        'playerid': player.playerid,
-                                    }
-                                    for player in players]),
-                                'captainlist': ', '.join([
-                                config.get('Pickup messages', 'game ready captain').decode('string-escape')%
-                                    {
-                                        'nick': player.get_nick(),
-                                        'name': player.nick,
-                                        'playerid': player.playerid,
-                                    }
-                                    for player in captains]),
-                            }
-                        self.pickup.pypickupbot.msg(player, msg.encode('utf-8'))
+                    msg = YOURE_NEEDED.get(config)%\
+                        {
+                            'channel': self.pickup.pypickupbot.channel,
+                            'name': self.name,
+                            'nick': self.nick,
+                            'numcaps': self.caps,
+                            'playerlist': ', '.join([
+                                GAME_READY_PLAYER.get(config)%
+                                {
+                                    'nick': player.get_nick(),
+                                    'name': player.nick,
+                                    'playerid': player.playerid,
+                                }
+                                for player in players]),
+                            'captainlist': ', '.join([
+                            GAME_READY_CAPTAIN.get(config)%
+                                {
+                                    'nick': player.get_nick(),
+                                    'name': player.nick,
+                                    'playerid': player.playerid,
+                                }
+                                for player in captains]),
+                        }
+                    self.pickup.pypickupbot.msg_many([player.nick for player in players],
+                        msg.encode('utf-8'))
                         
             else:
-                cmsg = config.get('Pickup messages', 'game ready nocaptains').decode('string-escape')%\
+                cmsg = GAME_READY_NOCAPTAINS.get(config)%\
                     {
                         'nick': self.nick,
                         'playernum': len(self.players),
@@ -441,7 +501,7 @@ class Game:
                         'name': self.name,
                         'numcaps': self.caps,
                         'playerlist': ', '.join([
-                                config.get('Pickup messages', 'game ready player').decode('string-escape')%
+                                GAME_READY_PLAYER.get(config)%
                                 {
                                     'nick': player.get_nick(),
                                     'name': player.nick,
@@ -452,23 +512,23 @@ class Game:
                 self.pickup.pypickupbot.cmsg(cmsg.encode('utf-8'))
 
                 if config.getboolean("Pickup", "PM each player on start"):
-                    for player in players:
-                        msg  = config.get("Pickup messages", "youre needed nocaptains").decode('string-escape')%\
-                            {
-                                'channel': self.pickup.pypickupbot.channel,
-                                'name': self.name,
-                                'nick': self.nick,
-                                'numcaps': self.caps,
-                                'playerlist': ', '.join([
-                                    config.get('Pickup messages', 'game ready player').decode('string-escape')%
-                                    {
-                                        'nick': player.get_nick(),
-                                        'name': player.nick,
-                                        'playerid': player.playerid,
-                                    }
-                                    for player in players]),
-                            }
-                        self.pickup.pypickupbot.msg(player, msg.encode('utf-8'))
+                    msg  = YOURE_NEEDED_NOCAPTAINS.get(config)%\
+                        {
+                            'channel': self.pickup.pypickupbot.channel,
+                            'name': self.name,
+                            'nick': self.nick,
+                            'numcaps': self.caps,
+                            'playerlist': ', '.join([
+                                GAME_READY_PLAYER.get(config)%
+                                {
+                                    'nick': player.get_nick(),
+                                    'name': player.nick,
+                                    'playerid': player.playerid,
+                                }
+                                for player in players]),
+                        }
+                    self.pickup.pypickupbot.msg_many([player.nick for player in players],
+                        msg.encode('utf-8'))
 
         else:  # if not self.autopick
             # Create a pickpool containing Player instances
@@ -538,7 +598,7 @@ class Game:
             captainlist = [c.nick.encode('utf-8') for c in captains]
             self.pickup.pypickupbot.fire('pickup_game_starting', self, playerlist, captainlist)
 
-            cmsg = config.get('Pickup messages', 'game ready autopick').decode('string-escape')%\
+            cmsg = GAME_READY_AUTOPICK.get(config)%\
                 {
                     'nick': self.nick,
                     'playernum': len(players),
@@ -546,11 +606,11 @@ class Game:
                     'name': self.name,
                     'numcaps': self.caps,
                     'teamslist': ', '.join([
-                        config.get('Pickup messages', 'game ready autopick team').decode('string-escape')%
+                        GAME_READY_AUTOPICK_TEAM.get(config)%
                         {
                             'name': team.name,
                             'players': ', '.join([
-                                config.get('Pickup messages', 'game ready player').decode('string-escape')%
+                                GAME_READY_PLAYER.get(config)%
                                 {
                                     'nick': player.get_nick(),
                                     'name': player.nick,
@@ -561,7 +621,7 @@ class Game:
                         }
                         for team in teams]),
                     'captainlist': ', '.join([
-                                config.get('Pickup messages', 'game ready captain').decode('string-escape')%
+                                GAME_READY_CAPTAIN.get(config)%
                                 {
                                     'nick': player.get_nick(),
                                     'name': player.nick,
@@ -573,31 +633,31 @@ class Game:
             self.pickup.pypickupbot.cmsg(cmsg.encode('utf-8'))
                 
             if config.getboolean("Pickup", "PM each player on start"):
-                for player in players:
-                    msg = config.get("Pickup messages", "youre needed").decode('string-escape')%\
-                        {
-                            'channel': self.pickup.pypickupbot.channel,
-                            'name': self.name,
-                            'nick': self.nick,
-                            'numcaps': self.caps,
-                            'playerlist': ', '.join([
-                                config.get('Pickup messages', 'game ready player').decode('string-escape')%
-                                {
-                                    'nick': player.get_nick(),
-                                    'name': player.nick,
-                                    'playerid': player.playerid,
-                                }
-                                for player in players]),
-                            'captainlist': ', '.join([
-                                config.get('Pickup messages', 'game ready captain').decode('string-escape')%
-                                {
-                                    'nick': player.get_nick(),
-                                    'name': player.nick,
-                                    'playerid': player.playerid,
-                                }
-                                for player in captains]),
-                        }
-                    self.pickup.pypickupbot.msg(player, msg.encode('utf-8'))
+                msg = YOURE_NEEDED.get(config)%\
+                    {
+                        'channel': self.pickup.pypickupbot.channel,
+                        'name': self.name,
+                        'nick': self.nick,
+                        'numcaps': self.caps,
+                        'playerlist': ', '.join([
+                            GAME_READY_PLAYER.get(config)%
+                            {
+                                'nick': player.get_nick(),
+                                'name': player.nick,
+                                'playerid': player.playerid,
+                            }
+                            for player in players]),
+                        'captainlist': ', '.join([
+                            GAME_READY_CAPTAIN.get(config)%
+                            {
+                                'nick': player.get_nick(),
+                                'name': player.nick,
+                                'playerid': player.playerid,
+                            }
+                            for player in captains]),
+                    }
+                self.pickup.pypickupbot.msg_many([player.nick for player in players],
+                    msg.encode('utf-8'))
 
         self.pickup.pypickupbot.fire('pickup_game_started', self, playerlist, captainlist)
         self.starting = False
@@ -621,7 +681,7 @@ class Game:
     def who(self):
         """Who is in this game"""
         if len(self.players):
-            return config.get('Pickup messages', 'who game').decode('string-escape')%\
+            return WHO_GAME.get(config)%\
                 {'nick': self.nick, 'playernum': len(self.players), 'playermax': self.maxplayers,
                 'name': self.name, 'numcaps': self.caps, 'playerlist': ', '.join(self.players) }
 
@@ -689,7 +749,8 @@ class XonstatInterface:
 
         def _done(args):
             self._load_from_db()
-        d = db.runOperation("""
+        d = db.migrate('xonstat_players', [
+            """
             CREATE TABLE IF NOT EXISTS
             xonstat_players
             (
@@ -697,7 +758,8 @@ class XonstatInterface:
                 nick        TEXT,
                 playerid    INTEGER,
                 create_dt   INTEGER
-            )""")
+            )""",
+            ])
         d.addCallback(_done)
         
     def _load_from_db(self):
@@ -827,17 +889,13 @@ class XonstatPickupBot:
         for gamenick in self.order:
             game = self.games[gamenick]
             if config_topic == 1 or game.players:
-                out.append(
-                    config.get('Pickup messages', 'topic game').decode('string-escape')
-                    % {
-                        'nick': game.nick, 'playernum': len(game.players),
-                        'playermax': game.maxplayers, 'name': game.name,
-                        'numcaps': game.caps
-                    })
+                out.append(TOPIC_GAME.get(config).partial(
+                    nick=game.nick, playermax=game.maxplayers,
+                    name=game.name, numcaps=game.caps
+                    ).render(playernum=len(game.players)))
 
         self.topic.update(
-            config.get('Pickup messages', 'topic game separator')\
-                .decode('string-escape')\
+            config.getescaped('Pickup messages', 'topic game separator')\
             .join(out)
             )
 
@@ -879,13 +937,13 @@ class XonstatPickupBot:
             all = True
         if len(games):
             if all:
-                call.reply(_("All games:")+" "+config.get('Pickup messages', 'who game separator').decode('string-escape').join(games),
+                call.reply(_("All games:")+" "+config.getescaped('Pickup messages', 'who game separator').join(games),
 
 
-                    config.get('Pickup messages', 'who game separator').decode('string-escape'))
+                    config.getescaped('Pickup messages', 'who game separator'))
             else:
-                call.reply(config.get('Pickup messages', 'who game separator').decode('string-escape').join(games),
-                    config.get('Pickup messages', 'who game separator').decode('string-escape'))
+                call.reply(config.getescaped('Pickup messages', 'who game separator').join(games),
+                    config.getescaped('Pickup messages', 'who game separator'))
         else:
             if all:
                 call.reply(_("No game going on!"))
@@ -911,7 +969,7 @@ class XonstatPickupBot:
                 raise InputError(_("Join the game yourself before promoting it."))
 
             self.last_promote = time()
-            cmsg = config.get('Pickup messages', 'promote').decode('string-escape')%\
+            cmsg = PROMOTE.get(config)%\
                 {
                     'bold': '\x02', 'prefix': config.get('Bot', 'command prefix'),
                     'name': game.name, 'nick': game.nick,
@@ -1010,11 +1068,11 @@ class XonstatPickupBot:
         def do_call(is_op):
             keys = sorted(players.keys())
             if is_op:
-                reply = config.get("Xonstat Interface", "player whois").decode('string-escape')%\
+                reply = PLAYER_WHOIS.get(config)%\
                         { 'players': ", ".join(["{0} ({1})".format(k, players[k].index) for k in keys]),
                           'num_players': len(players), 'gamenick': players.values()[0].get_stripped_nick(), }
             else:        
-                reply = config.get("Xonstat Interface", "player whois").decode('string-escape')%\
+                reply = PLAYER_WHOIS.get(config)%\
                         { 'players': ", ".join(["{0}".format(k) for k in keys]),
                           'num_players': len(players), 'gamenick': players.values()[0].get_stripped_nick(), }
             call.reply(reply)
@@ -1033,11 +1091,11 @@ class XonstatPickupBot:
         def do_call(is_op):
             keys = sorted(players.keys())
             if is_op:
-                reply = config.get("Xonstat Interface", "player list").decode('string-escape')%\
+                reply = PLAYER_LIST.get(config)%\
                         { 'players': ", ".join(["{0} ({1})".format(k, players[k].index) for k in keys]),
                           'num_players': len(players), }
             else:        
-                reply = config.get("Xonstat Interface", "player list").decode('string-escape')%\
+                reply = PLAYER_LIST.get(config)%\
                         { 'players': ", ".join(["{0}".format(k) for k in keys]),
                           'num_players': len(players), }
             call.reply(reply)
@@ -1056,7 +1114,7 @@ class XonstatPickupBot:
             call.reply(_("No players found."))
             return
         
-        reply = config.get("Xonstat Interface", "player search").decode('string-escape')%\
+        reply = PLAYER_SEARCH.get(config)%\
                 { 'players': ", ".join([ "({1}) {0}".format(k, players[k].index) for k in players.keys() ]),
                   'num_players': len(players), }
         call.reply(reply)
@@ -1075,14 +1133,14 @@ class XonstatPickupBot:
             call.reply(_("No player named <{0}> found!").format(nick))
             return
         
-        sep = config.get("Xonstat Interface", "playerinfo separator").decode('string-escape')
+        sep = config.getescaped("Xonstat Interface", "playerinfo separator")
             
         elo_list = []
         for gametype,elo in player.get_elo_dict().items():
             if gametype == 'overall':
                 continue
             eloscore, games = round(elo['elo'], 1), elo['games']
-            entry = config.get("Xonstat Interface", "playerinfo elo entry").decode('string-escape')%\
+            entry = PLAYERINFO_ELO_ENTRY.get(config)%\
                 { 'gametype':gametype, 'elo':eloscore, }
             if games < 8:
                 # don't show elos with little number of games
@@ -1100,7 +1158,7 @@ class XonstatPickupBot:
             if gametype == 'overall':
                 continue
             rank, max_rank = rank['rank'], rank['max_rank']
-            entry = config.get("Xonstat Interface", "playerinfo rank entry").decode('string-escape')%\
+            entry = PLAYERINFO_RANK_ENTRY.get(config)%\
                 { 'gametype':gametype, 'rank':rank, 'max_rank':max_rank, }
             rank_list.append(entry)
         rank_list.sort()
@@ -1108,15 +1166,15 @@ class XonstatPickupBot:
         if len(rank_list) == 0:
             rank_display = _("none yet")
         
-        reply = config.get("Xonstat Interface", "playerinfo").decode('string-escape')%\
+        reply = PLAYERINFO.get(config)%\
                 { 'nick': nick, 'gamenick': player.get_nick(), }
         if len(elo_list) > 0:
-            reply += config.get("Xonstat Interface", "playerinfo elos").decode('string-escape')%\
+            reply += PLAYERINFO_ELOS.get(config)%\
                 { 'elos': elo_display }
         if len(rank_list) > 0:
-            reply += config.get("Xonstat Interface", "playerinfo ranks").decode('string-escape')%\
+            reply += PLAYERINFO_RANKS.get(config)%\
                 { 'ranks': rank_display, }
-        reply += config.get("Xonstat Interface", "playerinfo profile").decode('string-escape')%\
+        reply += PLAYERINFO_PROFILE.get(config)%\
             { 'profile': player.get_xonstat_url(), }
         call.reply(reply)
 
@@ -1147,7 +1205,7 @@ class XonstatPickupBot:
         """
         
         # TODO - only allow if user is authed
-        # FetchedList.has_flag(self.bot, self.bot.channel, nick, <flag>) == True
+        # FetchedList.has_flag(self.pypickupbot, self.pypickupbot.channel, nick, <flag>) == True
         
         if not len(args) == 1:
             raise InputError(_("You must specify your Xonstat profile id to register an account."))
@@ -1186,7 +1244,7 @@ class XonstatPickupBot:
                     def done(*args):
                         player = self.xonstat._find_player(nick)
                         call.reply("Done.")
-                        msg = config.get('Xonstat Interface', 'player registered').decode('string-escape')%\
+                        msg = PLAYER_REGISTERED.get(config)%\
                             { 'nick': nick, 'playerid': playerid, 'gamenick': player.get_nick(), 'profile': player.get_xonstat_url(), }
                         self.pypickupbot.msg( self.pypickupbot.channel, msg.encode("utf-8") )
                     self.xonstat._load_from_db().addCallback(done)
@@ -1223,7 +1281,6 @@ class XonstatPickupBot:
 
         Reads games from config"""
         self.xonstat = XonstatInterface()
-        self.bot = bot
         
         self.games = {}
         self.order = []
@@ -0,0 +1,176 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""outbound line scheduling"""
+
+from collections import OrderedDict, deque
+
+from twisted.internet import reactor
+
+from pypickupbot.misc import TokenBucket
+from pypickupbot import metrics
+
+WAIT_SECONDS = metrics.histogram('pypickupbot_outqueue_wait_seconds',
+    'Time lines waited in the out queue', ('priority',))
+DEPTH = metrics.gauge('pypickupbot_outqueue_depth',
+    'Lines waiting in the out queue', ('priority',))
+
+class PRIORITY:
+    def __init__(self): raise NotImplementedError
+
+    CONTROL = 0
+    """protocol lines: PONG, MODE, KICK, WHO, ..."""
+    ANNOUNCE = 1
+    """messages to channels and topic changes"""
+    REPLY = 2
+    """notices to users, ie. command replies"""
+    BULK = 3
+    """private messages"""
+
+    names = ['control', 'announce', 'reply', 'bulk']
+
+def classify(line, chantypes='#&'):
+    """Guesses the priority class and target of an outbound line
+
+    @returns: (priority, target)"""
+    parts = line.split(' ', 2)
+    command = parts[0].upper()
+    if command in ('PRIVMSG', 'NOTICE') and len(parts) > 1:
+        target = parts[1]
+        if target[:1] in chantypes:
+            return PRIORITY.ANNOUNCE, target
+        if command == 'NOTICE':
+            return PRIORITY.REPLY, target
+        return PRIORITY.BULK, target
+    if command == 'TOPIC':
+        return PRIORITY.ANNOUNCE, parts[1] if len(parts) > 1 else ''
+    return PRIORITY.CONTROL, ''
+
+class OutboundScheduler:
+    """Sends lines to the server within its flood allowance.
+
+    The allowance is modeled as a token bucket. Queued lines go out by
+    priority class, and round-robin between targets within a class so that
+    one user's long reply doesn't hold back everybody else's. Lines that
+    waited longer than their class' max age are dropped.
+
+    @ivar max_ages: max time in seconds a line may wait, by priority. 0 or
+        None means the line is never dropped.
+    """
+
+    def __init__(self, send, interval, burst, max_ages=None, clock=reactor):
+        self.send = send
+        self.clock = clock
+        self.bucket = TokenBucket(interval, burst, clock.seconds)
+        self.max_ages = max_ages or {}
+        self.queues = [OrderedDict() for i in PRIORITY.names]
+        self.depth = [0 for i in PRIORITY.names]
+        self.sent = [0 for i in PRIORITY.names]
+        self.dropped = [0 for i in PRIORITY.names]
+        self.wait_total = [0.0 for i in PRIORITY.names]
+        self.wait_max = [0.0 for i in PRIORITY.names]
+        self.draining = None
+
+    def enqueue(self, line, priority=PRIORITY.CONTROL, target=''):
+        """Sends line as soon as the allowance and higher priority lines
+        permit"""
+        if not any(self.depth) and self.bucket.consume():
+            self._send(line, priority, 0)
+            return
+
+        queue = self.queues[priority]
+        try:
+            queue[target].append((self.clock.seconds(), line))
+        except KeyError:
+            queue[target] = deque([(self.clock.seconds(), line)])
+        self.depth[priority] += 1
+        self._schedule()
+
+    def _send(self, line, priority, waited):
+        self.sent[priority] += 1
+        WAIT_SECONDS.observe(waited, priority=PRIORITY.names[priority])
+        self.wait_total[priority] += waited
+        if waited > self.wait_max[priority]:
+            self.wait_max[priority] = waited
+        self.send(line)
+
+    def _pop(self):
+        """Takes the next line to send, dropping stale ones on the way"""
+        now = self.clock.seconds()
+        for priority, queue in enumerate(self.queues):
+            max_age = self.max_ages.get(priority)
+            while queue:
+                target, lines = queue.popitem(last=False)
+                queued, line = lines.popleft()
+                if lines:
+                    # back of the line for this target
+                    queue[target] = lines
+                self.depth[priority] -= 1
+                if max_age and now - queued > max_age:
+                    self.dropped[priority] += 1
+                    continue
+                return priority, now - queued, line
+
+    def _drain(self):
+        self.draining = None
+        while any(self.depth) and not self.bucket.delay():
+            popped = self._pop()
+            if popped is None:
+                break
+            self.bucket.consume()
+            priority, waited, line = popped
+            self._send(line, priority, waited)
+        self._schedule()
+
+    def _schedule(self):
+        if self.draining is None and any(self.depth):
+            self.draining = self.clock.callLater(
+                self.bucket.delay(), self._drain)
+
+    def stop(self):
+        """Forgets about queued lines"""
+        if self.draining is not None and self.draining.active():
+            self.draining.cancel()
+        self.draining = None
+        self.queues = [OrderedDict() for i in PRIORITY.names]
+        self.depth = [0 for i in PRIORITY.names]
+
+    def depths(self):
+        """@returns: {(priority name,): lines waiting}"""
+        return dict(((name,), self.depth[priority])
+            for priority, name in enumerate(PRIORITY.names))
+
+    def stats(self):
+        """Queue depth, lines sent and dropped and wait times per priority
+
+        @returns: {'priority name': {'depth': int, 'sent': int, ...}}"""
+        ret = {}
+        for priority, name in enumerate(PRIORITY.names):
+            sent = self.sent[priority]
+            ret[name] = {
+                'depth': self.depth[priority],
+                'sent': sent,
+                'dropped': self.dropped[priority],
+                'wait avg': self.wait_total[priority] / sent if sent else 0.0,
+                'wait max': self.wait_max[priority],
+            }
+        return ret
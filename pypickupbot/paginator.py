@@ -0,0 +1,132 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""splitting long replies into IRC-sized pages"""
+
+import re
+
+MAX_LINE = 512
+"""maximum length of a line as relayed by the server, CRLF included"""
+
+colorRe = re.compile(r'\x03(?:\d{1,2}(?:,\d{1,2})?)?')
+
+def _length(bot, feature, default):
+    """A length limit the server advertises, twisted keeps it as a
+    tuple of strings"""
+    value = bot.supported.getFeature(feature)
+    if value:
+        try:
+            return int(value[0])
+        except ValueError:
+            pass
+    return default
+
+def payload_budget(bot, command, target):
+    """How many bytes of text fit in one message from us to target
+
+    The server prepends our full hostmask when relaying the line, so it
+    counts against the limit too. While our ident and host are unknown,
+    assumes the longest ones the server allows.
+
+    @param command: PRIVMSG or NOTICE
+    @returns: int"""
+    mask = getattr(bot, 'hostmask', None)
+    if mask is None or mask.split('!', 1)[0] != bot.nickname:
+        mask = '%s!%s@%s' % (bot.nickname,
+            'x' * _length(bot, 'USERLEN', 10),
+            'x' * _length(bot, 'HOSTLEN', 63))
+    # ":mask COMMAND target :text\r\n"
+    return MAX_LINE - len(':%s %s %s :\r\n' % (mask, command, target))
+
+def safe_cut(data, cut):
+    """Moves a cut point in an utf-8 encoded string back so that it
+    falls neither inside a multibyte character nor inside a colour code
+
+    @returns: int"""
+    if cut >= len(data):
+        return len(data)
+    # continuation bytes look like 10xxxxxx
+    while cut > 0 and ord(data[cut]) & 0xC0 == 0x80:
+        cut -= 1
+    # a colour code is at most 6 bytes long
+    start = data.rfind('\x03', max(0, cut - 5), cut)
+    if start != -1:
+        m = colorRe.match(data, start)
+        if m.end() > cut:
+            cut = start
+    return cut
+
+class Paginator:
+    """Cuts a message into pieces that fit a byte budget each
+
+    The text is encoded once, the paginator then only moves a cursor
+    along it, so it can be kept around to continue later.
+
+    @ivar data: utf-8 encoded text
+    @ivar pos: offset of the first byte not sent yet"""
+
+    def __init__(self, text, split=" "):
+        """
+        @param text: str (utf-8) or unicode
+        @param split: what it is best to split at"""
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        if isinstance(split, unicode):
+            split = split.encode('utf-8')
+        self.data = text
+        self.split = split
+        self.pos = 0
+
+    def remaining(self):
+        """@returns: number of bytes left"""
+        return len(self.data) - self.pos
+
+    def done(self):
+        return self.pos >= len(self.data)
+
+    def take(self, budget):
+        """Returns the next piece of at most budget bytes
+
+        Cuts after the last splitting point that fits if there is one,
+        else cuts straight in, but never inside a character or a colour
+        code.
+
+        @returns: str"""
+        start = self.pos
+        end = start + budget
+        if end >= len(self.data):
+            self.pos = len(self.data)
+            return self.data[start:]
+        cut = -1
+        if self.split:
+            cut = self.data.rfind(self.split, start + 1, end + len(self.split))
+        if cut != -1:
+            self.pos = cut + len(self.split)
+            return self.data[start:cut]
+        cut = safe_cut(self.data, end)
+        if cut <= start:
+            # budget smaller than one character, make progress anyway
+            cut = end
+        self.pos = cut
+        return self.data[start:cut]
+
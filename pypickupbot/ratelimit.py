@@ -0,0 +1,165 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""inbound command rate limiting"""
+
+from time import time
+
+from pypickupbot import config
+from pypickupbot import logger
+from pypickupbot.misc import TokenBucket
+from pypickupbot.roster import casefolder
+
+LOG = logger.get('ratelimit')
+
+class InboundLimiter:
+    """Decides whether commands get run, before they are dispatched
+
+    Every command costs tokens from the sender's nick bucket, the
+    sender's host bucket and the global bucket. When one of them runs
+    dry, the command is dropped, or in coalesce mode it replaces the
+    sender's pending command, which is run once the tokens are back.
+
+    @ivar stats: counters of accepted, dropped, coalesced and delayed
+        commands
+    @ivar shed: command -> how many times it was dropped or coalesced"""
+
+    def __init__(self, bot, seconds=time):
+        self.bot = bot
+        self.seconds = seconds
+        self._key = None
+        self.nicks = {}
+        self.hosts = {}
+        self.pending = {}
+        self.stats = {'accepted': 0, 'dropped': 0, 'coalesced': 0,
+            'delayed': 0}
+        self.shed = {}
+
+    def _rebuild(self):
+        self.user_rate = (config.getfloat('Bot', 'user command interval'),
+            config.getint('Bot', 'user command burst'))
+        self.global_bucket = TokenBucket(
+            config.getfloat('Bot', 'global command interval'),
+            config.getint('Bot', 'global command burst'),
+            self.seconds)
+        # buckets never hold more than their burst, a command costing
+        # more could never be paid for
+        bursts = [burst for interval, burst
+            in (self.user_rate, (self.global_bucket.interval,
+                self.global_bucket.burst))
+            if interval > 0]
+        self.costs = {}
+        for cmd, cost in config.getdict('Bot', 'command costs').iteritems():
+            cost = float(cost)
+            if bursts and cost > min(bursts):
+                LOG.warning(_("Command {0} costs {1}, more than a burst of "
+                    "{2}: it costs {2} instead."), cmd, cost, min(bursts))
+                cost = min(bursts)
+            self.costs[cmd.strip().lower()] = cost
+        self.coalesce = config.get('Bot', 'over limit').lower() == 'coalesce'
+        self.nicks.clear()
+        self.hosts.clear()
+        self._key = config.generation
+
+    def _bucket(self, buckets, key):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(*self.user_rate,
+                seconds=self.seconds)
+            if len(buckets) == 1:
+                self._schedule_prune()
+        return bucket
+
+    def _buckets(self, user, nick):
+        host = user.partition('@')[2]
+        buckets = [self._bucket(self.nicks, nick), self.global_bucket]
+        if host:
+            buckets.append(self._bucket(self.hosts, host.lower()))
+        return buckets
+
+    def submit(self, user, cmd, func, *args):
+        """Runs func(*args) now if user may run cmd, later or never
+        otherwise
+
+        @returns: whether func was run right away"""
+        if self._key != config.generation:
+            self._rebuild()
+        cost = self.costs.get(cmd, 1.0)
+        nick = casefolder(self.bot.casemapping())(user.split('!', 1)[0])
+        buckets = self._buckets(user, nick)
+
+        if nick not in self.pending and self._take(buckets, cost):
+            self.stats['accepted'] += 1
+            func(*args)
+            return True
+
+        self.shed[cmd] = self.shed.get(cmd, 0) + 1
+        if not self.coalesce:
+            self.stats['dropped'] += 1
+            LOG.info(_("Over the command rate limit, dropped {0} from {1}."),
+                cmd, user)
+            return False
+
+        if nick in self.pending:
+            self.stats['coalesced'] += 1
+        else:
+            self.stats['delayed'] += 1
+        self.pending[nick] = (user, cmd, func, args)
+        self.bot.timers.schedule(('ratelimit', nick),
+            max(bucket.delay(cost) for bucket in buckets),
+            self._run_pending, nick)
+        return False
+
+    def _take(self, buckets, cost):
+        for bucket in buckets:
+            if bucket.delay(cost) > 0:
+                return False
+        for bucket in buckets:
+            bucket.consume(cost)
+        return True
+
+    def _run_pending(self, nick):
+        user, cmd, func, args = self.pending[nick]
+        cost = self.costs.get(cmd, 1.0)
+        buckets = self._buckets(user, nick)
+        if not self._take(buckets, cost):
+            # somebody else used the global budget meanwhile
+            self.bot.timers.schedule(('ratelimit', nick),
+                max(bucket.delay(cost) for bucket in buckets),
+                self._run_pending, nick)
+            return
+        del self.pending[nick]
+        self.stats['accepted'] += 1
+        func(*args)
+
+    def _schedule_prune(self):
+        self.bot.timers.schedule('ratelimit prune', 5 * 60, self._prune)
+
+    def _prune(self):
+        """Forgets buckets that are full again"""
+        for buckets in (self.nicks, self.hosts):
+            for key, bucket in buckets.items():
+                if bucket.delay(bucket.burst) == 0:
+                    del buckets[key]
+        if self.nicks or self.hosts:
+            self._schedule_prune()
@@ -0,0 +1,209 @@
+#
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Recording of inbound IRC traffic, see L{pypickupbot.replay}"""
+
+import os.path
+import re
+import gzip
+from time import time
+
+from twisted.internet import reactor
+from twisted.python import log
+
+from pypickupbot import config
+
+maskRe = re.compile(r'([^\s!@:,]+)!([^\s!@:,]+)@([^\s:,]+)')
+nickRe = re.compile(r'(?<![\w#&!.\[\]\\`^{|}-])[A-Za-z\[\]\\`^_{|}][\w\[\]\\`^{|}-]*')
+NAME_PREFIXES = '~&@%+!'
+
+class Anonymizer:
+    """Replaces nicknames, accounts, idents and hosts with made up ones,
+    the same each time they come up
+
+    Nicknames are only recognized in messages once they were seen joining,
+    in a user list or in the prefix of a line.
+
+    @ivar keep: folded nicknames left as they are"""
+
+    def __init__(self, keep=()):
+        self.nicks = {}
+        self.hosts = {}
+        self.keep = set(nick.lower() for nick in keep)
+
+    def nick(self, nick):
+        key = nick.lower()
+        if not nick or nick == '*' or key in self.keep:
+            return nick
+        try:
+            return self.nicks[key]
+        except KeyError:
+            alias = self.nicks[key] = 'user%d' % (len(self.nicks) + 1)
+            return alias
+
+    def host(self, host):
+        try:
+            return self.hosts[host]
+        except KeyError:
+            alias = self.hosts[host] = 'host%d.anon' % (len(self.hosts) + 1)
+            return alias
+
+    def _mask(self, match):
+        nick, ident, host = match.groups()
+        stripped = nick.lstrip(NAME_PREFIXES)
+        if stripped.lower() in self.keep:
+            return match.group(0)
+        return '%s%s!user@%s' % (nick[:len(nick) - len(stripped)],
+            self.nick(stripped), self.host(host))
+
+    def _word(self, match):
+        word = match.group(0)
+        return self.nicks.get(word.lower(), word)
+
+    def text(self, text):
+        return nickRe.sub(self._word, maskRe.sub(self._mask, text))
+
+    def _name(self, name):
+        stripped = name.lstrip(NAME_PREFIXES)
+        self.nick(stripped.split('!', 1)[0])
+        return name
+
+    def line(self, line):
+        """@returns: line with everyone it mentions replaced"""
+        tags = ''
+        if line[:1] == '@':
+            tags, line = line.split(' ', 1)
+            tags = '@%s ' % ';'.join(
+                'account=' + self.nick(tag[8:])
+                    if tag.startswith('account=') else tag
+                for tag in tags[1:].split(';'))
+        prefix = source = ''
+        if line[:1] == ':':
+            prefix, line = line.split(' ', 1)
+            if '!' in prefix:
+                source = prefix[1:].split('!', 1)[0]
+                self.nick(source)
+            prefix = ':%s ' % maskRe.sub(self._mask, prefix[1:])
+        if ' :' in line:
+            line, trailing = line.split(' :', 1)
+        else:
+            trailing = None
+        params = line.split(' ')
+        command = params.pop(0).upper()
+        if trailing is not None:
+            params.append(trailing)
+
+        # parameters replaced here aren't looked at again
+        done = {}
+        if command == 'NICK' and params:
+            self.nick(params[0])
+        elif command == 'ACCOUNT' and params:
+            done[0] = self.nick(params[0])
+        elif command == 'KICK' and len(params) > 1:
+            self.nick(params[1])
+        elif command == 'JOIN' and len(params) > 2:
+            # extended-join: account and real name
+            done[1] = self.nick(params[1])
+            done[2] = self.nick(source)
+        elif command == '353' and params:
+            for name in params[-1].split():
+                self._name(name)
+        elif command == '352' and len(params) > 7:
+            done[2] = 'user'
+            done[3] = self.host(params[3])
+            done[5] = self.nick(params[5])
+            done[7] = '0 ' + done[5]
+
+        params = [done[i] if i in done else self.text(param)
+            for i, param in enumerate(params)]
+        if trailing is not None:
+            params[-1] = ':' + params[-1]
+        return tags + prefix + ' '.join([command] + params)
+
+class Recorder:
+    """Writes inbound lines to a file along with when they came in
+
+    Each line is written as the milliseconds since the previous one, a
+    space and the line as it came from the server. Each connection starts
+    with a line of its own: C{#}, a space and the time it was made. Files
+    ending in C{.gz} are compressed."""
+
+    def __init__(self, path, anonymize=False, seconds=time):
+        opener = gzip.open if path.endswith('.gz') else open
+        self.file = opener(path, 'ab')
+        self.anonymizer = Anonymizer() if anonymize else None
+        self.seconds = seconds
+        self.last = seconds()
+        reactor.addSystemEventTrigger('before', 'shutdown', self.close)
+        log.msg(_("Recording inbound traffic to {0}").format(path))
+
+    @classmethod
+    def from_config(cls):
+        """@returns: a recorder as configured, or None"""
+        path = config.get('Bot', 'record')
+        if not path:
+            return None
+        return cls(os.path.expanduser(path),
+            config.getboolean('Bot', 'record anonymize'))
+
+    def session(self, nickname):
+        """Marks the start of a connection
+
+        @param nickname: the bot's, it is never anonymized"""
+        self.last = self.seconds()
+        if self.anonymizer is not None:
+            self.anonymizer.keep.add(nickname.lower())
+        self.file.write('# %.3f\n' % self.last)
+
+    def record(self, line):
+        now = self.seconds()
+        if self.anonymizer is not None:
+            line = self.anonymizer.line(line)
+        self.file.write('%d %s\n' % (round((now - self.last) * 1000), line))
+        self.last = now
+
+    def flush(self):
+        if not self.file.closed:
+            self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+def read(path):
+    """Reads a recording
+
+    @returns: list of sessions, each a list of (seconds since the previous
+        line, line)"""
+    opener = gzip.open if path.endswith('.gz') else open
+    sessions = []
+    with opener(path, 'rb') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line.startswith('# '):
+                sessions.append([])
+            elif line and sessions:
+                delay, line = line.split(' ', 1)
+                sessions[-1].append((int(delay) / 1000.0, line))
+    return sessions
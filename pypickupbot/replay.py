@@ -0,0 +1,218 @@
+#
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Replays a recording made with the C{record} setting against the bot
+
+The bot runs as usual from a configuration directory, but talks to a fake
+connection and an in-memory database. Lines are fed at the speed they
+were recorded at, or with C{--fast} as fast as the bot takes them::
+
+    python -m pypickupbot.replay -c configdir --fast -o out.txt evening.gz
+
+What the bot sends is written to the C{--out} file, one line each, so that
+two versions of the bot can be compared with C{--compare}."""
+
+import os
+import sys
+import random
+from time import time
+
+from twisted.internet import reactor, address
+from twisted.python import usage
+
+from pypickupbot import i18n
+from pypickupbot import config
+from pypickupbot import db
+from pypickupbot import record
+from pypickupbot import logger
+from pypickupbot.irc import IrcBotFactory
+
+class Options(usage.Options):
+
+    optFlags = [
+        ['fast', 'f', "Feed lines as fast as the bot takes them."],
+        ['debug', 'd', "Enable debug output"],
+    ]
+    optParameters = [
+        ['config', 'c', None, "What config directory to use."],
+        ['session', 's', 1, "Which connection of the recording to replay.",
+            int],
+        ['out', 'o', None, "Write what the bot sends to this file."],
+        ['compare', None, None,
+            "Compare what the bot sends to this earlier --out file."],
+        ['seed', None, 0, "Seed for the bot's random choices.", int],
+    ]
+
+    def parseArgs(self, recording):
+        self['recording'] = recording
+
+class ReplayTransport:
+    """Keeps what the bot sends"""
+
+    disconnecting = False
+
+    def __init__(self):
+        self.lines = []
+        self.buffer = ''
+        self.last_write = time()
+
+    def write(self, data):
+        lines = (self.buffer + data).split('\r\n')
+        self.buffer = lines.pop()
+        self.lines.extend(lines)
+        self.last_write = time()
+
+    def writeSequence(self, data):
+        self.write(''.join(data))
+
+    def loseConnection(self):
+        self.disconnecting = True
+
+    def getPeer(self):
+        return address.IPv4Address('TCP', '127.0.0.1', 6667)
+
+    def getHost(self):
+        return address.IPv4Address('TCP', '127.0.0.1', 0)
+
+class Replayer:
+    """Feeds recorded lines to a bot
+
+    @ivar records: list of (seconds since the previous line, line)
+    @ivar fast: don't wait between lines"""
+
+    # How long the bot must stay quiet after the last line to be done
+    QUIET = 0.5
+
+    def __init__(self, records, fast=False):
+        self.records = records
+        self.fast = fast
+        self.pos = 0
+
+    def start(self):
+        self.transport = ReplayTransport()
+        self.bot = IrcBotFactory().buildProtocol(None)
+        self.bot.makeConnection(self.transport)
+        self.started = time()
+        self.next()
+
+    def next(self, waited=False):
+        """Feeds lines due now, then waits for the next ones"""
+        while self.pos < len(self.records):
+            delay, line = self.records[self.pos]
+            if self.pos and delay > 0 and not (waited or self.fast):
+                reactor.callLater(delay, self.next, True)
+                return
+            waited = False
+            self.pos += 1
+            self.bot.lineReceived(line)
+            if self.fast:
+                self.settle()
+                return
+        self.fed = time()
+        self.wait()
+
+    def settle(self):
+        """Waits for database calls to finish so that their results come
+        in at the same point each time"""
+        if db.DBs.running:
+            reactor.callLater(0.001, self.settle)
+        else:
+            reactor.callLater(0, self.next)
+
+    def wait(self):
+        if any(self.bot.outqueue.depth) \
+                or time() - self.transport.last_write < self.QUIET:
+            reactor.callLater(0.1, self.wait)
+            return
+        self.bot.connectionLost(None)
+        self.done()
+
+    def done(self):
+        reactor.stop()
+
+def compare(lines, path):
+    """Tells whether lines are the same as in an earlier --out file"""
+    with open(path) as f:
+        previous = [line.rstrip('\n') for line in f]
+    for i, (old, new) in enumerate(zip(previous, lines)):
+        if old != new:
+            print("Line {0} differs:\n  was: {1}\n  now: {2}".format(
+                i + 1, old, new))
+            return False
+    if len(previous) != len(lines):
+        print("{0} lines were sent, {1} this time.".format(
+            len(previous), len(lines)))
+        return False
+    print("The bot sent the same {0} lines.".format(len(lines)))
+    return True
+
+def from_commandline():
+    options = Options()
+    try:
+        options.parseOptions()
+    except usage.UsageError as errortext:
+        print('%s: %s' % (sys.argv[0], errortext))
+        print('%s: Try --help for usage details.' % (sys.argv[0]))
+        sys.exit(1)
+
+
+    sessions = record.read(options['recording'])
+    if not 0 < options['session'] <= len(sessions):
+        print("%s: the recording has %d connections." % (
+            sys.argv[0], len(sessions)))
+        sys.exit(1)
+    records = sessions[options['session'] - 1]
+
+    config.parse_init_configs(options['config'])
+    logger.configure_from(config, options['debug'])
+    if options['debug']:
+        logger.start()
+    else:
+        # still format messages, as the bot would when not replaying
+        logger.start(out=open(os.devnull, 'w'))
+    config.set('Bot', 'record', '')
+    config.set('Bot', 'metrics port', '')
+    config.set('Bot', 'watch config', 'no')
+    if options['fast']:
+        config.set('Server', 'line interval', '0')
+    db.DBs.load_db(dbfile=':memory:')
+    random.seed(options['seed'])
+
+    replayer = Replayer(records, options['fast'])
+    reactor.callWhenRunning(replayer.start)
+    reactor.run()
+
+    lines = replayer.transport.lines
+    recorded = sum(delay for delay, line in records)
+    print("Replayed {0} lines ({1:.1f}s recorded) in {2:.3f}s, "
+        "the bot sent {3} lines.".format(len(records), recorded,
+            replayer.fed - replayer.started, len(lines)))
+    if options['out']:
+        with open(options['out'], 'w') as f:
+            f.writelines(line + '\n' for line in lines)
+    if options['compare'] and not compare(lines, options['compare']):
+        sys.exit(2)
+
+if __name__ == '__main__':
+    from_commandline()
@@ -0,0 +1,173 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""channel user lists"""
+
+import string
+
+_upper = string.ascii_uppercase
+_lower = string.ascii_lowercase
+
+CASEMAPPINGS = {
+    'ascii': string.maketrans(_upper, _lower),
+    'rfc1459': string.maketrans(_upper + '[]\\~', _lower + '{}|^'),
+    'strict-rfc1459': string.maketrans(_upper + '[]\\', _lower + '{}|'),
+    }
+
+def casefolder(casemapping='rfc1459'):
+    """Returns a function that lowercases nicknames according to the
+    server's CASEMAPPING"""
+    table = CASEMAPPINGS.get(casemapping, CASEMAPPINGS['ascii'])
+    def fold(s):
+        if isinstance(s, unicode):
+            return s.lower()
+        return s.translate(table)
+    return fold
+
+class RosterEntry(object):
+    """a user in a channel
+
+    Unpacks like the (nick, ident, host, flags) tuples user lists used to
+    be made of.
+
+    @ivar account: services account, when the server tells
+    @ivar away: away message, or None
+    """
+    __slots__ = ('nick', 'ident', 'host', 'flags', 'account', 'away')
+
+    def __init__(self, nick, ident=None, host=None, flags=None,
+            account=None):
+        self.nick = nick
+        self.ident = ident
+        self.host = host
+        if flags is None:
+            flags = set()
+        self.flags = flags
+        self.account = account
+        self.away = None
+
+    def __iter__(self):
+        return iter((self.nick, self.ident, self.host, self.flags))
+
+    def mask(self):
+        """nick!ident@host, with * for what isn't known"""
+        return '%s!%s@%s' % (self.nick, self.ident or '*', self.host or '*')
+
+    def __repr__(self):
+        return 'RosterEntry(%r, %r, %r, %r)' % tuple(self)
+
+class Roster:
+    """Users of a channel, indexed by casefolded nickname and by host
+
+    Supports the list operations L{FetchedList} uses on its contents.
+
+    @ivar hostless: how many users' ident and host are unknown
+    """
+
+    def __init__(self, casemapping='rfc1459'):
+        self.fold = casefolder(casemapping)
+        self.entries = {}
+        self.hosts = {}
+        self.hostless = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return self.entries.itervalues()
+
+    def __contains__(self, nick):
+        return self.fold(nick) in self.entries
+
+    def get(self, nick, default=None):
+        """Finds a user by nickname"""
+        return self.entries.get(self.fold(nick), default)
+
+    def by_host(self, host):
+        """Finds all users connected from host"""
+        return [self.entries[key] for key in self.hosts.get(host, ())]
+
+    def add(self, entry):
+        """Adds or replaces a user"""
+        key = self.fold(entry.nick)
+        if key in self.entries:
+            self._unindex(key, self.entries[key])
+        self.entries[key] = entry
+        if entry.host is not None:
+            self.hosts.setdefault(entry.host, set()).add(key)
+        else:
+            self.hostless += 1
+
+    def append(self, entry):
+        self.add(entry)
+
+    def extend(self, entries):
+        for entry in entries:
+            self.add(entry)
+
+    def discard(self, nick):
+        """Removes a user if present
+
+        @returns: the removed entry or None"""
+        key = self.fold(nick)
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self._unindex(key, entry)
+        return entry
+
+    def remove(self, entry):
+        """Removes a user, raising ValueError like lists if not present
+
+        @param entry: a L{RosterEntry} or a nickname"""
+        nick = getattr(entry, 'nick', entry)
+        if self.discard(nick) is None:
+            raise ValueError(nick)
+
+    def rename(self, oldnick, newnick):
+        """Changes a user's nickname
+
+        @returns: the entry, or None if oldnick isn't here"""
+        entry = self.discard(oldnick)
+        if entry is not None:
+            entry.nick = newnick
+            self.add(entry)
+        return entry
+
+    def set_host(self, nick, ident, host):
+        """Updates a user's ident and host"""
+        entry = self.discard(nick)
+        if entry is not None:
+            entry.ident = ident
+            entry.host = host
+            self.add(entry)
+        return entry
+
+    def _unindex(self, key, entry):
+        if entry.host is None:
+            self.hostless -= 1
+            return
+        keys = self.hosts.get(entry.host)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.hosts[entry.host]
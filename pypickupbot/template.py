@@ -0,0 +1,173 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""message templates: %-format strings with named placeholders, checked
+against what the code passes them"""
+
+import re
+import sys
+
+from ConfigParser import NoSectionError, NoOptionError
+
+PLACEHOLDER = re.compile(r"""
+    %(?:\((?P<key>[^)]*)\))?
+    (?P<spec>[#0\- +]*(?:\*|\d+)?(?:\.(?:\*|\d+))?[hlL]?
+        [diouxXeEfFgGcrs%])
+    """, re.VERBOSE)
+
+class TemplateError(ValueError):
+    pass
+
+class Template:
+    """A template, parsed once
+
+    Render it with L{render} or with the % operator and a dict, as with
+    the string it was made from.
+
+    @ivar keys: names of its placeholders"""
+
+    def __init__(self, text):
+        self.text = text
+        self.keys = set()
+        self.parts = []
+        self.partials = {}
+        pos = 0
+        for m in PLACEHOLDER.finditer(text):
+            self._literal(text[pos:m.start()])
+            if m.group('spec') == '%':
+                if m.group('key') is not None:
+                    raise TemplateError("%r: %%(...)%% is not a placeholder"
+                        % text)
+                self.parts.append((None, '%%'))
+            elif m.group('key') is None:
+                raise TemplateError("%r: unnamed placeholder %s"
+                    % (text, m.group(0)))
+            else:
+                self.keys.add(m.group('key'))
+                self.parts.append((m.group('key'), m.group(0)))
+            pos = m.end()
+        self._literal(text[pos:])
+
+    def _literal(self, s):
+        if '%' in s:
+            raise TemplateError("%r: stray %% in %r" % (self.text, s))
+        if s:
+            self.parts.append((None, s))
+
+    def render(self, **values):
+        return self.text % values
+
+    def __mod__(self, values):
+        return self.text % values
+
+    def partial(self, **values):
+        """Fills in some placeholders, for when they stay the same for
+        many renders
+
+        @returns: the L{Template} with the others left, made once for
+            each set of values"""
+        key = tuple(sorted(values.iteritems()))
+        try:
+            return self.partials[key]
+        except KeyError:
+            pass
+        text = []
+        for name, s in self.parts:
+            if name in values:
+                s = (s % values).replace('%', '%%')
+            text.append(s)
+        partial = self.partials[key] = Template(''.join(text))
+        return partial
+
+    def check(self, variables):
+        """Tries the template with the variables code passes to it
+
+        @raises TemplateError: if it uses others, or they don't fit"""
+        unknown = self.keys.difference(variables)
+        if unknown:
+            raise TemplateError("%r: unknown placeholder%s %s, use %s" % (
+                self.text, 's' if len(unknown) > 1 else '',
+                ', '.join(sorted(unknown)), ', '.join(sorted(variables))))
+        try:
+            self.text % dict.fromkeys(variables, 0)
+        except (TypeError, ValueError) as e:
+            raise TemplateError("%r: %s" % (self.text, e))
+
+class Message:
+    """A template from the configuration, as used by some code
+
+    @ivar variables: what the code passes to it"""
+
+    def __init__(self, section, option, variables):
+        self.section = section
+        self.option = option
+        self.variables = frozenset(variables)
+
+    def get(self, cfg):
+        """@param cfg: L{pypickupbot.config} or a
+            L{pypickupbot.config.ChannelConfig}
+        @returns: L{Template}"""
+        return cfg.gettemplate(self.section, self.option)
+
+    def render(self, cfg, **values):
+        return self.get(cfg).render(**values)
+
+    def check(self, cfg, channels=()):
+        """@returns: list of problems with the template, as set for
+        cfg and each of channels"""
+        problems = []
+        sections = [self.section] + ['%s %s' % (self.section, channel)
+            for channel in channels]
+        for section in sections:
+            if section != self.section and not (cfg.has_section(section)
+                    and cfg.has_option(section, self.option)):
+                continue
+            try:
+                cfg.gettemplate(section, self.option).check(self.variables)
+            except (NoSectionError, NoOptionError):
+                problems.append("[%s] %s is not set" % (section, self.option))
+            except TemplateError as e:
+                problems.append("[%s] %s: %s" % (section, self.option, e))
+        return problems
+
+messages = {}
+
+def message(section, option, variables):
+    """Declares a template that the calling module uses
+
+    @param variables: names of the values the code passes to it
+    @returns: L{Message}"""
+    m = Message(section, option, variables)
+    module = sys._getframe(1).f_globals['__name__']
+    messages.setdefault(module, []).append(m)
+    return m
+
+def check(cfg, channels, module):
+    """Checks the templates a module uses
+
+    @param module: the module's name, as in C{sys.modules}
+    @raises TemplateError: listing every problem found"""
+    problems = []
+    for m in messages.get(module, ()):
+        problems.extend(m.check(cfg, channels))
+    if problems:
+        raise TemplateError('\n'.join(problems))
@@ -0,0 +1,234 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""a hierarchical timer wheel for the bot's many short-lived timers"""
+
+from math import ceil
+
+from twisted.internet import reactor
+from twisted.python import log
+
+class Timer(object):
+    """A pending call on a L{TimerWheel}
+
+    @ivar name: hashable name the timer is known as. Tuples are grouped by
+        their first element, see L{TimerWheel.cancel_group}
+    @ivar deadline: tick at which it is due"""
+    __slots__ = ('name', 'deadline', 'func', 'args', 'kwargs', 'slot',
+        'wheel')
+
+    def __init__(self, wheel, name, deadline, func, args, kwargs):
+        self.wheel = wheel
+        self.name = name
+        self.deadline = deadline
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.slot = None
+
+    def active(self):
+        return self.wheel.timers.get(self.name) is self
+
+    def cancel(self):
+        if self.active():
+            self.wheel.cancel(self.name)
+
+    def remaining(self):
+        """@returns: seconds left before it fires, approximately"""
+        return max(0.0, self.wheel.time_of(self.deadline)
+            - self.wheel.clock.seconds())
+
+class TimerWheel:
+    """Schedules named timers on a hierarchical timing wheel
+
+    Adding, replacing and cancelling a timer are O(1). A single
+    DelayedCall ticks the wheel, and only while timers are pending. Timers
+    due at the same tick are expired together. Precision is one tick.
+
+    @ivar timers: name -> L{Timer}
+    @ivar levels: each level is a list of slots, each slot maps names to
+        timers. Level n spans size**(n+1) ticks."""
+
+    def __init__(self, resolution=1.0, size=64, depth=4, clock=reactor):
+        self.resolution = float(resolution)
+        self.size = size
+        self.clock = clock
+        self.levels = [[{} for i in xrange(size)] for j in xrange(depth)]
+        self.overflow = {}
+        self.timers = {}
+        self.groups = {}
+        self.epoch = clock.seconds()
+        self.ticks = 0
+        self.ticking = None
+
+    def _now_tick(self):
+        return int((self.clock.seconds() - self.epoch) / self.resolution)
+
+    def time_of(self, tick):
+        """@returns: when a tick happens, in clock seconds"""
+        return self.epoch + tick * self.resolution
+
+    def schedule(self, name, delay, func, *args, **kwargs):
+        """Calls func after delay seconds, replacing any timer with the
+        same name
+
+        @returns: L{Timer}"""
+        self.cancel(name)
+        if not self.timers:
+            # the wheel is empty, fast forward to now
+            self.ticks = self._now_tick()
+        deadline = int(ceil(
+            (self.clock.seconds() + delay - self.epoch) / self.resolution))
+        timer = Timer(self, name, max(deadline, self.ticks + 1),
+            func, args, kwargs)
+        self.timers[name] = timer
+        if isinstance(name, tuple):
+            self.groups.setdefault(name[0], set()).add(name)
+        self._place(timer)
+        self._start()
+        return timer
+
+    def _place(self, timer):
+        delta = timer.deadline - self.ticks
+        span = self.size
+        shift = 1
+        for level in self.levels:
+            if delta < span:
+                timer.slot = level[(timer.deadline // shift) % self.size]
+                timer.slot[timer.name] = timer
+                return
+            span *= self.size
+            shift *= self.size
+        timer.slot = self.overflow
+        self.overflow[timer.name] = timer
+
+    def get(self, name):
+        """@returns: the L{Timer} known as name, or None"""
+        return self.timers.get(name)
+
+    def cancel(self, name):
+        """Cancels the timer known as name, if there is one
+
+        @returns: whether there was one"""
+        timer = self.timers.pop(name, None)
+        if timer is None:
+            return False
+        del timer.slot[name]
+        timer.slot = None
+        self._ungroup(name)
+        if not self.timers:
+            self._stop_ticking()
+        return True
+
+    def cancel_group(self, group):
+        """Cancels all timers whose name is a tuple starting with group
+
+        @returns: how many were cancelled"""
+        names = list(self.groups.get(group, ()))
+        for name in names:
+            self.cancel(name)
+        return len(names)
+
+    def _ungroup(self, name):
+        if isinstance(name, tuple):
+            names = self.groups.get(name[0])
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self.groups[name[0]]
+
+    def _start(self):
+        if self.ticking is None:
+            self.ticking = self.clock.callLater(
+                max(0, self.time_of(self.ticks + 1) - self.clock.seconds()),
+                self._tick)
+
+    def _stop_ticking(self):
+        if self.ticking is not None:
+            if self.ticking.active():
+                self.ticking.cancel()
+            self.ticking = None
+
+    def _tick(self):
+        self.ticking = None
+        now = self._now_tick()
+        while self.ticks < now and self.timers:
+            self.ticks += 1
+            self._cascade()
+            self._expire(self.levels[0][self.ticks % self.size])
+        if self.timers:
+            self._start()
+
+    def _cascade(self):
+        """Moves timers from the coarser levels down as their time nears"""
+        ticks = self.ticks
+        for level in self.levels[1:]:
+            if ticks % self.size:
+                return
+            ticks //= self.size
+            self._replace(level[ticks % self.size])
+        if ticks % self.size == 0:
+            self._replace(self.overflow)
+
+    def _replace(self, slot):
+        timers = slot.values()
+        slot.clear()
+        for timer in timers:
+            self._place(timer)
+
+    def _expire(self, slot):
+        """Fires every timer of a slot at once"""
+        if not slot:
+            return
+        timers = slot.values()
+        slot.clear()
+        for timer in timers:
+            if timer.deadline > self.ticks:
+                # not due yet, wait for it to come round again
+                self._place(timer)
+                continue
+            del self.timers[timer.name]
+            timer.slot = None
+            self._ungroup(timer.name)
+        for timer in timers:
+            if timer.slot is not None:
+                continue
+            try:
+                timer.func(*timer.args, **timer.kwargs)
+            except Exception:
+                log.err(None, "Timer %r failed" % (timer.name,))
+
+    def stop(self):
+        """Cancels every timer"""
+        for slot in [self.overflow] + [s for level in self.levels for s in level]:
+            slot.clear()
+        self.timers.clear()
+        self.groups.clear()
+        self._stop_ticking()
+
+    def __len__(self):
+        return len(self.timers)
+
+    def pending(self):
+        """@returns: list of pending L{Timer}s, soonest first"""
+        return sorted(self.timers.itervalues(), key=lambda t: t.deadline)
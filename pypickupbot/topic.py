@@ -19,24 +19,49 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
-
 """channel topic management"""
 
-from twisted.internet import reactor
+from time import time
+
 from pypickupbot import config
+from pypickupbot import metrics
+from pypickupbot.paginator import safe_cut
+
+WRITES = metrics.counter('pypickupbot_topic_writes_total',
+    'Topic changes sent', ('channel',))
+SUPPRESSED = metrics.counter('pypickupbot_topic_writes_suppressed_total',
+    'Topic updates that sent nothing, because another one was already '
+    'pending or the topic was unchanged', ('channel', 'reason'))
 
 class Topic:
-    """the channel's topic"""
+    """the channel's topic
+
+    Parts are kept in topic order and the topic is rendered once for each
+    change to them. It is only sent when it differs from the channel's,
+    at most once every min write interval seconds. When it is longer than
+    the server's TOPICLEN, parts are left out from the end: those with
+    GRAVITY_END first, then GRAVITY_NONE ones. GRAVITY_BEGINNING parts
+    are kept, the last one left is cut instead.
+
+    @ivar current: the channel's topic, as we last set or saw it
+    @ivar last_write: when we last set it"""
 
     GRAVITY_BEGINNING = 0
     GRAVITY_NONE = 1
     GRAVITY_END = 2
 
-    def __init__(self, bot):
+    def __init__(self, bot, channel=None):
         self.parts = {}
         self.num = 0
-        self.update_call = None
         self.bot = bot
+        if channel is None:
+            channel = bot.channel
+        self.channel = channel
+        self.config = config.ChannelConfig(channel)
+        self.sorted = None
+        self.rendered = None
+        self.current = None
+        self.last_write = None
 
     def add(self, text, gravity=GRAVITY_NONE):
         """Adds something to the topic
@@ -51,6 +76,7 @@ class Topic:
         part = TopicPart(self.num, text, gravity, self)
         self.parts[self.num] = part
         self.num += 1
+        self.sorted = None
         self.update()
         return part
 
@@ -59,35 +85,72 @@ class Topic:
         
         see L{add} for arg reference"""
         del self.parts[num]
+        self.sorted = None
         self.update()
 
     def update(self):
         """updates the channel topic"""
-        if self.update_call != None and self.update_call.active():
-            self.update_call.cancel()
-        self.update_call = reactor.callLater(2, self._update)
+        self.rendered = None
+        timers = self.bot.timers
+        name = ('topic update', self.channel)
+        if timers.get(name) is not None:
+            SUPPRESSED.inc(channel=self.channel, reason='coalesced')
+            return
+        delay = self.config.getfloat('Topic', 'write delay')
+        if self.last_write is not None:
+            delay = max(delay, self.last_write
+                + self.config.getfloat('Topic', 'min write interval') - time())
+        timers.schedule(name, delay, self._update)
 
     def _update(self):
         """actually updates the channel topic
 
         use L{update} instead"""
-        self.bot.setTopic(self.bot.channel, str(self))
+        topic = str(self)
+        if topic == self.current:
+            SUPPRESSED.inc(channel=self.channel, reason='unchanged')
+            return
+        self.current = topic
+        self.last_write = time()
+        WRITES.inc(channel=self.channel)
+        self.bot.setTopic(self.channel, topic)
+
+    def seen(self, topic):
+        """The channel's topic was set, by us or someone else"""
+        self.current = topic
 
     def __str__(self):
-        sorted_topic = {
-                self.__class__.GRAVITY_BEGINNING : {},
-                self.__class__.GRAVITY_NONE : {},
-                self.__class__.GRAVITY_END : {},
-            }
-        as_list = []
-        for num, part in self.parts.iteritems():
-            s = str(part)
-            if len(s) > 0:
-                sorted_topic[part.gravity][num] = s
-        for i in [self.GRAVITY_BEGINNING, self.GRAVITY_NONE, self.GRAVITY_END]:
-            as_list.extend(sorted_topic[i].values())
-
-        return config.get('Topic', 'prefix').decode('string-escape') + config.get('Topic', 'separator').decode('string-escape').join(as_list) + config.get('Topic', 'suffix').decode('string-escape')
+        key = (config.generation, self.bot.supported.getFeature('TOPICLEN'))
+        if self.rendered is None or self.rendered[0] != key:
+            self.rendered = key, self.render(key[1])
+        return self.rendered[1]
+
+    def render(self, limit=None):
+        """@param limit: longest topic the server takes, if known
+        @returns: the topic as str"""
+        if self.sorted is None:
+            self.sorted = sorted(self.parts.itervalues(),
+                key=lambda part: (part.gravity, part.num))
+        parts = [(part.gravity, text) for part, text
+            in ((part, str(part)) for part in self.sorted) if text]
+        texts = [text for gravity, text in parts]
+        prefix = self.config.getescaped('Topic', 'prefix')
+        separator = self.config.getescaped('Topic', 'separator')
+        suffix = self.config.getescaped('Topic', 'suffix')
+        if limit:
+            length = len(prefix) + len(suffix) + sum(map(len, texts)) \
+                + len(separator) * max(0, len(texts) - 1)
+            while length > limit and len(texts) > 1 \
+                    and parts[len(texts) - 1][0] != self.GRAVITY_BEGINNING:
+                length -= len(texts.pop()) + len(separator)
+            if length > limit and texts and len(texts[-1]) > length - limit:
+                # what is left can't be left out, cut the last part
+                texts[-1] = texts[-1][:safe_cut(texts[-1],
+                    len(texts[-1]) - (length - limit))]
+        topic = prefix + separator.join(texts) + suffix
+        if limit and len(topic) > limit:
+            topic = topic[:safe_cut(topic, limit)]
+        return topic
 
 class TopicPart:
     """part of the channel's topic"""
@@ -99,8 +162,9 @@ class TopicPart:
 
     def update(self, text, gravity=None):
         self.text = text
-        if gravity != None:
+        if gravity != None and gravity != self.gravity:
             self.gravity = gravity
+            self.topic.sorted = None
         self.topic.update()
         return self
 
@@ -110,4 +174,3 @@ class TopicPart:
 
     def __str__(self):
         return self.text
-